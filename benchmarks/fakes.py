@@ -0,0 +1,265 @@
+import ctypes
+import random
+import time
+
+
+class FakeRect(object):
+
+    def __init__(self, x, y, width, height):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+
+class FakeCon(object):
+
+    def __init__(self, id, rect, focused=False, nodes=None, num=None,
+                 name=None):
+        self.id = id
+        self.rect = rect
+        self.focused = focused
+        self.nodes = nodes or []
+        self.num = num
+        self.name = name
+        self.type = 'workspace' if num is not None else 'con'
+        self.parent = None
+        for node in self.nodes:
+            node.parent = self
+
+    def leaves(self):
+        if not self.nodes:
+            return [self]
+        return [leaf for node in self.nodes for leaf in node.leaves()]
+
+    def workspace(self):
+        con = self
+        while con is not None and con.num is None:
+            con = con.parent
+        return con
+
+    def descendants(self):
+        for node in self.nodes:
+            yield node
+            yield from node.descendants()
+
+    def workspaces(self):
+        return [con for con in self.descendants() if con.num is not None]
+
+    def find_focused(self):
+        for con in self.descendants():
+            if con.focused:
+                return con
+        return None
+
+
+# The raw i3 IPC form of a container, as found in trees and event payloads
+def to_ipc(con, type=None):
+    rect = con.rect
+    return {
+        'id': con.id,
+        'type': type or con.type,
+        'num': con.num,
+        'name': con.name,
+        'focused': con.focused,
+        'rect': {'x': rect.x, 'y': rect.y, 'width': rect.width,
+                 'height': rect.height},
+        'nodes': [to_ipc(node) for node in con.nodes],
+        'floating_nodes': []
+    }
+
+
+class FakeEvent(object):
+    """Workspace and window events as i3ipc hands them to handlers"""
+
+    def __init__(self, change, current=None, old=None, container=None):
+        self.change = change
+        self.current = current
+        self.old = old
+        self.container = container
+
+
+class FakeOutput(object):
+
+    def __init__(self, name, rect, current_workspace):
+        self.name = name
+        self.rect = rect
+        self.active = True
+        self.current_workspace = current_workspace
+
+
+class FakeI3(object):
+    """Stands in for i3ipc.aio.Connection with a single output and a fixed
+    number of workspaces, each holding a few tiled windows"""
+
+    def __init__(self, workspaces, width, height, windows=3):
+        self.width = width
+        self.height = height
+        self.focused = 1
+        # workspace number -> id of its focused window, the first by default
+        self.focused_windows = {}
+        self.handlers = {}
+        self.commands = []
+        self.tree_requests = 0
+        self.workspace_nums = list(range(1, workspaces + 1))
+        self.windows = windows
+        # workspace number -> [(window id, FakeRect)] replacing the default
+        # side by side layout
+        self.layouts = {}
+
+    def layout(self, num):
+        if num in self.layouts:
+            return self.layouts[num]
+
+        width = self.width // self.windows
+        return [(num * 1000 + i, FakeRect(i * width, 0, width, self.height))
+                for i in range(self.windows)]
+
+    def build_workspace(self, num):
+        layout = self.layout(num)
+        focused = self.focused_windows.get(num, layout[0][0] if layout else None)
+        leaves = [FakeCon(con_id, rect,
+                          focused=(num == self.focused and con_id == focused))
+                  for con_id, rect in layout]
+        return FakeCon(num, FakeRect(0, 0, self.width, self.height),
+                       nodes=leaves, num=num, name=str(num))
+
+    def build_tree(self):
+        workspaces = [self.build_workspace(num) for num in self.workspace_nums]
+        return FakeCon(0, FakeRect(0, 0, self.width, self.height),
+                       nodes=workspaces)
+
+    # Focus another workspace, returning the event i3 would send for it
+    def focus(self, num):
+        old = self.focused
+        self.focused = num
+        return FakeEvent('focus', current=self.build_workspace(num),
+                         old=self.build_workspace(old)
+                         if old in self.workspace_nums else None)
+
+    def focus_window(self, num, con_id):
+        self.focused = num
+        self.focused_windows[num] = con_id
+        rect = dict(self.layout(num))[con_id]
+        return FakeEvent('focus', container=FakeCon(con_id, rect, True))
+
+    # Open a window to the right of the others, squeezing them together
+    def open_window(self, num, con_id):
+        ids = [con_id for con_id, _ in self.layout(num)] + [con_id]
+        width = self.width // len(ids)
+        self.layouts[num] = [(i, FakeRect(n * width, 0, width, self.height))
+                             for n, i in enumerate(ids)]
+        return FakeEvent('new', container=FakeCon(
+            con_id, self.layouts[num][-1][1]))
+
+    async def get_tree(self):
+        self.tree_requests += 1
+        return self.build_tree()
+
+    async def get_outputs(self):
+        rect = FakeRect(0, 0, self.width, self.height)
+        return [FakeOutput('fake-0', rect, str(self.focused))]
+
+    def ipc_tree(self):
+        return to_ipc(self.build_tree(), 'root')
+
+    def ipc_outputs(self):
+        return [{'name': 'fake-0', 'active': True,
+                 'current_workspace': str(self.focused),
+                 'rect': {'x': 0, 'y': 0, 'width': self.width,
+                          'height': self.height}}]
+
+    async def command(self, command):
+        self.commands.append(command)
+        return []
+
+    def on(self, event, handler):
+        self.handlers[event] = handler
+
+    async def connect(self):
+        return self
+
+    # There are no events to wait for, the daemon stops right away
+    async def main(self):
+        pass
+
+
+class FakeCaptureLib(object):
+    """Stands in for prtscn.so, filling captures with a noisy pattern that
+    compresses roughly like desktop content. Probes report which workspace is
+    on screen, so switch() can simulate a workspace that takes a while to
+    redraw: the old workspace stays up for the first half of its settle time
+    and the new one is drawn from the top down during the second half."""
+
+    def __init__(self, seed=0):
+        rng = random.Random(seed)
+        block = bytearray()
+        while len(block) < 1 << 16:
+            block += bytes([rng.randrange(256)] * rng.randrange(1, 64))
+        self.block = bytes(block[:1 << 16])
+        self.patterns = {}
+        self.captures = 0
+        self.bytes_captured = 0
+        self.shown = None
+        self.transition = None
+        self.last_state = None
+        self.captured_at = None
+
+    def pattern(self, length):
+        if length not in self.patterns:
+            repeats = length // len(self.block) + 1
+            self.patterns[length] = (self.block * repeats)[:length]
+        return self.patterns[length]
+
+    def switch(self, num, settle):
+        now = time.perf_counter()
+        self.transition = (self.state()[-1], num, now + settle / 2,
+                           now + settle)
+
+    # ('shown', num) once settled, ('torn', old, drawn fraction, new) while
+    # redrawing
+    def state(self):
+        if self.transition is not None:
+            old, new, torn_at, settled_at = self.transition
+            now = time.perf_counter()
+            if now < torn_at:
+                return ('shown', old)
+            if now < settled_at:
+                drawn = (now - torn_at) / (settled_at - torn_at)
+                return ('torn', old, drawn, new)
+            self.shown = new
+            self.transition = None
+        return ('shown', self.shown)
+
+    def initCapture(self):
+        return 1
+
+    def getBackend(self):
+        return 1
+
+    def closeCapture(self):
+        pass
+
+    def getScreen32(self, x, y, w, h, data):
+        length = w * h * 4
+        ctypes.memmove(data, self.pattern(length), length)
+        self.captures += 1
+        self.bytes_captured += length
+        self.last_state = self.state()
+        self.captured_at = time.perf_counter()
+        return 0
+
+    def getProbe32(self, x, y, w, h, pw, ph, data):
+        state = self.state()
+        rows = [state[-1]] * ph
+        if state[0] == 'torn':
+            drawn = round(ph * state[2])
+            rows[drawn:] = [state[1]] * (ph - drawn)
+
+        probe = b''.join(bytes([(num or 0) * 37 % 256] * 3 + [0xff]) * pw
+                         for num in rows)
+        ctypes.memmove(data, probe, len(probe))
+        return 0
+
+    def getRegion32(self, x, y, w, h, data):
+        return self.getScreen32(x, y, w, h, data)
@@ -0,0 +1,473 @@
+"""Replay a trace of i3 events against the daemon, to see how capture
+scheduling copes with a given workload and compare changes on the same one.
+
+Record a trace with the daemon, or generate one of rapid workspace cycling
+(cycle) or scripted window spawning (spawn):
+
+    i3expod --record trace.jsonl
+    python -m benchmarks.replay --generate cycle trace.jsonl
+
+Then replay it at recorded speed, faster, or with --speed 0 as fast as the
+daemon takes the events, with settings changed as needed:
+
+    python -m benchmarks.replay trace.jsonl --speed 4 \\
+        --set Daemon.debounce_mode=leading --output report.json
+
+The daemon runs as usual, headless, with a connection that answers from the
+trace and the fake capture library. The report has event handling throughput
+and lag, the backlog of changes not yet in a thumbnail, captures per event
+and how long each change took to reach the thumbnail of its workspace, per
+workspace the trace touched. Changes no thumbnail shows once the daemon is
+idle again count as stale until then.
+"""
+
+import os
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
+
+from benchmarks.fakes import FakeCaptureLib, FakeI3, to_ipc
+from i3expo import daemon
+from i3expo.trace import read_trace
+from i3ipc import Con
+from i3ipc.events import WorkspaceEvent, WindowEvent, OutputEvent, \
+    ShutdownEvent
+from i3ipc.replies import OutputReply
+from threading import Lock
+
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import tempfile
+import time
+
+EVENTS = {
+    'workspace': lambda data, conn: WorkspaceEvent(data, conn),
+    'window': lambda data, conn: WindowEvent(data, conn),
+    'output': lambda data, conn: OutputEvent(data),
+    'shutdown': lambda data, conn: ShutdownEvent(data)
+}
+
+parser = argparse.ArgumentParser(
+    description="Replay a trace of i3 events against the daemon")
+parser.add_argument("trace", help="Trace recorded with i3expod --record")
+parser.add_argument("-g", "--generate", choices=['cycle', 'spawn'],
+                    help="Write a synthetic trace to TRACE instead")
+parser.add_argument("-n", "--events", type=int, default=200,
+                    help="Events of a generated trace (default: 200)")
+parser.add_argument("--rate", type=float, default=50,
+                    help="Events per second of a generated trace "
+                    "(default: 50)")
+parser.add_argument("-w", "--workspaces", type=int, default=9,
+                    help="Workspaces of a generated trace (default: 9)")
+parser.add_argument("-s", "--speed", type=float, default=1.0,
+                    help="Replay speed, 0 sends events without waiting "
+                    "(default: 1)")
+parser.add_argument("--redraw", type=float, default=0.05,
+                    help="Seconds a workspace takes to redraw after being "
+                    "focused (default: 0.05)")
+parser.add_argument("--set", action="append", default=[],
+                    metavar="SECTION.KEY=VALUE",
+                    help="Change a setting of the daemon, can be repeated")
+parser.add_argument("--drain", type=float, default=10.0,
+                    help="Seconds to wait for captures after the last event "
+                    "(default: 10)")
+parser.add_argument("-o", "--output", help="Write the report as JSON")
+
+
+class Staleness(object):
+    """Changes to each workspace that its thumbnail does not show yet. A
+    capture shows every change made before the screen was grabbed. Windows
+    opening, closing or moving are changes, and so is a workspace without a
+    thumbnail being focused."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.pending = {}
+        self.captured_nums = set()
+        # workspace number -> delays of its changes that reached a thumbnail
+        self.delays = {}
+        self.touched = set()
+
+    def changed(self, num, at):
+        with self.lock:
+            self.touched.add(num)
+            self.pending.setdefault(num, []).append(at)
+
+    def focused(self, num, at):
+        with self.lock:
+            self.touched.add(num)
+            if num not in self.captured_nums and not self.pending.get(num):
+                self.pending[num] = [at]
+
+    def captured(self, num, grabbed, now):
+        with self.lock:
+            self.captured_nums.add(num)
+            pending = self.pending.get(num, [])
+            self.delays.setdefault(num, []).extend(
+                now - t for t in pending if t <= grabbed)
+            self.pending[num] = [t for t in pending if t > grabbed]
+
+    def backlog(self):
+        with self.lock:
+            return sum(len(pending) for pending in self.pending.values())
+
+    # Every workspace the trace touched, with the changes no thumbnail showed
+    # by the end counted as stale until then
+    def summary(self, end):
+        with self.lock:
+            workspaces = {}
+            for num in sorted(self.touched):
+                shown = self.delays.get(num, [])
+                unserved = [end - t for t in self.pending.get(num, [])]
+                workspaces[num] = {
+                    'changes': len(shown) + len(unserved),
+                    'unserved': len(unserved),
+                    'staleness': distribution(shown + unserved)
+                }
+            shown = [d for delays in self.delays.values() for d in delays]
+            unserved = [end - t for pending in self.pending.values()
+                        for t in pending]
+
+        return {
+            'all': distribution(shown + unserved),
+            'shown': distribution(shown),
+            'unserved': len(unserved),
+            'workspaces': workspaces
+        }
+
+
+class TraceI3(object):
+    """Stands in for i3ipc.aio.Connection, answering with the trees and
+    outputs of a trace. main() sends the trace's events to the handlers at
+    their recorded times and returns once the daemon is idle again."""
+
+    def __init__(self, start, events, grab, speed=1.0, redraw=0.05,
+                 drain=10.0):
+        self.events = events
+        self.grab = grab
+        self.speed = speed
+        self.redraw = redraw
+        self.drain = drain
+        self.tree = start['tree']
+        self.outputs = start['outputs']
+        self.layouts = start['layouts']
+        self.subscriptions = []
+        self.handlers = set()
+        self.commands = []
+        self.tree_requests = 0
+
+        self.staleness = Staleness()
+        self.lag = []
+        self.handler_seconds = []
+        self.backlog = []
+        self.failed = 0
+        self.before = None
+        self.sent = None
+        self.idle = None
+        self.end = None
+
+    async def connect(self):
+        return self
+
+    async def get_tree(self):
+        self.tree_requests += 1
+        return Con(self.tree, None, self)
+
+    async def get_outputs(self):
+        return [OutputReply(output) for output in self.outputs]
+
+    async def command(self, command):
+        self.commands.append(command)
+        return []
+
+    def on(self, event, handler):
+        event, _, detail = event.partition('::')
+        self.subscriptions.append((event, detail, handler))
+
+    # Handlers run on tasks of their own, as with i3ipc
+    def emit(self, entry, due):
+        e = EVENTS[entry['event']](entry['data'], self)
+        for event, detail, handler in self.subscriptions:
+            if event == entry['event'] and detail in ['', e.change]:
+                task = asyncio.ensure_future(self.handle(handler, e, due))
+                self.handlers.add(task)
+                task.add_done_callback(self.handlers.discard)
+
+    async def handle(self, handler, e, due):
+        start = time.perf_counter()
+        self.lag.append(start - due)
+        try:
+            if asyncio.iscoroutinefunction(handler):
+                await handler(self, e)
+            else:
+                handler(self, e)
+        except Exception:
+            logging.exception("Handler failed")
+            self.failed += 1
+        self.handler_seconds.append(time.perf_counter() - start)
+
+    async def main(self):
+        # The daemon's own loops run until it exits
+        loops = set(daemon.background_tasks)
+        self.before = count_work(self)
+
+        layouts = self.layouts
+        start = time.perf_counter()
+        for entry in self.events:
+            if self.speed:
+                due = start + entry['t'] / self.speed
+                await asyncio.sleep(max(0, due - time.perf_counter()))
+            else:
+                await asyncio.sleep(0)
+                due = time.perf_counter()
+
+            self.tree = entry['tree']
+            self.outputs = entry['outputs']
+            now = time.perf_counter()
+            for num, layout in entry['layouts'].items():
+                if layouts.get(num) != layout:
+                    self.staleness.changed(num, now)
+            layouts = entry['layouts']
+            if entry['focused'] is not None:
+                self.staleness.focused(entry['focused'], now)
+            self.backlog.append(self.staleness.backlog())
+            if entry['event'] == 'workspace' \
+                    and entry['data']['change'] == 'focus':
+                self.grab.switch(entry['focused'], self.redraw)
+            self.emit(entry, due)
+        self.sent = time.perf_counter() - start
+
+        await self.wait_idle(loops)
+        self.end = time.perf_counter()
+        self.idle = self.end - start
+
+    # Wait until the handlers of every event ran and nothing they scheduled
+    # is left: no debounced call, pending update or capture. The daemon has
+    # to stay idle for a few polls, as one step can schedule the next.
+    async def wait_idle(self, loops, polls=3):
+        deadline = time.perf_counter() + self.drain
+        idle = 0
+        while time.perf_counter() < deadline:
+            busy = self.handlers \
+                or daemon.pending_update is not None \
+                or daemon.update_lock.locked() \
+                or daemon.background_tasks - loops \
+                or any(d.t is not None for d in daemon.debouncers.values())
+            idle = 0 if busy else idle + 1
+            if idle == polls:
+                return
+            await asyncio.sleep(0.01)
+        logging.warning("Daemon still busy %s s after the last event",
+                        self.drain)
+
+
+def get_focused(root):
+    focused = root.find_focused()
+    if focused is None or focused.workspace() is None:
+        return None
+    return focused.workspace().num
+
+
+# Where the windows of every workspace are
+def get_layouts(root):
+    return {w.num: [(c.id, c.rect.x, c.rect.y, c.rect.width, c.rect.height)
+                    for c in w.leaves()]
+            for w in root.workspaces()}
+
+
+def count_work(i3):
+    return {
+        'captures': i3.grab.captures,
+        'kinds': daemon.captures_taken.collect(),
+        'skipped': daemon.captures_skipped.collect(),
+        'tree_requests': i3.tree_requests
+    }
+
+
+# Captures change the thumbnails of a workspace through put()
+def track_thumbnails(i3):
+    put = daemon.thumbnails.put
+
+    def put_and_track(num, *args, **kwargs):
+        result = put(num, *args, **kwargs)
+        if i3.grab.captured_at is not None:
+            i3.staleness.captured(num, i3.grab.captured_at,
+                                  time.perf_counter())
+        return result
+
+    daemon.thumbnails.put = put_and_track
+
+
+def distribution(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        'median_ms': statistics.median(values) * 1000,
+        'p95_ms': values[min(len(values) - 1, int(len(values) * 0.95))]
+        * 1000,
+        'max_ms': values[-1] * 1000
+    }
+
+
+def difference(after, before):
+    return {dict(key).popitem()[1] if key else '': value - before.get(key, 0)
+            for key, value in after.items() if value != before.get(key, 0)}
+
+
+def report(i3):
+    before = i3.before
+    after = count_work(i3)
+    events = len(i3.events)
+    captures = after['captures'] - before['captures']
+
+    return {
+        'events': events,
+        'failed': i3.failed,
+        'sent_s': i3.sent,
+        'idle_s': i3.idle,
+        'throughput_per_s': events / i3.idle if i3.idle else None,
+        'handler_capacity_per_s': events / sum(i3.handler_seconds)
+        if sum(i3.handler_seconds) else None,
+        'lag': distribution(i3.lag),
+        'handler': distribution(i3.handler_seconds),
+        'backlog': {
+            'mean': statistics.mean(i3.backlog) if i3.backlog else 0,
+            'max': max(i3.backlog, default=0),
+            'left': i3.staleness.backlog()
+        },
+        'captures': captures,
+        'captures_per_event': captures / events if events else None,
+        'captures_by_kind': difference(after['kinds'], before['kinds']),
+        'skipped': difference(after['skipped'], before['skipped']),
+        'tree_requests_per_event':
+        (after['tree_requests'] - before['tree_requests']) / events
+        if events else None,
+        'debounce': {e: d.stats() for e, d in daemon.debouncers.items()},
+        'staleness': i3.staleness.summary(i3.end)
+    }
+
+
+def replay(path, speed=1.0, redraw=0.05, overrides=(), drain=10.0):
+    start, events = read_trace(path)
+    for entry in [start] + events:
+        root = Con(entry['tree'], None, None)
+        entry['focused'] = get_focused(root)
+        entry['layouts'] = get_layouts(root)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        daemon.config_path = os.path.join(tmp, 'config')
+        daemon.control.get_socket_path = lambda: os.path.join(tmp, 'sock')
+
+        # Same steps as daemon.main(), with the fakes
+        daemon.read_config()
+        for setting in overrides:
+            key, value = setting.split('=', 1)
+            section, option = key.split('.', 1)
+            daemon.config.set(section, option, value)
+        daemon.load_settings()
+        daemon.configure_thumbnails()
+        daemon.configure_render_pool()
+        daemon.grab = FakeCaptureLib()
+
+        i3 = TraceI3(start, events, daemon.grab, speed, redraw, drain)
+        daemon.i3ipc.aio.Connection = lambda **kwargs: i3
+        track_thumbnails(i3)
+        asyncio.run(daemon.run(time.perf_counter()))
+
+    return report(i3)
+
+
+def ipc_event(e):
+    if e.container is not None:
+        return 'window', {'change': e.change,
+                          'container': to_ipc(e.container)}
+    return 'workspace', {
+        'change': e.change,
+        'current': to_ipc(e.current),
+        'old': to_ipc(e.old) if e.old is not None else None
+    }
+
+
+# Focus every workspace in turn
+def cycle_events(i3):
+    while True:
+        for num in i3.workspace_nums[1:] + i3.workspace_nums[:1]:
+            yield i3.focus(num)
+
+
+# Open a few windows on every workspace in turn, each taking focus
+def spawn_events(i3):
+    con_id = 100000
+    while True:
+        for num in i3.workspace_nums:
+            if num != i3.focused:
+                yield i3.focus(num)
+            for _ in range(4):
+                con_id += 1
+                yield i3.open_window(num, con_id)
+                yield i3.focus_window(num, con_id)
+
+
+def generate(kind, path, events=200, rate=50, workspaces=9, width=1920,
+             height=1080):
+    i3 = FakeI3(workspaces, width, height)
+    source = {'cycle': cycle_events, 'spawn': spawn_events}[kind](i3)
+
+    with open(path, 'w') as f:
+        f.write(json.dumps({'t': 0.0, 'tree': i3.ipc_tree(),
+                            'outputs': i3.ipc_outputs()}) + '\n')
+        for n in range(events):
+            event, data = ipc_event(next(source))
+            f.write(json.dumps({
+                't': (n + 1) / rate, 'event': event, 'data': data,
+                'tree': i3.ipc_tree(), 'outputs': i3.ipc_outputs()
+            }) + '\n')
+
+
+def print_report(result):
+    print(f"{result['events']} events sent in {result['sent_s']:.2f} s, "
+          f"idle after {result['idle_s']:.2f} s, "
+          f"{result['throughput_per_s']:.1f} events/s")
+    staleness = result['staleness']
+    for key, d in [('lag', result['lag']), ('handler', result['handler']),
+                   ('staleness', staleness['all']),
+                   ('shown', staleness['shown'])]:
+        if d is not None:
+            print(f"{key:10} median {d['median_ms']:8.2f} ms  "
+                  f"p95 {d['p95_ms']:8.2f} ms  max {d['max_ms']:8.2f} ms")
+    for num, workspace in staleness['workspaces'].items():
+        d = workspace['staleness']
+        if d is not None:
+            print(f"{'ws ' + str(num):10} {workspace['changes']:3} changes, "
+                  f"{workspace['unserved']:3} never shown, "
+                  f"max {d['max_ms']:8.2f} ms")
+    backlog = result['backlog']
+    print(f"backlog    mean {backlog['mean']:.1f}  max {backlog['max']}  "
+          f"left {backlog['left']}")
+    print(f"captures   {result['captures']} "
+          f"({result['captures_per_event']:.2f} per event) "
+          f"{result['captures_by_kind']}, skipped {result['skipped']}")
+    print(f"tree requests per event "
+          f"{result['tree_requests_per_event']:.2f}")
+
+
+def main(argv=None):
+    options = parser.parse_args(argv)
+    if options.generate:
+        generate(options.generate, options.trace, options.events,
+                 options.rate, options.workspaces)
+        return
+
+    result = replay(options.trace, options.speed, options.redraw,
+                    options.set, options.drain)
+    print_report(result)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
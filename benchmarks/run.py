@@ -0,0 +1,563 @@
+"""Benchmarks for the capture, render and UI paths of the daemon.
+
+Everything runs headless: pygame uses the SDL dummy video driver, captures
+come from a fake prtscn.so and i3 is replaced by a fake connection. Results
+are printed as a table and can be written as JSON to compare releases:
+
+    python -m benchmarks.run --output results.json
+"""
+
+import os
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
+
+from benchmarks.fakes import FakeCaptureLib, FakeI3
+from i3expo import daemon
+from i3expo.damage import Rect
+from i3expo.live import FramePacer
+from i3expo.persist import ThumbnailCache
+from i3expo.settle import SettleTracker
+from i3expo.tree import TreeModel
+from i3expo.windows import compose, crop_windows, get_layout
+
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import pygame
+
+WORKSPACES = [9, 30, 100]
+RESOLUTIONS = {
+    '1080p': (1920, 1080),
+    '1440p': (2560, 1440),
+    '4k': (3840, 2160)
+}
+
+parser = argparse.ArgumentParser(description="Benchmark the i3expo daemon")
+parser.add_argument("-o", "--output", help="Write results as JSON to a file")
+parser.add_argument("-r", "--repeat", type=int, default=5,
+                    help="Runs per benchmark (default: 5)")
+parser.add_argument("-q", "--quick", action="store_true",
+                    help="Only run 9 workspaces at 1080p")
+parser.add_argument("-k", "--filter", default='',
+                    help="Only run benchmarks whose name contains this")
+
+
+def measure(f, repeat, setup=None):
+    timings = []
+    tracemalloc.start()
+    try:
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            tracemalloc.reset_peak()
+            start = time.perf_counter()
+            f()
+            timings.append(time.perf_counter() - start)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    median = statistics.median(timings)
+    return {
+        'repeat': repeat,
+        'median_ms': median * 1000,
+        'mean_ms': statistics.mean(timings) * 1000,
+        'min_ms': min(timings) * 1000,
+        'max_ms': max(timings) * 1000,
+        'ops_per_s': 1 / median if median > 0 else None,
+        'py_peak_kb': peak / 1024
+    }
+
+
+# Surfaces kept alive by the tiles of an overview, which measure() cannot see
+# since pygame allocates pixels outside of the Python heap
+def tile_surfaces(tiles):
+    surfaces = {id(v): v for t in tiles for v in t.values()
+                if isinstance(v, pygame.Surface)}
+    return {
+        'tile_surfaces': len(surfaces),
+        'tile_surface_kb': sum(s.get_bytesize() * s.get_width() *
+                               s.get_height()
+                               for s in surfaces.values()) / 1024
+    }
+
+
+# Capture buffers taken from the pool and newly allocated per call of a
+# benchmark, to see whether full frames are still allocated on every capture
+def with_buffers(run_bench):
+    def run():
+        pool = daemon.capture_buffers
+        before = dict(pool.stats)
+        result = run_bench()
+        calls = result['repeat']
+        for key, name, scale in [('acquired', 'buffers_acquired', 1),
+                                 ('allocations', 'buffer_allocations', 1),
+                                 ('allocated_bytes', 'buffer_allocated_kb',
+                                  1 / 1024)]:
+            result[name] = (pool.stats[key] - before[key]) * scale / calls
+        return result
+    return run
+
+
+def reset_daemon(config_dir, workspaces, size):
+    width, height = size
+
+    daemon.config_path = os.path.join(config_dir, 'config')
+    daemon.read_config()
+    daemon.config.set('UI', 'window_width', str(width))
+    daemon.config.set('UI', 'window_height', str(height))
+    daemon.config.set('UI', 'workspaces', str(workspaces))
+    daemon.config.set('UI', 'grid_x', str(math.ceil(math.sqrt(workspaces))))
+    daemon.load_settings()
+    daemon.configure_thumbnails()
+    daemon.configure_render_pool()
+
+    for num in list(daemon.thumbnails.keys()):
+        daemon.thumbnails.remove(num)
+    daemon.knowledge.clear()
+    daemon.tree = TreeModel()
+    daemon.window_images.clear()
+    daemon.capture_buffers.clear()
+    daemon.render_cache.clear()
+    daemon.invalidate_overview()
+
+    daemon.grab = FakeCaptureLib()
+    daemon.i3 = FakeI3(workspaces, width, height)
+    return daemon.i3
+
+
+def populate(i3):
+    tree = i3.build_tree()
+    rect = Rect(0, 0, i3.width, i3.height)
+    for workspace in tree.workspaces():
+        daemon.update_workspace(workspace)
+        daemon.capture_workspace(rect, workspace)
+
+
+def bench_capture(size, repeat):
+    width, height = size
+    rect = Rect(0, 0, width, height)
+    workspace = daemon.i3.build_tree().workspaces()[0]
+    raw = daemon.grab_screen(rect)
+    sizes = daemon.get_thumbnail_sizes()
+    thumb = daemon.thumbnails.get(workspace.num)
+
+    def grab():
+        daemon.capture_buffers.release(daemon.grab_screen(rect)[2])
+
+    # Steady state, with a buffer waiting in the pool as after the first
+    # capture
+    grab()
+    yield 'capture.grab_screen', with_buffers(lambda: measure(grab, repeat))
+    yield 'capture.thumbnail', lambda: measure(
+        lambda: daemon.thumbnails.put(workspace.num, raw, sizes), repeat)
+    yield 'capture.capture_workspace', with_buffers(lambda: measure(
+        lambda: daemon.capture_workspace(rect, workspace), repeat))
+    yield 'capture.process_image', lambda: measure(
+        lambda: daemon.process_image(thumb), repeat)
+
+    # Redraw a hidden workspace whose windows swapped places from the images
+    # of its windows, instead of capturing it again
+    layout = get_layout(workspace)
+    swapped = dict(zip(layout, reversed(list(layout.values()))))
+
+    def recompose():
+        largest = daemon.thumbnails.get_largest(workspace.num)
+        crops = crop_windows(largest, rect, layout)
+        composed = compose(largest, rect, layout, swapped, crops, (0, 0, 0))
+        daemon.thumbnails.put(workspace.num, composed, sizes, mode='RGB')
+
+    yield 'capture.recompose', lambda: measure(recompose, repeat)
+
+    # Save every thumbnail to a cache on disk and restore them all, as after
+    # a restart of the daemon
+    workspaces = daemon.i3.build_tree().workspaces()
+
+    def persisted(f):
+        with tempfile.TemporaryDirectory() as path:
+            cache = ThumbnailCache(path)
+            cache.open()
+            daemon.thumbnail_cache = cache
+            try:
+                for w in workspaces:
+                    daemon.persist_thumbnail(w)
+                cache.writer.submit(lambda: None).result()
+                return f(cache)
+            finally:
+                daemon.thumbnail_cache = None
+                cache.close()
+
+    def write(cache):
+        return measure(lambda: [daemon.persist_thumbnail(w).result()
+                                for w in workspaces], repeat)
+
+    def restore(cache):
+        return measure(lambda: daemon.restore_thumbnails(workspaces), repeat,
+                       setup=lambda: [daemon.thumbnails.remove(w.num)
+                                      for w in workspaces])
+
+    yield 'capture.persist_write', lambda: persisted(write)
+    yield 'capture.persist_restore', lambda: persisted(restore)
+
+
+def bench_render(size, repeat):
+    width, height = size
+    screen = pygame.Surface(size)
+    g = daemon.init_geometry(width, height)
+    image = daemon.process_image(daemon.thumbnails.get(1))
+    tiles = daemon.init_tiles(screen)
+
+    yield 'render.init_geometry', lambda: measure(
+        lambda: daemon.init_geometry(width, height), repeat)
+    yield 'render.autosize_image', lambda: measure(
+        lambda: daemon.autosize_image(g, image), repeat)
+    yield 'render.init_tiles', lambda: measure(
+        lambda: daemon.init_tiles(screen), repeat)
+    yield 'render.draw_tiles_cold', lambda: measure(
+        lambda: daemon.draw_tiles(screen, tiles, g), repeat,
+        setup=daemon.render_cache.clear)
+    yield 'render.draw_tiles_warm', lambda: measure(
+        lambda: daemon.draw_tiles(screen, tiles, g), repeat)
+
+    # Cold draws on a single render thread, to compare against the pool
+    def serial(f):
+        threads = daemon.config.get('UI', 'render_threads')
+        daemon.config.set('UI', 'render_threads', '1')
+        daemon.load_settings()
+        daemon.configure_render_pool()
+        try:
+            return f()
+        finally:
+            daemon.config.set('UI', 'render_threads', threads)
+            daemon.load_settings()
+            daemon.configure_render_pool()
+
+    yield 'render.draw_tiles_cold_serial', lambda: serial(lambda: measure(
+        lambda: daemon.draw_tiles(screen, tiles, g), repeat,
+        setup=daemon.render_cache.clear))
+
+
+def bench_ui(size, repeat):
+    width, height = size
+
+    def overview_cold():
+        result = measure(daemon.refresh_overview, repeat, setup=lambda: (
+            daemon.render_cache.clear(), daemon.invalidate_overview()))
+        result.update(tile_surfaces(daemon.overview['tiles']))
+        return result
+
+    yield 'ui.refresh_overview_cold', overview_cold
+    yield 'ui.refresh_overview_warm', lambda: measure(
+        daemon.refresh_overview, repeat)
+
+    current = daemon.refresh_overview()
+    tiles = current['tiles']
+    g = current['geometry']
+    rng = random.Random(0)
+    positions = [(rng.randrange(width), rng.randrange(height))
+                 for _ in range(1000)]
+
+    def hover():
+        for mpos in positions:
+            daemon.get_hovered_frame(mpos, tiles, g)
+
+    def hover_result():
+        result = measure(hover, repeat)
+        result['calls'] = len(positions)
+        return result
+
+    yield 'ui.get_hovered_frame', hover_result
+
+    screen = pygame.Surface(size)
+    screen.blit(current['surface'], (0, 0))
+
+    # Move the highlight across every tile, as hovering over the grid does
+    def highlight():
+        for tile in tiles:
+            daemon.highlight_tile(screen, tile, True, g)
+            daemon.highlight_tile(screen, tile, False, g)
+
+    yield 'ui.highlight_tile', lambda: measure(highlight, repeat)
+
+    # Live tiles for workspaces shown on two other outputs, drawn straight
+    # from captures sampled down to the tile size
+    def live_setup():
+        daemon.live_targets.clear()
+        for t in tiles[:2]:
+            daemon.live_targets[t['ws_num']] = Rect(0, 0, width, height)
+
+    def live_frame():
+        live_setup()
+        try:
+            return measure(
+                lambda: daemon.draw_live_tiles(screen, tiles, g), repeat)
+        finally:
+            daemon.live_targets.clear()
+
+    # Paced like the input loop does, with nothing else to do in between
+    def live_paced(seconds=0.5, fps=30):
+        live_setup()
+        pacer = FramePacer(fps, 0.25)
+        end = time.perf_counter() + seconds
+        try:
+            while time.perf_counter() < end:
+                time.sleep(pacer.timeout())
+                start = time.perf_counter()
+                daemon.draw_live_tiles(screen, tiles, g)
+                pacer.record(start, time.perf_counter())
+        finally:
+            daemon.live_targets.clear()
+
+        stats = pacer.stats()
+        return {
+            'repeat': stats['frames'],
+            'median_ms': stats['median_frame_ms'],
+            'max_ms': stats['max_frame_ms'],
+            'fps': stats['fps'],
+            'target_fps': stats['target_fps'],
+            'budget_ms': stats['budget_ms'],
+            'over_budget': stats['over_budget']
+        }
+
+    yield 'ui.live_frame', live_frame
+    yield 'ui.live_paced', live_paced
+
+    # Paged expo showing a 3x3 grid at a time, flipping through every page
+    def paged_setup():
+        daemon.config.set('UI', 'workspaces', '9')
+        daemon.config.set('UI', 'grid_x', '3')
+        daemon.load_settings()
+        daemon.invalidate_overview()
+
+    def flip_pages():
+        for page in range(daemon.get_page_count()):
+            daemon.refresh_overview(page)
+
+    def paged(f):
+        try:
+            return measure(f, repeat, setup=paged_setup)
+        finally:
+            daemon.config.set('UI', 'workspaces', str(len(tiles)))
+            daemon.config.set('UI', 'grid_x', str(g.grid.x))
+            daemon.load_settings()
+            daemon.invalidate_overview()
+
+    yield 'ui.refresh_overview_paged', lambda: paged(
+        lambda: daemon.refresh_overview(0))
+    yield 'ui.flip_pages', lambda: paged(flip_pages)
+
+
+# Follow focus changes like the event handlers do, either asking i3 for the
+# whole tree on every event as before or answering from the tree model. The
+# fake tree is built in Python, a real one also costs a JSON round trip.
+def bench_tree(size, repeat, events=50):
+    async def follow(model):
+        i3 = daemon.i3
+        for n in range(events):
+            e = i3.focus(i3.workspace_nums[n % len(i3.workspace_nums)])
+            if model:
+                daemon.tree.on_workspace(e)
+                workspace = await daemon.get_focused_workspace()
+            else:
+                workspace = (await i3.get_tree()).find_focused().workspace()
+            daemon.tree_hash(workspace)
+
+    def run_follow(model):
+        loop = asyncio.new_event_loop()
+        i3 = daemon.i3
+        daemon.tree = TreeModel()
+        before = i3.tree_requests
+        try:
+            result = measure(
+                lambda: loop.run_until_complete(follow(model)), repeat)
+        finally:
+            loop.close()
+        result['tree_requests_per_event'] = \
+            (i3.tree_requests - before) / (events * repeat)
+        return result
+
+    yield 'tree.get_tree_per_event', lambda: run_follow(False)
+    yield 'tree.model', lambda: run_follow(True)
+
+
+# Switch between workspaces that each take their own time to redraw and check
+# what every capture actually stored. Runs in real time, so only once.
+def bench_settle(size, repeat, switches=30):
+    async def switch_workspaces(mode):
+        daemon.loop = asyncio.get_running_loop()
+        daemon.update_lock = asyncio.Lock()
+        daemon.settle_tracker = SettleTracker()
+        daemon.config.set('Capture', 'settle_mode', mode)
+        daemon.load_settings()
+
+        i3 = daemon.i3
+        grab = daemon.grab
+        rng = random.Random(0)
+        # Mostly quick to redraw, like terminals, with a few slow ones
+        settle = {num: rng.uniform(0.02, 0.08) if rng.random() < 0.7
+                  else rng.uniform(0.25, 0.5) for num in i3.workspace_nums}
+        outcomes = {'fresh': 0, 'stale': 0, 'torn': 0, 'missed': 0}
+
+        for _ in range(switches):
+            target = rng.choice([n for n in i3.workspace_nums
+                                 if n != i3.focused])
+            daemon.tree.on_workspace(i3.focus(target))
+            grab.last_state = None
+            grab.switch(target, settle[target] * rng.uniform(0.8, 1.2))
+
+            daemon.schedule_update(force=True)
+            while daemon.pending_update or daemon.background_tasks:
+                await asyncio.sleep(0.005)
+
+            if grab.last_state is None:
+                outcomes['missed'] += 1
+            elif grab.last_state[0] == 'torn':
+                outcomes['torn'] += 1
+            elif grab.last_state[1] == target:
+                outcomes['fresh'] += 1
+            else:
+                outcomes['stale'] += 1
+
+            # Let the screen settle before the next switch
+            while grab.transition is not None:
+                grab.state()
+                await asyncio.sleep(0.01)
+
+        stats = daemon.settle_tracker.stats()
+        return {
+            'switches': switches,
+            'median_ms': stats['median_delay_ms'],
+            'stale_rate': outcomes['stale'] / switches,
+            'torn_rate': outcomes['torn'] / switches,
+            'missed_rate': outcomes['missed'] / switches,
+            'settle': stats['rates']
+        }
+
+    def run_mode(mode):
+        try:
+            return asyncio.run(switch_workspaces(mode))
+        finally:
+            daemon.config.set('Capture', 'settle_mode', 'fixed')
+            daemon.load_settings()
+            daemon.settle_tracker = SettleTracker()
+
+    yield 'settle.fixed', lambda: run_mode('fixed')
+    yield 'settle.adaptive', lambda: run_mode('adaptive')
+
+
+# Imports are cached after the first run, so every run of the daemon's
+# startup gets its own interpreter
+def bench_startup(size, repeat):
+    runs = []
+
+    def spawn():
+        out = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.startup'],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            capture_output=True, text=True, check=True)
+        return json.loads(out.stdout)
+
+    def summary(key):
+        if not runs:
+            runs.extend(spawn() for _ in range(repeat))
+        timings = [r[key] for r in runs]
+        return {
+            'repeat': repeat,
+            'median_ms': statistics.median(timings),
+            'mean_ms': statistics.mean(timings),
+            'min_ms': min(timings),
+            'max_ms': max(timings),
+            'pygame_at_ready': any(r['pygame_at_ready'] for r in runs)
+        }
+
+    yield 'startup.import', lambda: summary('import_ms')
+    yield 'startup.ready', lambda: summary('ready_ms')
+    yield 'startup.first_capture', lambda: summary('first_capture_ms')
+
+
+def run(options):
+    workspaces = WORKSPACES
+    resolutions = RESOLUTIONS
+    if options.quick:
+        workspaces = workspaces[:1]
+        resolutions = {'1080p': RESOLUTIONS['1080p']}
+
+    pygame.display.init()
+    pygame.font.init()
+
+    results = []
+    first = True
+    with tempfile.TemporaryDirectory() as config_dir:
+        for n in workspaces:
+            for resolution, size in resolutions.items():
+                i3 = reset_daemon(config_dir, n, size)
+                populate(i3)
+
+                benches = [bench_capture, bench_render, bench_ui, bench_tree]
+                if first:
+                    benches += [bench_settle, bench_startup]
+                    first = False
+
+                for bench in benches:
+                    for name, run_bench in bench(size, options.repeat):
+                        if options.filter not in name:
+                            continue
+                        result = run_bench()
+                        result.update({
+                            'name': name,
+                            'workspaces': n,
+                            'resolution': resolution
+                        })
+                        results.append(result)
+                        print(f"{name:30} {n:4} {resolution:6} "
+                              f"{result['median_ms']:10.3f} ms "
+                              f"{result.get('py_peak_kb', 0):10.1f} KiB")
+                        if 'fps' in result:
+                            print(f"{'':42} {result['fps'] or 0:.1f} fps of "
+                                  f"{result['target_fps']:.0f}, "
+                                  f"{result['over_budget']} over budget")
+                        if 'tree_requests_per_event' in result:
+                            print(f"{'':42} "
+                                  f"{result['tree_requests_per_event']:.2f}"
+                                  f" tree requests per event")
+                        if 'stale_rate' in result:
+                            print(f"{'':42} stale {result['stale_rate']:.0%}"
+                                  f" torn {result['torn_rate']:.0%}"
+                                  f" missed {result['missed_rate']:.0%}")
+
+    return {
+        'meta': {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'pygame': pygame.version.ver,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'render_threads': daemon.render_threads,
+            'capture_backend': daemon.get_capture_backend(),
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        },
+        'results': results
+    }
+
+
+def main(argv=None):
+    options = parser.parse_args(argv)
+    report = run(options)
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
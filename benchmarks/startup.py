@@ -0,0 +1,64 @@
+"""Cold start of the daemon against the fakes, in a fresh interpreter.
+
+benchmarks.run spawns this once per repeat, since imports are only slow the
+first time. Prints a JSON object with milliseconds since the interpreter
+started running this module:
+
+    python -m benchmarks.startup
+"""
+
+import time
+started = time.perf_counter()
+
+import os
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
+
+from i3expo import daemon
+imported = time.perf_counter()
+
+from benchmarks.fakes import FakeCaptureLib, FakeI3
+
+import asyncio
+import json
+import sys
+import tempfile
+
+
+def main():
+    ready = {}
+    start_server = daemon.start_control_server
+
+    async def start_control_server():
+        server = await start_server()
+        ready['at'] = time.perf_counter()
+        ready['pygame'] = 'pygame' in sys.modules
+        return server
+
+    with tempfile.TemporaryDirectory() as tmp:
+        daemon.config_path = os.path.join(tmp, 'config')
+        daemon.control.get_socket_path = lambda: os.path.join(tmp, 'sock')
+        daemon.start_control_server = start_control_server
+        fake = FakeI3(9, 1920, 1080)
+        daemon.i3ipc.aio.Connection = lambda **kwargs: fake
+
+        # Same steps as daemon.main(), with the fake capture library
+        daemon.read_config()
+        daemon.configure_thumbnails()
+        daemon.configure_render_pool()
+        daemon.init_thumbnail_cache()
+        daemon.grab = FakeCaptureLib()
+
+        asyncio.run(daemon.run(started))
+        captured = time.perf_counter()
+
+    print(json.dumps({
+        'import_ms': (imported - started) * 1000,
+        'ready_ms': (ready['at'] - started) * 1000,
+        'first_capture_ms': (captured - started) * 1000,
+        'pygame_at_ready': ready['pygame']
+    }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+from collections import OrderedDict
+from threading import Lock
+
+import ctypes
+
+
+class BufferPool(object):
+    """Capture buffers that are handed back after use and reused for the
+    next capture of the same size, instead of allocating a full frame every
+    time. At most limit idle buffers are kept, those of sizes that were not
+    asked for in a while are dropped first."""
+
+    def __init__(self, limit=4):
+        self.limit = limit
+        # length -> idle buffers of that length, least recently used first
+        self.free = OrderedDict()
+        self.lock = Lock()
+        self.stats = {
+            'acquired': 0,
+            'allocations': 0,
+            'allocated_bytes': 0
+        }
+
+    def acquire(self, length):
+        with self.lock:
+            self.stats['acquired'] += 1
+            idle = self.free.get(length)
+            if idle:
+                self.free.move_to_end(length)
+                return idle.pop()
+
+            self.stats['allocations'] += 1
+            self.stats['allocated_bytes'] += length
+        return (ctypes.c_ubyte*length)()
+
+    def release(self, buffer):
+        with self.lock:
+            self.free.setdefault(len(buffer), []).append(buffer)
+            self.free.move_to_end(len(buffer))
+
+            while sum(len(idle) for idle in self.free.values()) > self.limit:
+                length, idle = next(iter(self.free.items()))
+                idle.pop(0)
+                if not idle:
+                    del self.free[length]
+
+    def idle_bytes(self):
+        with self.lock:
+            return sum(length * len(idle)
+                       for length, idle in self.free.items())
+
+    def clear(self):
+        with self.lock:
+            self.free.clear()
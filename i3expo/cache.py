@@ -0,0 +1,58 @@
+from threading import Lock
+
+
+class RenderCache(object):
+    """Tiles, labels and fonts reused between frames. The UI thread reads
+    it while capture threads invalidate tiles, so every access holds the
+    lock. Values are built outside of it: two threads missing the same key
+    both build it and the last one is kept."""
+
+    def __init__(self):
+        self.lock = Lock()
+        # workspace number -> (key, future of the prepared tile)
+        self.tiles = {}
+        # (text, font, size, color) -> rendered surface
+        self.labels = {}
+        # (font, size) -> pygame font
+        self.fonts = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_tile(self, num, key, build):
+        with self.lock:
+            entry = self.tiles.get(num)
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = build()
+        with self.lock:
+            self.tiles[num] = (key, value)
+        return value
+
+    def get_label(self, key, build):
+        return self.get_cached(self.labels, key, build)
+
+    def get_font(self, key, build):
+        return self.get_cached(self.fonts, key, build)
+
+    def get_cached(self, cache, key, build):
+        with self.lock:
+            value = cache.get(key)
+        if value is None:
+            value = build()
+            with self.lock:
+                cache[key] = value
+        return value
+
+    # Drop the scaled image of a workspace that was recaptured or removed
+    def invalidate(self, num):
+        with self.lock:
+            self.tiles.pop(num, None)
+
+    def clear(self):
+        with self.lock:
+            self.tiles.clear()
+            self.labels.clear()
+            self.fonts.clear()
@@ -1,15 +1,28 @@
 #!/usr/bin/env python3
 
+from i3expo import control
+
 import argparse
+import json
 import os
 import signal
 
 parser = argparse.ArgumentParser(description="Interact with the i3expo daemon")
 parser.add_argument("-u", "--update-config",
                     help="Update config from file", action="store_true")
-parser.add_argument("-s", "--show", help="Show expo UI", action="store_true")
+parser.add_argument("-s", "--show", help="Show expo UI, or hide it if shown",
+                    action="store_true")
+parser.add_argument("--hide", help="Hide expo UI", action="store_true")
+parser.add_argument("--status", help="Print daemon status", action="store_true")
+parser.add_argument("--metrics", help="Print daemon metrics in Prometheus format",
+                    action="store_true")
 args = parser.parse_args()
 
+signals = {
+    'toggle': signal.SIGUSR1,
+    'reload': signal.SIGHUP
+}
+
 
 def get_pid():
     uid = os.getuid()
@@ -18,18 +31,54 @@ def get_pid():
         return int(pid)
 
 
-def main():
+def send_signal(command):
+    if command not in signals:
+        print(f"Daemon is not reachable, cannot {command}")
+        return
+
     try:
-        pid = get_pid()
-        if args.show:
-            print("Requesting UI")
-            os.kill(pid, signal.SIGUSR1)
-        elif args.update_config:
-            print("Requesting config update")
-            os.kill(pid, signal.SIGHUP)
+        os.kill(get_pid(), signals[command])
     except:
         print("Failed to send signal")
 
 
+def send_command(command):
+    try:
+        reply = control.request(command)
+    except (FileNotFoundError, ConnectionRefusedError):
+        # Older daemons only listen for signals
+        send_signal(command)
+        return
+    except Exception as e:
+        print(f"Failed to send command: {e}")
+        return
+
+    if not reply.get('ok'):
+        print(f"Daemon failed to {command}: {reply.get('error')}")
+    elif command == 'status':
+        print(json.dumps(reply, indent=2))
+    elif command == 'metrics':
+        print(reply['prometheus'], end='')
+    elif reply.get('shown'):
+        print(f"UI shown in {reply['first_frame_ms']:.1f} ms")
+    elif reply.get('reason'):
+        print(reply['reason'])
+
+
+def main():
+    if args.show:
+        print("Requesting UI")
+        send_command('toggle')
+    elif args.hide:
+        send_command('hide')
+    elif args.update_config:
+        print("Requesting config update")
+        send_command('reload')
+    elif args.status:
+        send_command('status')
+    elif args.metrics:
+        send_command('metrics')
+
+
 if __name__ == "__main__":
     main()
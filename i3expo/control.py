@@ -0,0 +1,47 @@
+import json
+import os
+import socket
+
+COMMANDS = ['show', 'hide', 'toggle', 'reload', 'status', 'metrics']
+
+
+def get_socket_path():
+    uid = os.getuid()
+    return f"/var/run/user/{uid}/i3expo.sock"
+
+
+def encode(message):
+    return (json.dumps(message) + '\n').encode()
+
+
+def decode(line):
+    return json.loads(line.decode())
+
+
+# Whether a daemon accepts connections on the socket at path. A socket left
+# behind by a daemon that died refuses them.
+def is_listening(path, timeout=1.0):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        try:
+            s.connect(path)
+        except ConnectionRefusedError:
+            return False
+    return True
+
+
+# Send a single command to the daemon and wait for its reply
+def request(command, timeout=5.0, path=None):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(path or get_socket_path())
+        s.sendall(encode({'command': command}))
+
+        reply = b''
+        while not reply.endswith(b'\n'):
+            chunk = s.recv(4096)
+            if not chunk:
+                raise ConnectionError("Daemon closed the connection")
+            reply += chunk
+
+    return decode(reply)
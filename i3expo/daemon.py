@@ -1,14 +1,31 @@
 #!/usr/bin/env python3
 
 from xdg.BaseDirectory import xdg_config_home
-from PIL import Image, ImageDraw
-from threading import Thread
+from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor
 from i3expo.debounce import Debounce
 from i3expo.geometry import Geometry, Dimension
+from i3expo.thumbnails import ThumbnailStore, TILE, PREVIEW
+from i3expo.cache import RenderCache
+from i3expo.damage import DamageTracker, Rect
+from i3expo.settle import SettleTracker, PROBE_WIDTH, difference
+from i3expo.live import FramePacer
+from i3expo.buffers import BufferPool
+from i3expo.pixels import to_surface
+from i3expo.state import StateStore
+from i3expo.tree import TreeModel
+from i3expo.trace import TraceRecorder
+from i3expo.windows import get_layout, crop_windows, compose
+from i3expo.persist import ThumbnailCache, get_cache_dir
+from i3expo.settings import DEFAULTS, WINDOW_EVENTS, compile_settings
+from i3expo.lazy import lazy_import
+from i3expo import control
+from i3expo import metrics
 
 import os
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
 
+import asyncio
 import logging
 import math
 import argparse
@@ -17,18 +34,110 @@ import traceback
 import sys
 import signal
 import copy
-import i3ipc
-import pygame
+import i3ipc.aio
 import ctypes
 import configparser
 
-global_updates_running = True
-global_knowledge = {'active': -1}
+# pygame takes most of the startup time and are only needed once
+# something is captured or shown
+pygame = lazy_import('pygame')
 
-i3 = i3ipc.Connection()
+global_updates_running = True
+knowledge = StateStore()
+thumbnails = ThumbnailStore()
+render_cache = RenderCache()
+render_pool = None
+render_threads = None
+settle_tracker = SettleTracker()
+# window id -> image of the window cut from its last capture, written by
+# capture threads and read by recomposition, always under window_images_lock
+window_images = {}
+window_images_lock = Lock()
+thumbnail_cache = None
+capture_buffers = BufferPool()
+# Workspace number -> capture rectangle of workspaces that stay visible on
+# other outputs while the expo is shown, and their reusable capture buffers
+live_targets = {}
+live_buffers = {}
+live_pacer = None
+
+registry = metrics.Registry()
+events_received = registry.counter(
+    'i3expo_events_total', 'i3 events received by type')
+captures_taken = registry.counter(
+    'i3expo_captures_total', 'Captures taken by kind')
+captures_skipped = registry.counter(
+    'i3expo_captures_skipped_total', 'Captures skipped by reason')
+capture_bytes = registry.counter(
+    'i3expo_capture_bytes_total', 'Bytes read from the X server')
+capture_seconds = registry.histogram(
+    'i3expo_capture_seconds', 'Time to grab and store a capture')
+conversion_seconds = registry.histogram(
+    'i3expo_image_conversion_seconds', 'Time to convert a thumbnail to a surface')
+scaling_seconds = registry.histogram(
+    'i3expo_image_scaling_seconds', 'Time to scale a thumbnail to its tile')
+capture_delay_seconds = registry.histogram(
+    'i3expo_capture_delay_seconds', 'Time from a capture request to the capture',
+    (0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.5))
+settle_results = registry.counter(
+    'i3expo_settle_results_total', 'Adaptive captures by how the screen settled')
+settle_estimate = registry.gauge(
+    'i3expo_settle_estimate_seconds', 'Learned settle time per workspace',
+    lambda: [({'workspace': num}, seconds)
+             for num, seconds in list(settle_tracker.estimates.items())])
+open_seconds = registry.histogram(
+    'i3expo_expo_open_seconds', 'Time from a show request to the first frame')
+live_frame_seconds = registry.histogram(
+    'i3expo_live_frame_seconds', 'Time to redraw live tiles',
+    (0.001, 0.0025, 0.005, 0.01, 0.02, 0.05, 0.1))
+live_fps = registry.gauge(
+    'i3expo_live_fps', 'Live tile frames per second while the expo is shown',
+    lambda: collect_live_fps())
+buffer_allocations = registry.gauge(
+    'i3expo_capture_buffer_allocations', 'Capture buffers allocated so far',
+    lambda: [({}, capture_buffers.stats['allocations'])])
+tree_requests = registry.counter(
+    'i3expo_tree_requests_total', 'Full i3 tree requests by reason')
+tree_requests_per_event = registry.gauge(
+    'i3expo_tree_requests_per_event', 'Full i3 tree requests per i3 event',
+    lambda: collect_tree_requests_per_event())
+tree_divergences = registry.counter(
+    'i3expo_tree_divergences_total',
+    'Checks that found the tree model out of date')
+workspace_memory = registry.gauge(
+    'i3expo_workspace_memory_bytes', 'Thumbnail memory per workspace',
+    lambda: [({'workspace': num}, size)
+             for num, size in thumbnails.usage().items()])
+thumbnail_codec_seconds = registry.histogram(
+    'i3expo_thumbnail_codec_seconds',
+    'Time to encode or decode a thumbnail level',
+    (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025))
+thumbnail_evictions = registry.counter(
+    'i3expo_thumbnail_evictions_total',
+    'Workspaces whose thumbnails were evicted to fit the memory budget')
+
+
+def on_thumbnails_evicted(num):
+    thumbnail_evictions.inc()
+    render_cache.invalidate(num)
+
+
+thumbnails.on_evict = on_thumbnails_evicted
+thumbnails.on_timing = lambda operation, seconds: \
+    thumbnail_codec_seconds.observe(seconds, operation=operation)
+
+i3 = None
+loop = None
 
 screenshot_lib = '/usr/share/i3expo/prtscn.so'
-grab = ctypes.CDLL(screenshot_lib)
+grab = None
+damage = None
+capture_lock = Lock()
+# Set under capture_lock when the capture library closed its X connection,
+# grabs fail from then on instead of reopening one
+capture_closed = False
+
+capture_backends = {-1: 'none', 0: 'xlib', 1: 'xshm'}
 
 parser = argparse.ArgumentParser(
     description="Display an overview of all open workspaces")
@@ -38,111 +147,298 @@ parser.add_argument("-i", "--interval",
                     help="Update interval in seconds (default: 1s)")
 parser.add_argument("-d", "--dedicated",
                     help="Launch on a dedicated workspace", action="store_true")
-args = parser.parse_args()
+parser.add_argument("-r", "--record", metavar="TRACE",
+                    help="Record i3 events to TRACE for benchmarks.replay")
+# Defaults until main() parses the command line, so the module can be
+# imported by other tools
+args = parser.parse_args([])
 
 loop_interval = 100.0
+ui_wake_interval = 1000  # ms
 config = None
+settings = None
+# Bounding box of the active i3 outputs, the default capture and window size
+screen_size = None
+ui_colors = {}
 config_path = os.path.join(xdg_config_home, "i3expo", "config")
-update_debounced = None
+window_events = WINDOW_EVENTS
+# Only followed to keep the tree model up to date, they trigger no capture
+tree_events = ['window::new', 'window::close']
+tree = TreeModel()
+recorder = None
+debouncers = {}
+update_lock = None
+control_lock = None
+overview = None
+overview_lock = Lock()
+# Resolved by the UI thread once it closed the overview
+ui_closed = None
+pending_update = None
+update_requested = None
+background_tasks = set()
+
+
+def signal_quit():
+    global capture_closed
 
-
-def signal_quit(signal, frame):
     logging.info("Shutting down...")
-    pygame.display.quit()
-    pygame.quit()
+    log_debounce_stats()
+    if 'pygame' in sys.modules:
+        pygame.display.quit()
+        pygame.quit()
+    # Executor and UI threads may be grabbing right now
+    with capture_lock:
+        capture_closed = True
+        grab.closeCapture()
     i3.main_quit()
-    sys.exit(0)
 
 
-def signal_reload(signal, frame):
+def signal_reload():
     global loop_interval
 
     logging.info("Reloading config")
     read_config()
+    configure_thumbnails()
+    configure_render_pool()
+    init_thumbnail_cache()
+    render_cache.clear()
+    invalidate_overview()
+    log_debounce_stats()
+    init_debouncers()
 
-    loop_interval = config.getfloat('Daemon', 'forced_update_interval')
+    loop_interval = settings.Daemon.forced_update_interval
 
 
-def signal_show(signal, frame):
+def signal_show():
+    start_task(handle_command('toggle'))
+
+
+async def toggle():
+    if not global_updates_running:
+        return await hide()
+    return await show()
+
+
+# Returns once the UI thread is done with the display, so that a following
+# show() cannot start a second one next to it
+async def hide():
     global global_updates_running
 
-    logging.info("Showing UI")
+    if global_updates_running:
+        return {'hidden': False, 'reason': 'UI is not shown'}
+
+    logging.info("Hiding UI")
+    global_updates_running = True
+    wake_ui()
+    await wait_ui_closed()
+    return {'hidden': True}
+
+
+async def wait_ui_closed():
+    if ui_closed is not None:
+        await ui_closed
+
+
+async def show():
+    global global_updates_running, ui_closed
+
     if not global_updates_running:
-        global_updates_running = True
-    elif should_show_ui():
-        global_updates_running = False
-        update_debounced.reset()
+        return {'shown': False, 'reason': 'UI is already shown'}
+    elif not should_show_ui():
+        return {'shown': False, 'reason': 'Not enough workspaces'}
+
+    # The overview may have closed itself and still be shutting down
+    await wait_ui_closed()
 
-        source = i3.get_tree().find_focused().workspace().name
+    logging.info("Showing UI")
+    global_updates_running = False
+    reset_debouncers()
+    cancel_pending_update()
+
+    requested = time.perf_counter()
+    try:
+        source = (await get_focused_workspace(layout=False)).name
+        await init_live_targets(source)
         if args.dedicated:
-            i3.command('workspace i3expod-temporary-workspace')
+            await i3.command('workspace i3expod-temporary-workspace')
+    except Exception:
+        # Captures would otherwise stay off with no overview to close
+        global_updates_running = True
+        raise
+
+    # Resolved by the UI thread once the first frame is on screen
+    shown = loop.create_future()
+    closed = loop.create_future()
+    ui_closed = closed
+
+    def on_shown(elapsed):
+        loop.call_soon_threadsafe(
+            lambda: shown.done() or shown.set_result(elapsed))
+
+    def on_closed():
+        loop.call_soon_threadsafe(
+            lambda: closed.done() or closed.set_result(None))
+
+    ui_thread = Thread(target=show_ui,
+                       args=[source, requested, on_shown, on_closed])
+    ui_thread.daemon = True
+    ui_thread.start()
+
+    elapsed = await shown
+    if elapsed is None:
+        return {'shown': False, 'reason': 'Failed to show UI'}
+    return {'shown': True, 'first_frame_ms': elapsed}
+
+
+def get_status():
+    snapshot = knowledge.current()
+    return {
+        'ui_open': not global_updates_running,
+        'workspaces': len(snapshot.workspaces),
+        'active': snapshot.active,
+        'state_version': snapshot.version,
+        'capture_backend': get_capture_backend(),
+        'thumbnail_bytes': thumbnails.total_bytes(),
+        'thumbnail_codec': dict(thumbnails.timing(),
+                                evictions=thumbnails.stats['evictions']),
+        'debounce': {e: d.stats() for e, d in debouncers.items()},
+        'settle': settle_tracker.stats(),
+        'capture_buffers': dict(capture_buffers.stats,
+                                idle_bytes=capture_buffers.idle_bytes()),
+        'live': live_pacer.stats() if live_pacer is not None else None,
+        'tree': dict(tree.stats, requests=count_tree_requests())
+    }
+
+
+# Requests from signals and concurrent clients are handled one at a time
+async def handle_command(command):
+    async with control_lock:
+        return await dispatch_command(command)
+
+
+async def dispatch_command(command):
+    if command == 'toggle':
+        return await toggle()
+    elif command == 'show':
+        return await show()
+    elif command == 'hide':
+        return await hide()
+    elif command == 'reload':
+        signal_reload()
+        return {}
+    elif command == 'status':
+        return get_status()
+    elif command == 'metrics':
+        return {'metrics': registry.snapshot(),
+                'prometheus': registry.prometheus()}
+    raise ValueError(f"Unknown command: {command}")
+
+
+async def handle_client(reader, writer):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
 
-        ui_thread = Thread(target=show_ui, args=[source])
-        ui_thread.daemon = True
-        ui_thread.start()
+            start = time.perf_counter()
+            try:
+                command = control.decode(line).get('command')
+                reply = await handle_command(command)
+                reply['ok'] = True
+            except Exception as e:
+                logging.exception("Failed to handle control request")
+                reply = {'ok': False, 'error': str(e)}
+
+            reply['elapsed_ms'] = (time.perf_counter() - start) * 1000
+            writer.write(control.encode(reply))
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+# Only a socket that no daemon listens on any more is replaced, a second
+# daemon must not take the control channel from a running one
+def claim_control_socket():
+    path = control.get_socket_path()
+    if not os.path.exists(path):
+        return
+
+    if control.is_listening(path):
+        logging.error("Another daemon is listening on %s", path)
+        sys.exit("i3expo daemon is already running")
+
+    logging.info("Removing stale control socket %s", path)
+    os.unlink(path)
+
+
+async def start_control_server():
+    path = control.get_socket_path()
+    claim_control_socket()
+
+    server = await asyncio.start_unix_server(handle_client, path=path)
+    os.chmod(path, 0o600)
+    logging.info("Listening for commands on %s", path)
+    return server
+
+
+def remove_control_socket():
+    path = control.get_socket_path()
+    if os.path.exists(path):
+        os.unlink(path)
+
+
+def start_task(coro):
+    # Keep a reference so that running tasks are not garbage collected
+    task = loop.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(on_task_done)
+    return task
+
+
+def on_task_done(task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.error("Background task failed", exc_info=task.exception())
+
+
+# Run an i3 command from a thread other than the event loop's
+def i3_command(command):
+    return asyncio.run_coroutine_threadsafe(i3.command(command), loop).result()
 
 
 def should_show_ui():
-    return len(global_knowledge) - 1 > 1
+    return len(knowledge.current().workspaces) > 1
 
 
-def get_color(raw):
-    return pygame.Color(raw)
+# Colors are parsed once per config, invalid ones fall back to the default
+def get_ui_color(key):
+    color = ui_colors.get(key)
+    if color is None:
+        try:
+            color = pygame.Color(getattr(settings.UI, key))
+        except ValueError:
+            logging.warning("Invalid color for %s in [UI], using %s",
+                            key, DEFAULTS['UI'][key])
+            color = pygame.Color(DEFAULTS['UI'][key])
+        ui_colors[key] = color
+    return color
 
 
-def read_config():
-    global config
+def load_settings():
+    global settings
 
-    converters = {'color': get_color}
-
-    pygame.display.init()
-    disp_info = pygame.display.Info()
-
-    defaults = {
-        'Capture': {
-            'screenshot_width': disp_info.current_w,
-            'screenshot_height': disp_info.current_h,
-            'screenshot_offset_x': 0,
-            'screenshot_offset_y': 0,
-            'screenshot_delay': 0.2
-        },
-        'UI': {
-            'window_width': disp_info.current_w,
-            'window_height': disp_info.current_h,
-            'bgcolor': 'gray20',
-            'frame_active_color': '#5a6da4',
-            'frame_inactive_color': '#93afb3',
-            'frame_missing_color': '#ffe6d0',
-            'tile_missing_color': 'gray40',
-
-            'grid_x': 3,
-            'workspaces': 9,
-
-            'padding_percent_x': 5,
-            'padding_percent_y': 5,
-            'spacing_percent_x': 4,
-            'spacing_percent_y': 4,
-            'frame_width_px': 3,
-
-            'names_show': True,
-            'names_font': 'verdana',  # list with pygame.font.get_fonts()
-            'names_fontsize': 25,
-            'names_color': 'white',
-            'highlight_percentage': 20
-        },
-        'Daemon': {
-            'forced_update_interval': 10.0,
-            'debounce_period': 1.0,
-        }
-    }
-    pygame.display.quit()
+    settings = compile_settings(config, screen_size)
+    ui_colors.clear()
 
-    config = configparser.ConfigParser(
-        converters=converters
-    )
 
-    config.read_dict(defaults)
+def read_config():
+    global config
 
+    config = configparser.ConfigParser()
+    config.read_dict(DEFAULTS)
 
     root_dir = os.path.dirname(config_path)
     if not os.path.exists(root_dir):
@@ -154,58 +450,505 @@ def read_config():
         with open(config_path, 'w') as f:
             config.write(f)
 
-def grab_screen():
-    logging.debug("Grabbing screen")
-    x1 = config.getint('Capture', 'screenshot_offset_x')
-    y1 = config.getint('Capture', 'screenshot_offset_y')
-    x2 = config.getint('Capture', 'screenshot_width')
-    y2 = config.getint('Capture', 'screenshot_height')
-    w, h = x2-x1, y2-y1
-    size = w * h
-    objlength = size * 3
+    load_settings()
+
+
+# Tiles are scaled and their highlight variants built on this pool. Scaling
+# and blitting release the GIL, so opening the expo scales with the cores.
+def configure_render_pool():
+    global render_pool, render_threads
+
+    threads = settings.UI.render_threads or os.cpu_count() or 1
+    if render_pool is not None:
+        if threads == render_threads:
+            return
+        render_pool.shutdown(wait=False)
+
+    render_threads = threads
+    render_pool = ThreadPoolExecutor(
+        max_workers=threads, thread_name_prefix='i3expo-render')
+    logging.info("Render threads: %s", threads)
+
+
+def init_thumbnail_cache():
+    global thumbnail_cache
+
+    path = None
+    if settings.Daemon.persist_thumbnails:
+        path = os.path.expanduser(settings.Daemon.persist_dir) \
+            or get_cache_dir()
+
+    if thumbnail_cache is not None:
+        if thumbnail_cache.path == path:
+            return
+        thumbnail_cache.close()
+        thumbnail_cache = None
+
+    if path is None:
+        return
 
-    grab.getScreen.argtypes = []
-    result = (ctypes.c_ubyte*objlength)()
-    grab.getScreen(x1, y1, w, h, result)
+    cache = ThumbnailCache(path)
+    try:
+        if cache.open():
+            thumbnail_cache = cache
+            logging.info("Keeping thumbnails in %s", path)
+    except OSError:
+        logging.exception("Failed to open thumbnail cache %s", path)
+
+
+def init_capture():
+    global grab
+
+    grab = ctypes.CDLL(screenshot_lib)
+    grab.initCapture.restype = ctypes.c_int
+    grab.getBackend.restype = ctypes.c_int
+    for f in [grab.getScreen32, grab.getRegion32]:
+        f.restype = ctypes.c_int
+        f.argtypes = [
+            ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+            ctypes.POINTER(ctypes.c_ubyte)]
+    grab.getProbe32.restype = ctypes.c_int
+    grab.getProbe32.argtypes = [
+        ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+        ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_ubyte)]
+
+    # Keeps a single X connection open for the lifetime of the daemon
+    grab.initCapture()
+    logging.info("Capture backend: %s", get_capture_backend())
+
+
+def get_capture_backend():
+    return capture_backends.get(grab.getBackend(), 'unknown')
+
+
+def configure_thumbnails():
+    thumbnails.configure(
+        settings.Daemon.frame_compression,
+        settings.Daemon.frame_format,
+        round(settings.Daemon.memory_budget_mb * 1024 * 1024))
+
+
+def init_damage():
+    global damage
+
+    damage = None
+    if not settings.Capture.use_damage:
+        return
+
+    with capture_lock:
+        tracker = DamageTracker(grab)
+    if tracker.available:
+        damage = tracker
+        logging.info("Tracking screen damage")
+    else:
+        logging.warning("XDamage is not available, capturing full frames")
+
+
+async def get_capture_rect(i3, workspace):
+    if settings.Capture.capture_output:
+        for output in await i3.get_outputs():
+            if output.active and output.current_workspace == workspace.name:
+                r = output.rect
+                return Rect(r.x, r.y, r.width, r.height)
+
+        logging.debug("No output found for workspace %s", workspace.num)
+
+    x1 = settings.Capture.screenshot_offset_x
+    y1 = settings.Capture.screenshot_offset_y
+    x2 = settings.Capture.screenshot_width
+    y2 = settings.Capture.screenshot_height
+    return Rect(x1, y1, x2-x1, y2-y1)
+
+
+def grab_screen(rect, region=False):
+    logging.debug("Grabbing screen %s", rect)
+    x1, y1, w, h = rect
+    size = w * h
+    objlength = size * 4
+
+    # Pixels come back in the native 32-bit layout of the X server, into a
+    # buffer that goes back to the pool once the capture has been stored.
+    # Damaged regions come in every size and would push the full frame
+    # buffers out of the pool, they get a buffer of their own each time.
+    if region:
+        result = (ctypes.c_ubyte*objlength)()
+    else:
+        result = capture_buffers.acquire(objlength)
+    with capture_lock:
+        if capture_closed:
+            status = -1
+        elif region:
+            status = grab.getRegion32(x1, y1, w, h, result)
+        else:
+            status = grab.getScreen32(x1, y1, w, h, result)
+    if status != 0:
+        if not region:
+            capture_buffers.release(result)
+        logging.warning("Failed to grab screen")
+        return None
+    capture_bytes.inc(objlength)
     return (w, h, result)
 
 
+# Sample the screen down to a few thousand pixels to tell whether it settled,
+# or down to size into buffer for live tiles
+def grab_probe(rect, size=None, buffer=None):
+    if size is None:
+        width = min(PROBE_WIDTH, rect.width)
+        height = max(1, round(width * rect.height / rect.width))
+    else:
+        width, height = size
+
+    result = buffer
+    if result is None:
+        result = (ctypes.c_ubyte*(width * height * 4))()
+    with capture_lock:
+        if capture_closed:
+            status = -1
+        else:
+            status = grab.getProbe32(rect.x, rect.y, rect.width,
+                                     rect.height, width, height, result)
+    if status != 0:
+        logging.warning("Failed to probe screen")
+        return None
+    return (width, height, result)
+
+
+# When settled is the probe the screen was judged stable on, a frame that no
+# longer matches it changed while it was being captured and is dropped
+def capture_workspace(rect, workspace, settled=None):
+    if damage is not None:
+        with capture_lock:
+            damaged = damage.collect(rect) if not capture_closed else []
+        previous = damage.captured.get(rect)
+
+        if previous == workspace.num and thumbnails.has(workspace.num):
+            if not damaged:
+                logging.debug("No damage on workspace %s, skipping capture",
+                              workspace.num)
+                captures_skipped.inc(reason='no_damage')
+                return True
+
+            # Thumbnails evicted meanwhile are captured in full instead
+            area = sum(r.width * r.height for r in damaged)
+            if area * 2 < rect.width * rect.height:
+                with capture_seconds.time(kind='patch'):
+                    patched = patch_workspace(workspace, rect, damaged)
+                if patched:
+                    captures_taken.inc(kind='patch')
+                    return True
+
+    with capture_seconds.time(kind='full'):
+        screenshot = grab_screen(rect)
+        if screenshot is None:
+            return False
+
+        try:
+            if settled is not None:
+                after = grab_probe(rect)
+                threshold = settings.Capture.settle_threshold
+                if after is not None \
+                        and difference(settled, after) > threshold:
+                    logging.debug("Workspace %s changed while capturing",
+                                  workspace.num)
+                    captures_skipped.inc(reason='torn')
+                    return False
+
+            thumbnails.put(workspace.num, screenshot, get_thumbnail_sizes())
+        finally:
+            capture_buffers.release(screenshot[2])
+    captures_taken.inc(kind='full')
+    if damage is not None:
+        damage.captured[rect] = workspace.num
+    return True
+
+
+def patch_workspace(workspace, rect, damaged):
+    logging.debug("Patching %s damaged areas on workspace %s",
+                  len(damaged), workspace.num)
+    for r in damaged:
+        region = grab_screen(r, region=True)
+        if region is None:
+            return False
+
+        relative = Rect(r.x - rect.x, r.y - rect.y, r.width, r.height)
+        if not thumbnails.patch(workspace.num, region, relative,
+                                (rect.width, rect.height)):
+            return False
+    return True
+
+
 def process_image(raw_img):
-    pil = Image.frombuffer(
-        'RGB', (raw_img[0], raw_img[1]), raw_img[2], 'raw', 'RGB', 0, 1)
-    return pygame.image.fromstring(pil.tobytes(), pil.size, pil.mode)
+    with conversion_seconds.time():
+        return convert_image(raw_img)
+
+
+# The surface reads the thumbnail's pixels in place, it is only scaled from
+def convert_image(raw_img):
+    return to_surface(raw_img)
 
 
 def update_workspace(workspace):
     # logging.debug("Update workspace %s", workspace.num)
-    if workspace.num not in global_knowledge.keys():
-        global_knowledge[workspace.num] = {
-            'name': None,
-            'screenshot': None,
-            'windows': {},
-            'last_update': 0,
-            'state': 0
-        }
-
-    global_knowledge[workspace.num]['name'] = workspace.name
-    global_knowledge['active'] = workspace.num
+    knowledge.update(workspace.num, activate=True, name=workspace.name)
 
 
-def init_knowledge():
-    for workspace in i3.get_tree().workspaces():
+async def init_knowledge():
+    await sync_tree('startup')
+    workspaces = tree.get_workspaces()
+    for workspace in workspaces:
         update_workspace(workspace)
 
+    if thumbnail_cache is not None:
+        restore_thumbnails(workspaces)
+
+
+# Bring back the thumbnails saved by a previous run, as long as the windows
+# of their workspace did not change in the meantime
+def restore_thumbnails(workspaces):
+    start = time.perf_counter()
+    thumbnail_cache.prune([w.name for w in workspaces])
+
+    restored = 0
+    for workspace in workspaces:
+        entry = thumbnail_cache.load(workspace.name)
+        if entry is None:
+            continue
+
+        meta, levels = entry
+        codec = (meta['compression'], meta['pixel_format'])
+        if meta['state'] != tree_hash(workspace, focus=False) \
+                or not thumbnails.restore(workspace.num, codec, levels):
+            logging.debug("Dropping outdated thumbnail of workspace %s",
+                          workspace.name)
+            thumbnail_cache.remove(workspace.name)
+            continue
+
+        knowledge.update(workspace.num, state=tree_hash(workspace))
+        restored += 1
+
+    logging.info("Restored %s thumbnails in %.1f ms", restored,
+                 (time.perf_counter() - start) * 1000)
+
+
+def persist_thumbnail(workspace):
+    if thumbnail_cache is None or not thumbnails.has(workspace.num):
+        return None
+
+    (compression, pixel_format), levels = thumbnails.export(workspace.num)
+    return thumbnail_cache.save(
+        workspace.name, tree_hash(workspace, focus=False),
+        compression, pixel_format, levels)
+
+
+# The root window spans every active output, so their bounding box is the
+# size the X server reports for the screen
+async def init_screen_size():
+    global screen_size
+
+    outputs = [o for o in await i3.get_outputs() if o.active]
+    if not outputs:
+        logging.warning("No active outputs, screen size unknown")
+        return
+
+    size = Dimension(max(o.rect.x + o.rect.width for o in outputs),
+                     max(o.rect.y + o.rect.height for o in outputs))
+    if screen_size is not None \
+            and (size.x, size.y) == (screen_size.x, screen_size.y):
+        return
+
+    logging.info("Screen size: %sx%s", size.x, size.y)
+    screen_size = size
+    load_settings()
+    invalidate_overview()
+
+
+# Full tree requests are counted by reason, everything else is answered by
+# the tree model
+async def sync_tree(reason):
+    tree_requests.inc(reason=reason)
+    root = await i3.get_tree()
+    tree.sync(root)
+    return root
+
+
+# Without layout, only which workspace is focused matters and not where its
+# windows are
+async def get_focused_workspace(layout=True):
+    if tree.is_stale(focused=layout):
+        await sync_tree('resync')
+    return tree.focused_workspace()
+
+
+async def get_workspaces(layout=True):
+    if tree.is_stale(focused=False, every=layout):
+        await sync_tree('resync')
+    return tree.get_workspaces()
+
+
+# Compare the model to a full tree from time to time, in case an event was
+# missed or did not say everything that changed
+async def verify_tree():
+    tree_requests.inc(reason='verify')
+    root = await i3.get_tree()
+    diverged = tree.diverged(root, tree_hash)
+    if diverged:
+        logging.warning("Tree model was out of date for workspaces %s",
+                        diverged)
+        tree_divergences.inc()
+    tree.sync(root)
+
+
+# Trees taken for a trace being recorded are left out, they are not what the
+# overview costs
+def count_tree_requests():
+    return sum(value for labels, value in tree_requests.collect().items()
+               if ('reason', 'record') not in labels)
+
+
+def collect_tree_requests_per_event():
+    events = sum(events_received.collect().values())
+    if not events:
+        return []
+    return [({}, count_tree_requests() / events)]
+
+
+def init_recorder():
+    global recorder
+
+    logging.info("Recording i3 events to %s", args.record)
+    recorder = TraceRecorder(args.record)
+    start_task(recorder.run(snapshot_tree))
+
+
+async def snapshot_tree():
+    tree_requests.inc(reason='record')
+    root = await i3.get_tree()
+    outputs = await i3.get_outputs()
+    return root.ipc_data, [o.ipc_data for o in outputs]
+
+
+def record_event(event, e):
+    if recorder is not None:
+        recorder.record(event, e)
+
+
+async def on_output(i3, e):
+    events_received.inc(type='output')
+    record_event('output', e)
+    await init_screen_size()
+
 
 def on_workspace(i3, e):
-    global global_updates_running, loop_interval
+    events_received.inc(type='workspace')
+    record_event('workspace', e)
+    tree.on_workspace(e)
+    schedule_update(rate_limit_period=loop_interval, force=True)
+
+
+# i3 restarts or exits, the tree is fetched again once it is back
+def on_shutdown(i3, e):
+    events_received.inc(type='shutdown')
+    record_event('shutdown', e)
+    tree.invalidate()
+
+
+def on_window(i3, e):
+    events_received.inc(type=f'window::{e.change}')
+    record_event('window', e)
+    tree.on_window(e)
+    debouncer = debouncers.get(f'window::{e.change}')
+    if debouncer is not None:
+        debouncer()
+
+
+# Policies are validated with the other settings, see get_debounce()
+def init_debouncers():
+    reset_debouncers()
+
+    for event in window_events:
+        period, mode, max_wait = settings.debounce[event]
+        debouncers[event] = Debounce(period, schedule_update, mode, max_wait)
+
+
+def reset_debouncers():
+    for debouncer in debouncers.values():
+        debouncer.reset()
+
+
+def log_debounce_stats():
+    for event, debouncer in debouncers.items():
+        logging.info("Debounce %s: %s", event, debouncer.stats())
+
+
+# Prevent screenshots from being taken too fast and capturing the still
+# unchanged workspace instead of the new one. A newer request replaces a
+# pending one instead of queueing behind it.
+def schedule_update(rate_limit_period=None, force=False):
+    global pending_update, update_requested
+
+    if pending_update is not None:
+        handle, pending_period, pending_force = pending_update
+        handle.cancel()
+        force = force or pending_force
+        if pending_period is None or rate_limit_period is None:
+            rate_limit_period = None
+        else:
+            rate_limit_period = min(rate_limit_period, pending_period)
+
+    # In adaptive mode the delay only groups requests, waiting for the screen
+    # to settle is left to the capture
+    if settings.Capture.settle_mode == 'adaptive':
+        delay = settings.Capture.settle_interval
+    else:
+        delay = settings.Capture.screenshot_delay
+
+    update_requested = time.perf_counter()
+    handle = loop.call_later(
+        delay, start_update, rate_limit_period, force)
+    pending_update = (handle, rate_limit_period, force)
+
+
+def start_update(rate_limit_period, force):
+    global pending_update
+
+    pending_update = None
+    start_task(update_state(
+        i3, rate_limit_period=rate_limit_period, force=force))
+
+
+def cancel_pending_update():
+    global pending_update
+
+    if pending_update is not None:
+        pending_update[0].cancel()
+        pending_update = None
 
-    # global_updates_running = True
-    update_state(i3, rate_limit_period=loop_interval, force=True)
 
-def tree_hash(workspace):
+async def write_metrics_loop():
+    while True:
+        path = os.path.expanduser(settings.Daemon.metrics_file)
+        if path:
+            # A failed write must not end the loop, the next one may work
+            try:
+                await loop.run_in_executor(None, registry.write, path)
+            except Exception:
+                logging.exception("Failed to write metrics to %s", path)
+        await asyncio.sleep(settings.Daemon.metrics_interval)
+
+
+async def forced_update_loop():
+    while True:
+        await asyncio.sleep(loop_interval)
+        await verify_tree()
+        await update_state(i3, rate_limit_period=loop_interval, force=True)
+
+# Focus only moves within i3, it is left out when checking whether a saved
+# thumbnail still matches the windows of its workspace
+def tree_hash(workspace, focus=True):
     state = 0
     for con in workspace.leaves():
-        f = 31 if con.focused else 0  # so focus change can be detected
+        f = 31 if focus and con.focused else 0  # so focus change can be detected
         state += con.id % (con.rect.x + con.rect.y + con.rect.width + con.rect.height + f)
 
     logging.debug("Tree hash for workspace %s: %s", workspace.num, state)
@@ -214,97 +957,427 @@ def tree_hash(workspace):
 def tree_has_changed(workspace):
     state = tree_hash(workspace)
 
-    if global_knowledge[workspace.num]['state'] == state:
+    if knowledge.current().workspaces[workspace.num].state == state:
         return False
     else:
-        global_knowledge[workspace.num]['state'] = state
+        knowledge.update(workspace.num, state=state)
         return True
 
 
 def should_update(rate_limit_period, current_workspace, force):
     if not global_updates_running:
+        captures_skipped.inc(reason='ui_open')
         return False
-    elif rate_limit_period is not None and time.time() - global_knowledge[current_workspace.num]['last_update'] <= rate_limit_period:
+    elif rate_limit_period is not None and time.time() - knowledge.current().workspaces[current_workspace.num].last_update <= rate_limit_period:
+        captures_skipped.inc(reason='rate_limit')
         return False
     elif force:
-        update_debounced.reset()
+        reset_debouncers()
         tree_has_changed(current_workspace)
         return True
     elif not tree_has_changed(current_workspace):
+        captures_skipped.inc(reason='unchanged_tree')
         return False
 
     return True
 
 
-def update_state(i3, e=None, rate_limit_period=None, force=False):
-    # Prevent screenshoft from being takes too fast and capturing
-    # the still unchanged workspace instead of the new one
-    time.sleep(config.getfloat('Capture', 'screenshot_delay'))
+async def update_state(i3, e=None, rate_limit_period=None, force=False):
+    async with update_lock:
+        await update_state_locked(i3, rate_limit_period, force)
+
 
-    global last_update
+async def update_state_locked(i3, rate_limit_period, force):
+    global update_requested
 
-    root = i3.get_tree()
-    current_workspace = root.find_focused().workspace()
+    # Forced updates are not tied to an event and have no delay to report
+    requested = update_requested
+    update_requested = None
+
+    current_workspace = await get_focused_workspace()
 
     update_workspace(current_workspace)
+    if settings.Capture.window_crops and global_updates_running:
+        await recompose_hidden(i3)
     if should_update(rate_limit_period, current_workspace, force):
         logging.debug("Update state for workspace %s", current_workspace.num)
-        
-        workspaces = [w.num for w in root.workspaces()]
-        deleted = []
-        for num in global_knowledge:
-            if type(num) is int and num not in workspaces:
-                deleted.append(num)
-        for num in deleted:
-            del global_knowledge[num]
-
-        global_knowledge[current_workspace.num]['screenshot'] = grab_screen()
-        global_knowledge[current_workspace.num]['last_update'] = time.time()
-
-
-def get_hovered_frame(mpos, frames):
-    for frame in frames:
-        if mpos[0] > frame['ul'].x \
-                and mpos[0] < frame['br'].x \
-                and mpos[1] > frame['ul'].y \
-                and mpos[1] < frame['br'].y:
-            return frame['ws_num']
+
+        workspaces = [w.num for w in await get_workspaces(layout=False)]
+        deleted = knowledge.remove(
+            [num for num in knowledge.current().workspaces
+             if num not in workspaces])
+        for record in deleted:
+            if thumbnail_cache is not None:
+                thumbnail_cache.remove(record.name)
+            thumbnails.remove(record.num)
+            render_cache.invalidate(record.num)
+            settle_tracker.forget(record.num)
+
+        rect = await get_capture_rect(i3, current_workspace)
+        if settings.Capture.settle_mode == 'adaptive':
+            captured = await capture_settled(
+                rect, current_workspace, requested)
+        else:
+            if requested is not None:
+                delay = time.perf_counter() - requested
+                capture_delay_seconds.observe(delay, mode='fixed')
+                settle_tracker.record(delay)
+            # Grabbing and downsampling block, keep them off the event loop
+            captured = await loop.run_in_executor(
+                None, capture_workspace, rect, current_workspace)
+        if not captured:
+            return
+
+        if settings.Capture.window_crops:
+            await loop.run_in_executor(
+                None, store_window_crops, rect, current_workspace)
+        persist_thumbnail(current_workspace)
+
+        render_cache.invalidate(current_workspace.num)
+        await loop.run_in_executor(None, refresh_overview)
+        logging.debug("Thumbnail memory: %s, timing: %s",
+                      thumbnails.usage(), thumbnails.timing())
+        knowledge.update(current_workspace.num, last_update=time.time())
+
+
+# Capture once the screen stopped changing instead of after a fixed delay.
+# Frames still showing the previously captured workspace and frames that
+# changed while being captured are rejected.
+async def capture_settled(rect, workspace, requested):
+    retries = settings.Capture.settle_retries
+    if requested is None:
+        requested = time.perf_counter()
+
+    for _ in range(retries + 1):
+        probe, result = await wait_for_settle(rect, workspace, requested)
+        delay = time.perf_counter() - requested
+
+        captured = await loop.run_in_executor(
+            None, capture_workspace, rect, workspace, probe)
+        if captured:
+            break
+        result = 'torn'
+
+    logging.debug("Workspace %s %s after %.0f ms", workspace.num, result,
+                  delay * 1000)
+    capture_delay_seconds.observe(delay, mode='adaptive')
+    settle_results.inc(result=result)
+    settle_tracker.record(delay, result)
+    if captured and probe is not None:
+        settle_tracker.captured(rect, workspace.num, probe)
+    return captured
+
+
+# Probe until two consecutive probes match or settle_timeout passes. Returns
+# the last probe and how the wait ended.
+async def wait_for_settle(rect, workspace, requested):
+    interval = settings.Capture.settle_interval
+    timeout = settings.Capture.settle_timeout
+    threshold = settings.Capture.settle_threshold
+
+    # Empty workspaces often look alike, do not mistake them for stale
+    check_stale = bool(workspace.leaves())
+
+    # Start probing shortly before this workspace usually settles
+    wait = settle_tracker.estimate(workspace.num) - interval \
+        - (time.perf_counter() - requested)
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+    previous = None
+    stale = False
+    while True:
+        probe = await loop.run_in_executor(None, grab_probe, rect)
+        if probe is None:
+            return (None, 'timeout')
+        elapsed = time.perf_counter() - requested
+
+        if previous is not None and difference(previous[1], probe) <= threshold:
+            stale = check_stale and settle_tracker.is_stale(
+                rect, workspace.num, probe, threshold)
+            if not stale:
+                settle_tracker.learn(workspace.num, previous[0])
+                return (probe, 'settled')
+
+        if elapsed >= timeout:
+            return (probe, 'stale' if stale else 'timeout')
+
+        previous = (elapsed, probe)
+        await asyncio.sleep(interval)
+
+
+# Keep the image of every window of a freshly captured workspace, so that its
+# thumbnail can be redrawn when its windows change while it is not visible
+def store_window_crops(rect, workspace):
+    thumb = thumbnails.get_largest(workspace.num)
+    if thumb is None:
+        return
+
+    layout = get_layout(workspace)
+    crops = crop_windows(thumb, rect, layout)
+    with window_images_lock:
+        window_images.update(crops)
+    knowledge.update(workspace.num, windows=layout, rect=rect)
+
+
+async def recompose_hidden(i3):
+    workspaces = await get_workspaces()
+    visible = {o.current_workspace for o in await i3.get_outputs() if o.active}
+    recomposed = await loop.run_in_executor(
+        None, recompose_workspaces, workspaces, visible)
+
+    for num in recomposed:
+        render_cache.invalidate(num)
+    if recomposed:
+        await loop.run_in_executor(None, refresh_overview)
+
+
+# Redraw the thumbnails of hidden workspaces whose windows moved, floated or
+# closed from the images of their windows instead of capturing them again
+def recompose_workspaces(workspaces, visible):
+    background = tuple(get_ui_color('bgcolor'))[:3]
+    sizes = get_thumbnail_sizes()
+
+    recomposed = []
+    alive = set()
+    snapshot = knowledge.current()
+    with window_images_lock:
+        images = dict(window_images)
+    for workspace in workspaces:
+        layout = get_layout(workspace)
+        alive.update(layout)
+
+        record = snapshot.workspaces.get(workspace.num)
+        if workspace.name in visible or record is None \
+                or record.rect is None \
+                or record.windows == layout \
+                or not thumbnails.has(workspace.num):
+            continue
+
+        logging.debug("Recomposing workspace %s", workspace.num)
+        thumb = compose(thumbnails.get_largest(workspace.num), record.rect,
+                        record.windows, layout, images, background)
+        thumbnails.put(workspace.num, thumb, sizes, mode='RGB')
+        knowledge.update(workspace.num, windows=layout)
+        captures_taken.inc(kind='recompose')
+        recomposed.append(workspace.num)
+
+    # Windows that no longer exist will not be drawn again
+    with window_images_lock:
+        for con_id in list(window_images):
+            if con_id not in alive:
+                del window_images[con_id]
+
+    return recomposed
+
+
+def get_thumbnail_sizes():
+    window_width = settings.UI.window_width
+    window_height = settings.UI.window_height
+    preview_percent = settings.Capture.preview_percent
+
+    sizes = {TILE: init_geometry(window_width, window_height).inner}
+    if preview_percent > 0:
+        sizes[PREVIEW] = Dimension(
+            round(window_width * preview_percent / 100),
+            round(window_height * preview_percent / 100))
+
+    return sizes
+
+
+def get_hovered_frame(mpos, frames, g):
+    idx = g.cell_at(mpos[0], mpos[1])
+    if idx is None or idx >= len(frames):
+        return None
+
+    frame = frames[idx]
+    if mpos[0] > frame['ul'].x \
+            and mpos[0] < frame['br'].x \
+            and mpos[1] > frame['ul'].y \
+            and mpos[1] < frame['br'].y:
+        return frame['ws_num']
     return None
 
 
-def show_ui(source):
+def get_workspace_ids(snapshot=None):
+    snapshot = snapshot or knowledge.current()
+    return sorted(snapshot.workspaces)
+
+
+def get_page_count(snapshot=None):
+    page_size = settings.UI.workspaces
+    return max(1, math.ceil(len(get_workspace_ids(snapshot)) / page_size))
+
+
+def get_page_of(ws_num, snapshot=None):
+    workspace_ids = get_workspace_ids(snapshot)
+    if ws_num not in workspace_ids:
+        return 0
+    return workspace_ids.index(ws_num) // settings.UI.workspaces
+
+
+def invalidate_overview():
+    global overview
+
+    with overview_lock:
+        overview = None
+
+
+def get_tile_state(t):
+    return (t['version'], t['captured'], tuple(t['frame']), t['name'])
+
+
+# Keep a page of the expo drawn off-screen so that showing it is a single
+# blit. Only tiles whose workspace changed are redrawn, unless the page, the
+# set of workspaces on it or the window size changed.
+def refresh_overview(page=None):
+    global overview
+
+    window_width = settings.UI.window_width
+    window_height = settings.UI.window_height
+
+    init_fonts()
+    with overview_lock:
+        # Everything below is drawn from the same state, even if workspaces
+        # change meanwhile
+        snapshot = knowledge.current()
+        if page is None:
+            page = overview['page'] if overview is not None else 0
+        pages = get_page_count(snapshot)
+        page = min(page, pages - 1)
+
+        geometry = init_geometry(window_width, window_height, snapshot)
+
+        if overview is None:
+            surface = pygame.Surface((window_width, window_height))
+        else:
+            surface = overview['surface']
+
+        tiles = init_tiles(surface, page, snapshot)
+        layout = ([t['ws_num'] for t in tiles], page, pages,
+                  window_width, window_height, geometry.grid.x,
+                  geometry.grid.y)
+
+        if overview is None or overview['layout'] != layout:
+            draw_tiles(surface, tiles, geometry)
+            draw_page_indicator(surface, geometry, page, pages)
+        else:
+            changed = []
+            for idx, t in enumerate(tiles):
+                old = overview['tiles'][idx]
+                if get_tile_state(old) == get_tile_state(t):
+                    tiles[idx] = old
+                else:
+                    changed.append(idx)
+
+            prepared = prepare_tiles([tiles[i] for i in changed], geometry)
+            for idx, p in zip(changed, prepared):
+                cleared = draw_tile(surface, idx, tiles[idx], geometry, p,
+                                    clear=True)
+                # Clearing the bottom row also clears part of the indicator,
+                # which is drawn over the names as in a full redraw
+                surface.set_clip(cleared)
+                draw_page_indicator(surface, geometry, page, pages)
+                surface.set_clip(None)
+
+        overview = {
+            'surface': surface,
+            'tiles': tiles,
+            'geometry': geometry,
+            'layout': layout,
+            'page': page,
+            'pages': pages
+        }
+        return overview
+
+
+def init_fonts():
+    if not pygame.font.get_init():
+        pygame.font.init()
+
+
+def draw_page_indicator(screen, g, page, pages):
+    if pages < 2:
+        return
+
+    names_font = settings.UI.names_font
+    names_fontsize = settings.UI.names_fontsize
+    names_color = get_ui_color('names_color')
+
+    font = render_cache.get_font(
+        (names_font, names_fontsize),
+        lambda: pygame.font.SysFont(names_font, names_fontsize))
+    label = font.render(f'{page + 1} / {pages}', True, names_color)
+    screen.blit(label, (
+        round((g.total.x - label.get_width()) / 2),
+        round(g.total.y - (g.pad.y + label.get_height()) / 2)
+    ))
+
+
+def present_page(screen, page):
+    current = refresh_overview(page)
+    screen.blit(current['surface'], (0, 0))
+    pygame.display.flip()
+
+    for t in current['tiles']:
+        t['active'] = False
+        t.pop('live', None)
+        thumbnails.touch(t['ws_num'])
+
+    return current
+
+
+def show_ui(source, requested, on_shown=None, on_closed=None):
     global global_updates_running
 
+    elapsed = None
     try:
-        window_width = config.getint('UI', 'window_width')
-        window_height = config.getint('UI', 'window_height')
+        window_width = settings.UI.window_width
+        window_height = settings.UI.window_height
 
         pygame.display.init()
-        pygame.font.init()
+        init_fonts()
         screen = pygame.display.set_mode(
             (window_width, window_height), pygame.FULLSCREEN)
         pygame.display.set_caption('i3expo')
 
-        geometry = init_geometry(screen)
-        tiles = init_tiles(screen)
-        draw_tiles(screen, tiles, geometry)
-
-        pygame.display.flip()
-        input_loop(screen, source, tiles, geometry.grid.x)
+        snapshot = knowledge.current()
+        page = get_page_of(snapshot.active, snapshot)
+        current = present_page(screen, page)
+        elapsed = (time.perf_counter() - requested) * 1000
+        open_seconds.observe(elapsed / 1000)
+        logging.info("Showed first frame %.1f ms after request", elapsed)
+        if on_shown is not None:
+            on_shown(elapsed)
+
+        start_live()
+        input_loop(screen, source, current)
     except Exception:
         logging.exception("Failed to show UI")
     finally:
+        if elapsed is None and on_shown is not None:
+            on_shown(None)
         logging.info("Closing UI")
+        log_live_stats()
         pygame.display.quit()
         pygame.display.init()  # Allows for faster launching
-        global_updates_running = True
+        # Unless hide() closed the overview and already turned them back on
+        if not global_updates_running:
+            global_updates_running = True
+        if on_closed is not None:
+            on_closed()
+
 
+def input_loop(screen, source, current):
+    tiles = current['tiles']
+    g = current['geometry']
+    page = current['page']
 
-def input_loop(screen, source, tiles, columns):
     running = True
     use_mouse = True
 
     selected_id = 0
+    active_frame = None
     while running:
         if global_updates_running:
             logging.info("Global updates is running")
@@ -314,10 +1387,22 @@ def input_loop(screen, source, tiles, columns):
             logging.info("Display is not initialised")
             break
 
+        # Every event of a batch counts, so that fast key repeats and wheel
+        # scrolling do not lose steps
         jump = False
         kbdmove = (0, 0)
-
-        for event in pygame.event.get():
+        pagemove = 0
+
+        # Sleep until there is input, waking up regularly in case the UI was
+        # closed from outside without an event being posted, or when the next
+        # live frame is due
+        timeout = ui_wake_interval
+        if live_pacer is not None:
+            timeout = min(timeout, max(1, round(live_pacer.timeout() * 1000)))
+        events = [pygame.event.wait(timeout)]
+        events += pygame.event.get()
+
+        for event in events:
             if event.type == pygame.QUIT:
                 logging.info("Received pygame.QUIT")
                 running = False
@@ -327,87 +1412,218 @@ def input_loop(screen, source, tiles, columns):
                 use_mouse = False
 
                 if event.key == pygame.K_UP or event.key == pygame.K_k:
-                    kbdmove = (0, -1)
+                    kbdmove = (kbdmove[0], kbdmove[1] - 1)
                 if event.key == pygame.K_DOWN or event.key == pygame.K_j:
-                    kbdmove = (0, 1)
+                    kbdmove = (kbdmove[0], kbdmove[1] + 1)
                 if event.key == pygame.K_LEFT or event.key == pygame.K_h:
-                    kbdmove = (-1, 0)
+                    kbdmove = (kbdmove[0] - 1, kbdmove[1])
                 if event.key == pygame.K_RIGHT or event.key == pygame.K_l:
-                    kbdmove = (1, 0)
+                    kbdmove = (kbdmove[0] + 1, kbdmove[1])
+                if event.key == pygame.K_PAGEUP:
+                    pagemove -= 1
+                if event.key == pygame.K_PAGEDOWN:
+                    pagemove += 1
                 if event.key == pygame.K_RETURN:
                     jump = True
                 if event.key == pygame.K_ESCAPE:
                     logging.debug("ESCAPE key pressed")
                     running = False
-                pygame.event.clear()
-                break
+
+            elif event.type == pygame.MOUSEWHEEL:
+                pagemove += -1 if event.y > 0 else 1
 
             elif event.type == pygame.MOUSEBUTTONUP:
                 use_mouse = True
                 if event.button == 1:
                     jump = True
-                pygame.event.clear()
+
+            # Whatever follows a selection or closing the overview is moot
+            if jump or not running:
                 break
 
+        # Only the current page is drawn, flipping pages rebuilds the
+        # overview for the new one
+        pages = current['pages']
+        if pagemove and pages > 1:
+            page = (page + pagemove) % pages
+            current = present_page(screen, page)
+            tiles = current['tiles']
+            g = current['geometry']
+            selected_id = 0
+            active_frame = None
+            logging.debug("Showing page %s of %s", page + 1, pages)
+
         if use_mouse:
             mpos = pygame.mouse.get_pos()
-            active_frame = get_hovered_frame(mpos, tiles)
+            active_frame = get_hovered_frame(mpos, tiles, g)
             logging.debug("Mouse selected: %s", active_frame)
         elif kbdmove != (0, 0):
-            if kbdmove[0] != 0:
-                selected_id += kbdmove[0]
-            elif kbdmove[1] != 0:
-                selected_id += kbdmove[1] * columns
-
-            if selected_id >= len(tiles):
-                selected_id -= len(tiles)
-            elif selected_id < 0:
-                selected_id += len(tiles)
+            selected_id += kbdmove[0] + kbdmove[1] * g.grid.x
+            selected_id %= len(tiles)
 
             active_frame = tiles[selected_id]['ws_num']
             logging.debug("Keyboard selected: %s", active_frame)
 
 
         if jump:
-            if active_frame in global_knowledge.keys():
+            if active_frame in knowledge.current().workspaces:
                 logging.info('Switching to workspace %s', active_frame)
-                i3.command(f'workspace number {active_frame}')
+                i3_command(f'workspace number {active_frame}')
                 break
 
         elif not running and args.dedicated:
             logging.info('Exiting expo and switching to workspace %s', source)
-            i3.command('workspace ' + source)
+            i3_command('workspace ' + source)
 
+        dirty = []
         for tile in tiles:
             if tile['active'] and not tile['ws_num'] == active_frame:
-                screen.blit(tile['mouseoff'], (tile['ul'].x, tile['ul'].y))
-                tile['active'] = False
+                dirty.append(highlight_tile(screen, tile, False, g))
 
             if not tile['active'] and tile['ws_num'] == active_frame:
-                screen.blit(tile['mouseon'], (tile['ul'].x, tile['ul'].y))
-                tile['active'] = True
+                dirty.append(highlight_tile(screen, tile, True, g))
+
+        live_start = None
+        if live_pacer is not None and live_pacer.due():
+            live_start = time.perf_counter()
+            dirty += draw_live_tiles(screen, tiles, g)
+
+        if dirty:
+            pygame.display.update(dirty)
+
+        if live_start is not None:
+            live_end = time.perf_counter()
+            live_pacer.record(live_start, live_end)
+            live_frame_seconds.observe(live_end - live_start)
+
+    # Input meant for the overview must not reach it when it opens again
+    if pygame.display.get_init():
+        pygame.event.clear()
+
+
+# The expo covers the output it is shown on, so only workspaces visible on
+# the other outputs can be captured while it is open
+async def init_live_targets(source):
+    live_targets.clear()
+    if settings.UI.live_fps <= 0:
+        return
+
+    nums = {record.name: num
+            for num, record in knowledge.current().workspaces.items()}
+    for output in await i3.get_outputs():
+        num = nums.get(output.current_workspace)
+        if output.active and output.current_workspace != source \
+                and num is not None:
+            r = output.rect
+            live_targets[num] = Rect(r.x, r.y, r.width, r.height)
+
+
+def collect_live_fps():
+    if live_pacer is None or global_updates_running:
+        return []
+    fps = live_pacer.fps()
+    return [({}, fps)] if fps is not None else []
+
+
+def start_live():
+    global live_pacer
+
+    live_pacer = None
+    if not live_targets:
+        return
+
+    budget = min(max(settings.UI.live_budget_percent, 1), 100) / 100
+    live_pacer = FramePacer(settings.UI.live_fps, budget)
+    logging.info("Live updates for workspaces %s at %s fps",
+                 sorted(live_targets), settings.UI.live_fps)
+
+
+def log_live_stats():
+    if live_pacer is None:
+        return
+
+    stats = live_pacer.stats()
+    if stats['frames']:
+        logging.info("Live updates: %.1f fps, median frame %.2f ms, "
+                     "%s of %s frames over the %.1f ms budget",
+                     stats['fps'] or 0, stats['median_frame_ms'],
+                     stats['over_budget'], stats['frames'], stats['budget_ms'])
+
+
+# Redraw the live tiles of the page from captures sampled straight down to
+# the tile size, returning the rectangles that changed
+def draw_live_tiles(screen, tiles, g):
+    dirty = []
+    for t in tiles:
+        rect = live_targets.get(t['ws_num'])
+        if rect is None or t['ul'] is None:
+            continue
+
+        width, height = t['image'].get_size()
+        length = width * height * 4
+        buffer = live_buffers.get(t['ws_num'])
+        if buffer is None or len(buffer) != length:
+            buffer = (ctypes.c_ubyte*length)()
+            live_buffers[t['ws_num']] = buffer
+
+        if grab_probe(rect, (width, height), buffer) is None:
+            continue
+        capture_bytes.inc(length)
+        # Probes are opaque, the padding byte is always 0xff
+        t['live'] = pygame.image.frombuffer(buffer, (width, height), 'BGRA')
+        dirty.append(highlight_tile(screen, t, t['active'], g))
+
+    return dirty
+
+
+# Tiles keep a single surface, the highlight is blended over it when shown
+# using a mask shared by every tile
+def highlight_tile(screen, tile, on, g):
+    image = tile.get('live', tile['image'])
+    rect = screen.blit(image, (tile['ul'].x, tile['ul'].y))
+    if on:
+        screen.blit(get_lightmask(g), rect,
+                    (0, 0, rect.width, rect.height))
+    tile['active'] = on
+    return rect
+
+
+def get_lightmask(g):
+    highlight_percentage = settings.UI.highlight_percentage
+
+    def build():
+        lightmask = pygame.Surface((g.inner.x, g.inner.y), pygame.SRCALPHA, 32)
+        lightmask.fill((255, 255, 255, 255 * highlight_percentage / 100))
+        return lightmask
+
+    return render_cache.get_label(
+        ('lightmask', g.inner.x, g.inner.y, highlight_percentage), build)
 
-        pygame.display.update()
-        pygame.time.wait(25)
 
+# Interrupt the blocking wait in input_loop
+def wake_ui():
+    if pygame.display.get_init():
+        pygame.event.post(pygame.event.Event(pygame.USEREVENT))
 
-def init_geometry(screen):
+
+def init_geometry(width, height, snapshot=None):
     g = Geometry()
+    snapshot = snapshot or knowledge.current()
 
-    workspaces = config.getint('UI', 'workspaces')
-    max_grid_x = config.getint('UI', 'grid_x')
+    workspaces = settings.UI.workspaces
+    max_grid_x = settings.UI.grid_x
 
-    padding_x = config.getint('UI', 'padding_percent_x')
-    padding_y = config.getint('UI', 'padding_percent_y')
-    spacing_x = config.getint('UI', 'spacing_percent_x')
-    spacing_y = config.getint('UI', 'spacing_percent_y')
-    frame_width = config.getint('UI', 'frame_width_px')
+    padding_x = settings.UI.padding_percent_x
+    padding_y = settings.UI.padding_percent_y
+    spacing_x = settings.UI.spacing_percent_x
+    spacing_y = settings.UI.spacing_percent_y
+    frame_width = settings.UI.frame_width_px
 
-    g.total.x = screen.get_width()
-    g.total.y = screen.get_height()
+    g.total.x = width
+    g.total.y = height
     logging.debug('total_x=%s total_y=%s', g.total.x, g.total.y)
 
-    n_workspaces = min(workspaces, len(global_knowledge) - 1)
+    n_workspaces = max(1, min(workspaces, len(snapshot.workspaces)))
 
     g.grid.x = min(max_grid_x, n_workspaces)
     g.grid.y = math.ceil(n_workspaces / max_grid_x)
@@ -446,95 +1662,129 @@ def init_geometry(screen):
 
 
 def autosize_image(g, image):
-    result = Dimension()
-    offset = Dimension()
-
     image_size = image.get_rect().size
-    image_dim = Dimension(image_size[0], image_size[1])
-    ratio = g.inner / image_dim
-    if ratio.x < ratio.y:
-        result.set(g.inner.x, round(ratio.x * image_dim.y))
-        offset.set(0, round((g.inner.y - result.y) / 2))
-    else:
-        result.set(round(ratio.y * image_dim.x), g.inner.y)
-        offset.set(round((g.inner.x - result.x) / 2), 0)
+    result = g.inner.fit(Dimension(image_size[0], image_size[1]))
+    offset = Dimension(round((g.inner.x - result.x) / 2),
+                       round((g.inner.y - result.y) / 2))
 
-    resized = pygame.transform.smoothscale(image, (result.x, result.y))
+    with scaling_seconds.time():
+        resized = pygame.transform.smoothscale(image, (result.x, result.y))
 
     return (resized, result, offset)
 
 
 def draw_tiles(screen, tiles, g):
-    highlight_percentage = config.getint('UI', 'highlight_percentage')
-    bgcolor = config.getcolor('UI', 'bgcolor')
+    bgcolor = get_ui_color('bgcolor')
 
+    prepared = prepare_tiles(tiles, g)
     screen.fill(bgcolor)
 
     for idx, t in enumerate(tiles):
-        x = math.floor(idx % g.grid.x)
-        y = math.floor(idx / g.grid.x)
-
-        origin = Dimension(
-            g.pad.x + g.offset.x * x,
-            g.pad.y + g.offset.y * y
-        )
-        result = Dimension()
-        offset = Dimension()
-
-        if t['screenshot']:
-            t['img'] = process_image(t['screenshot'])
-
-        (image, result, offset) = autosize_image(g, t['img'])
-        t['ul'] = origin + g.frame + offset
-        t['br'] = origin + g.frame + offset + result
-
-        screen.fill(t['frame'],
-                    (
-                        origin.x + offset.x,
-                        origin.y + offset.y,
-                        result.x + g.frame * 2,
-                        result.y + g.frame * 2,
-        ))
+        draw_tile(screen, idx, t, g, prepared[idx])
 
-        if t['tile']:
-            screen.fill(t['tile'],
-                        (
-                            origin.x + g.frame + offset.x,
-                            origin.y + g.frame + offset.y,
-                            result.x,
-                            result.y,
-            ))
-
-        screen.blit(image, (origin.x + g.frame + offset.x,
-                            origin.y + g.frame + offset.y))
-
-        mouseoff = screen.subsurface(
-            (origin.x + g.frame + offset.x, origin.y +
-             g.frame + offset.y, result.x, result.y)
-        ).copy()
-        lightmask = pygame.Surface((result.x, result.y), pygame.SRCALPHA, 32)
-        lightmask.convert_alpha()
-        lightmask.fill((255, 255, 255, 255 * highlight_percentage / 100))
-        mouseon = mouseoff.copy()
-        mouseon.blit(lightmask, (0, 0))
 
-        t['mouseon'] = mouseon.copy()
-        t['mouseoff'] = mouseoff.copy()
+# Start preparing every tile on the render pool, then collect the results in
+# grid order so that drawing is left with nothing but blits
+def prepare_tiles(tiles, g):
+    if render_pool is None:
+        configure_render_pool()
+
+    futures = [get_tile_image(g, t) for t in tiles]
+    return [get_prepared_tile(t, f) for t, f in zip(tiles, futures)]
 
-        draw_name(screen, t['ws_num'], origin, offset, result, g.frame)
 
+def get_prepared_tile(t, future):
+    try:
+        return future.result()
+    except Exception:
+        # Do not keep serving a failed preparation from the cache
+        render_cache.invalidate(t['ws_num'])
+        raise
+
+
+def draw_tile(screen, idx, t, g, prepared, clear=False):
+    x = math.floor(idx % g.grid.x)
+    y = math.floor(idx / g.grid.x)
+
+    origin = Dimension(
+        g.pad.x + g.offset.x * x,
+        g.pad.y + g.offset.y * y
+    )
+
+    cleared = None
+    if clear:
+        # The name is drawn in the spacing below the tile
+        cleared = pygame.Rect(origin.x, origin.y, g.outer.x, g.offset.y)
+        screen.fill(get_ui_color('bgcolor'), cleared)
+
+    (image, result, offset) = prepared
+    t['ul'] = origin + g.frame + offset
+    t['br'] = origin + g.frame + offset + result
+
+    screen.fill(t['frame'],
+                (
+                    origin.x + offset.x,
+                    origin.y + offset.y,
+                    result.x + g.frame * 2,
+                    result.y + g.frame * 2,
+    ))
 
-def init_tiles(screen):
-    logging.debug("Workspace data: %s", global_knowledge)
+    screen.blit(image, (origin.x + g.frame + offset.x,
+                        origin.y + g.frame + offset.y))
+
+    t['image'] = image
+
+    draw_name(screen, t['name'], origin, offset, result, g.frame)
+    return cleared
+
+
+def get_tile_image(g, t):
+    # Scaled images only change when the workspace is recaptured or the
+    # geometry changes, so reuse them across openings
+    key = (t['version'] if t['captured'] else None, g.inner.x, g.inner.y,
+           t['tile'])
+
+    return render_cache.get_tile(t['ws_num'], key, lambda: render_pool.submit(
+        prepare_tile, g, t))
+
+
+# Produce the scaled tile. Runs on the render pool, so it must not touch the
+# screen or any shared state.
+def prepare_tile(g, t):
+    if t['captured']:
+        image = process_image(thumbnails.get(t['ws_num']))
+    else:
+        image = t['img']
+    (image, result, offset) = autosize_image(g, image)
 
-    frame_active_color = config.getcolor('UI', 'frame_active_color')
-    frame_inactive_color = config.getcolor('UI', 'frame_inactive_color')
-    frame_missing_color = config.getcolor('UI', 'frame_missing_color')
-    tile_missing_color = config.getcolor('UI', 'tile_missing_color')
+    # Flatten missing tiles onto their background so the tile can be
+    # restored with a single blit after highlighting
+    if t['tile']:
+        tile = pygame.Surface((result.x, result.y))
+        tile.fill(t['tile'])
+        tile.blit(image, (0, 0))
+        image = tile
 
-    missing_tile = draw_missing_tile(screen)
+    return (image, result, offset)
 
-    workspace_ids = [w for w in global_knowledge if w != 'active']
+
+def init_tiles(screen, page=0, snapshot=None):
+    snapshot = snapshot or knowledge.current()
+    logging.debug("Workspace data: %s", snapshot)
+
+    frame_active_color = get_ui_color('frame_active_color')
+    frame_inactive_color = get_ui_color('frame_inactive_color')
+    frame_missing_color = get_ui_color('frame_missing_color')
+    tile_missing_color = get_ui_color('tile_missing_color')
+
+    missing_tile = render_cache.get_label(
+        ('?', screen.get_width(), screen.get_height()),
+        lambda: draw_missing_tile(screen))
+
+    # Only the workspaces on the shown page are turned into tiles
+    page_size = settings.UI.workspaces
+    workspace_ids = get_workspace_ids(snapshot)[
+        page * page_size:(page + 1) * page_size]
 
     tiles = []
     for i in range(len(workspace_ids)):
@@ -542,19 +1792,20 @@ def init_tiles(screen):
 
         t = {
             'active': False,
-            'mouseoff': None,
-            'mouseon': None,
+            'image': None,
             'ul': None,
             'br': None,
             'frame': None,
             'tile': None,
-            'screenshot': None,
-            'ws_num': index
+            'captured': False,
+            'version': thumbnails.version(index),
+            'ws_num': index,
+            'name': get_workspace_name(index, snapshot)
         }
 
-        if global_knowledge[index]['screenshot'] != None:
-            t['screenshot'] = global_knowledge[index]['screenshot']
-            if global_knowledge['active'] == index:
+        if thumbnails.has(index):
+            t['captured'] = True
+            if snapshot.active == index:
                 t['frame'] = frame_active_color
             else:
                 t['frame'] = frame_inactive_color
@@ -565,30 +1816,23 @@ def init_tiles(screen):
 
         tiles.append(t)
 
-    return sorted(tiles, key=lambda k: k['ws_num'])
+    return tiles
 
 
-def draw_name(screen, index, origin, offset, result, frame):
-    names_show = config.get('UI', 'names_show')
-    names_font = config.get('UI', 'names_font')
-    names_fontsize = config.getint('UI', 'names_fontsize')
-    names_color = config.getcolor('UI', 'names_color')
+def draw_name(screen, name, origin, offset, result, frame):
+    names_show = settings.UI.names_show
+    names_font = settings.UI.names_font
+    names_fontsize = settings.UI.names_fontsize
+    names_color = get_ui_color('names_color')
 
-    defined_name = False
-    try:
-        defined_name = config.get('Workspaces', f'workspace_{index}')
-    except:
-        pass
-
-    if names_show and (index in global_knowledge.keys() or defined_name):
-        if not defined_name:
-            name = global_knowledge[index]['name']
-        else:
-            name = defined_name
+    if names_show and name is not None:
+        font = render_cache.get_font(
+            (names_font, names_fontsize),
+            lambda: pygame.font.SysFont(names_font, names_fontsize))
 
-        font = pygame.font.SysFont(names_font, names_fontsize)
-
-        name = font.render(name, True, names_color)
+        name = render_cache.get_label(
+            (name, names_font, names_fontsize, tuple(names_color)),
+            lambda: font.render(name, True, names_color))
         name_width = name.get_rect().size[0]
         screen.blit(name, (
             origin.x + frame + offset.x +
@@ -598,12 +1842,21 @@ def draw_name(screen, index, origin, offset, result, frame):
         ))
 
 
+def get_workspace_name(index, snapshot=None):
+    snapshot = snapshot or knowledge.current()
+    defined_name = settings.workspace_names.get(index)
+    if defined_name:
+        return defined_name
+    elif index in snapshot.workspaces:
+        return snapshot.workspaces[index].name
+    return None
+
+
 def draw_missing_tile(screen):
     missing_x = screen.get_width() * 0.3
     missing_y = screen.get_height() * 0.3
 
     missing = pygame.Surface((missing_x, missing_y), pygame.SRCALPHA, 32)
-    missing = missing.convert_alpha()
     qm = pygame.font.SysFont(
         'sans-serif', int(missing_x * 0.5)).render('?', True, (150, 150, 150))  # RGB
     qm_size = qm.get_rect().size
@@ -630,46 +1883,75 @@ def setup_logging():
         format='[%(levelname)s] %(asctime)s: %(message)s', level=logLevel)
 
 
-def main():
-    global update_debounced
-    try:
-        setup_logging()
-        save_pid()
+async def run(started):
+    global i3, loop, loop_interval, update_lock, control_lock
 
-        signal.signal(signal.SIGINT, signal_quit)
-        signal.signal(signal.SIGTERM, signal_quit)
-        signal.signal(signal.SIGHUP, signal_reload)
-        signal.signal(signal.SIGUSR1, signal_show)
+    loop = asyncio.get_running_loop()
+    i3 = await i3ipc.aio.Connection(auto_reconnect=True).connect()
+    update_lock = asyncio.Lock()
+    control_lock = asyncio.Lock()
 
-        read_config()
+    loop.add_signal_handler(signal.SIGINT, signal_quit)
+    loop.add_signal_handler(signal.SIGTERM, signal_quit)
+    loop.add_signal_handler(signal.SIGHUP, signal_reload)
+    loop.add_signal_handler(signal.SIGUSR1, signal_show)
 
-        update_debounced = Debounce(config.getfloat(
-            'Daemon', 'debounce_period'), update_state)
+    init_debouncers()
 
-        init_knowledge()
-        update_state(i3, force=True)
+    await init_screen_size()
+    await init_knowledge()
 
-        # i3.on('workspace', workspace_event)
-        # i3.on('window::new', update_debounced)
-        # i3.on('window::close', update_debounced)
-        i3.on('window::move', update_debounced)
-        i3.on('window::floating', update_debounced)
-        i3.on('window::fullscreen_mode', update_debounced)
-        i3.on('window::focus', update_debounced)
-        i3.on('workspace', on_workspace)
+    for event in window_events + tree_events:
+        i3.on(event, on_window)
+    i3.on('workspace', on_workspace)
+    i3.on('shutdown', on_shutdown)
+    if args.record:
+        init_recorder()
+    i3.on('output', on_output)
 
-        logging.info("Starting main threads")
+    server = await start_control_server()
+    logging.info("Ready %.1f ms after start",
+                 (time.perf_counter() - started) * 1000)
 
-        i3_thread = Thread(target=i3.main)
-        i3_thread.daemon = True
-        i3_thread.start()
+    try:
+        # The first capture runs once the daemon already answers requests
+        await update_state(i3, force=True)
 
-        loop_interval = config.getfloat('Daemon', 'forced_update_interval')
-        while True:
-            time.sleep(loop_interval)
-            update_state(i3, rate_limit_period=loop_interval, force=True)
-    except SystemExit:
-        pass
+        logging.info("Starting main loop")
+
+        loop_interval = settings.Daemon.forced_update_interval
+        start_task(forced_update_loop())
+        start_task(write_metrics_loop())
+
+        await i3.main()
+    finally:
+        server.close()
+        remove_control_socket()
+        if recorder is not None:
+            recorder.close()
+
+
+def main():
+    global args
+
+    started = time.perf_counter()
+    args = parser.parse_args()
+    try:
+        setup_logging()
+        claim_control_socket()
+        save_pid()
+
+        read_config()
+        configure_thumbnails()
+        configure_render_pool()
+        init_thumbnail_cache()
+        init_capture()
+        init_damage()
+
+        asyncio.run(run(started))
+    except SystemExit as e:
+        if e.code:
+            raise
     except:
         logging.exception("An unknown exception has ocurred")
 
@@ -0,0 +1,64 @@
+from collections import namedtuple
+
+import ctypes
+
+MAX_RECTS = 64
+
+Rect = namedtuple('Rect', ['x', 'y', 'width', 'height'])
+
+
+def intersect(a, b):
+    x1 = max(a.x, b.x)
+    y1 = max(a.y, b.y)
+    x2 = min(a.x + a.width, b.x + b.width)
+    y2 = min(a.y + a.height, b.y + b.height)
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return Rect(x1, y1, x2 - x1, y2 - y1)
+
+
+def bounding_box(rects):
+    x1 = min(r.x for r in rects)
+    y1 = min(r.y for r in rects)
+    x2 = max(r.x + r.width for r in rects)
+    y2 = max(r.y + r.height for r in rects)
+    return Rect(x1, y1, x2 - x1, y2 - y1)
+
+
+class DamageTracker(object):
+
+    def __init__(self, lib):
+        self.lib = lib
+        self.lib.initDamage.restype = ctypes.c_int
+        self.lib.pollDamage.restype = ctypes.c_int
+        self.lib.pollDamage.argtypes = [
+            ctypes.POINTER(ctypes.c_int), ctypes.c_int]
+
+        self.available = bool(self.lib.initDamage())
+        # damage reported by X that lies outside every rectangle collected
+        # so far, e.g. on another output
+        self.pending = []
+        # capture rectangle -> workspace number last captured from it
+        self.captured = {}
+
+    # Return the parts of rect damaged since it was last collected
+    def collect(self, rect):
+        rects = (ctypes.c_int * (MAX_RECTS * 4))()
+        count = self.lib.pollDamage(rects, MAX_RECTS)
+        for i in range(count):
+            self.pending.append(Rect(*rects[i * 4:i * 4 + 4]))
+
+        damaged = []
+        remaining = []
+        for r in self.pending:
+            part = intersect(r, rect)
+            if part is not None:
+                damaged.append(part)
+            if part != r:
+                remaining.append(r)
+
+        if len(remaining) > MAX_RECTS:
+            remaining = [bounding_box(remaining)]
+        self.pending = remaining
+
+        return damaged
@@ -1,26 +1,80 @@
-from threading import Timer
+import asyncio
+
+MODES = ['leading', 'trailing', 'both']
 
 
 class Debounce(object):
 
-    def __init__(self, period, f):
-        # never call the wrapped function more often than this (in seconds)
+    def __init__(self, period, f, mode='trailing', max_wait=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown debounce mode: {mode}")
+
+        # calls closer than this (in seconds) are coalesced into one
         self.period = period
+        # never delay a pending call longer than this after the first one
+        self.max_wait = max_wait or None
         self.f = f
+        self.leading = mode in ['leading', 'both']
+        self.trailing = mode in ['trailing', 'both']
+
         self.t = None
+        self.started = None
+        self.pending = None
+
+        self.received = 0
+        self.coalesced = 0
+        self.fired = 0
 
     # force a reset of the timer, ie the next call will start new timer
     def reset(self):
         if self.t != None:
             self.t.cancel()
             self.t = None
+        self.drop_pending()
+
+    def drop_pending(self):
+        if self.pending is not None:
+            self.pending = None
+            self.coalesced += 1
+
+    def invoke(self, args, kwargs):
+        self.fired += 1
+        self.f(*args, **kwargs)
 
-    # TODO: do we want to call w/ first or last args?
+    def flush(self):
+        self.t = None
+        pending = self.pending
+        if pending is not None and self.trailing:
+            self.pending = None
+            self.invoke(*pending)
+        else:
+            self.drop_pending()
+
+    # The latest call wins: its arguments replace those of any pending call
     def __call__(self, *args, **kwargs):
-        def invoke():
-            self.t = None
-            self.f(*args, **kwargs)
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        self.received += 1
+
+        if self.t is None:
+            self.started = now
+            if self.leading:
+                self.invoke(args, kwargs)
+            else:
+                self.pending = (args, kwargs)
+        else:
+            self.t.cancel()
+            self.drop_pending()
+            self.pending = (args, kwargs)
+
+        delay = self.period
+        if self.max_wait is not None:
+            delay = max(0, min(delay, self.started + self.max_wait - now))
+        self.t = loop.call_later(delay, self.flush)
 
-        if self.t == None:
-            self.t = Timer(self.period, invoke)
-            self.t.start()
+    def stats(self):
+        return {
+            'received': self.received,
+            'coalesced': self.coalesced,
+            'fired': self.fired
+        }
@@ -1,3 +1,6 @@
+import math
+
+
 class Geometry:
     def __init__(self):
         self.total = Dimension()
@@ -9,6 +12,20 @@ class Geometry:
         self.offset = Dimension()
         self.frame = None
 
+    # Index of the grid cell under a point, or None if the point lies in the
+    # padding or in the spacing between cells
+    def cell_at(self, x, y):
+        col = math.floor((x - self.pad.x) / self.offset.x)
+        row = math.floor((y - self.pad.y) / self.offset.y)
+
+        if col < 0 or row < 0 or col >= self.grid.x or row >= self.grid.y:
+            return None
+        if x - self.pad.x - col * self.offset.x >= self.outer.x \
+                or y - self.pad.y - row * self.offset.y >= self.outer.y:
+            return None
+
+        return row * self.grid.x + col
+
 
 class Dimension:
     def __init__(self, x=None, y=None):
@@ -32,3 +49,11 @@ class Dimension:
 
     def __str__(self):
         return f'({self.x}, {self.y})'
+
+    # Largest size with the aspect ratio of o that fits inside this one
+    def fit(self, o):
+        ratio = self / o
+        if ratio.x < ratio.y:
+            return Dimension(self.x, round(ratio.x * o.y))
+        else:
+            return Dimension(round(ratio.y * o.x), self.y)
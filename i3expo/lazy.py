@@ -0,0 +1,25 @@
+from threading import Lock
+
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """Stands in for a module that is only imported once one of its
+    attributes is first used, keeping heavy imports off the startup path"""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._lock = Lock()
+
+    def __getattr__(self, attr):
+        # Only reached until the module is loaded, afterwards its attributes
+        # are found directly
+        with self._lock:
+            module = importlib.import_module(self.__name__)
+            self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazy_import(name):
+    return LazyModule(name)
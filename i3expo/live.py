@@ -0,0 +1,58 @@
+from collections import deque
+
+import statistics
+import time
+
+
+class FramePacer(object):
+    """Paces live tile updates at a target frame rate. Frames may only take
+    their share of the UI thread's time, a frame that costs more pushes the
+    next one back so that input is still handled without delay."""
+
+    def __init__(self, fps, budget, history=120):
+        self.interval = 1 / fps
+        # Fraction of the frame interval live updates may spend
+        self.budget = budget
+        self.next_due = time.perf_counter()
+        self.costs = deque(maxlen=history)
+        self.presented = deque(maxlen=history)
+        self.frames = 0
+        self.over_budget = 0
+
+    # Seconds until the next frame is due
+    def timeout(self):
+        return max(0.0, self.next_due - time.perf_counter())
+
+    def due(self):
+        return time.perf_counter() >= self.next_due
+
+    def record(self, start, end):
+        cost = end - start
+        self.costs.append(cost)
+        self.presented.append(end)
+        self.frames += 1
+        if cost > self.interval * self.budget:
+            self.over_budget += 1
+
+        # Leave the rest of the time to input, and do not try to catch up on
+        # frames that were missed
+        idle = cost * (1 - self.budget) / self.budget
+        self.next_due = max(self.next_due + self.interval, end + idle)
+
+    def fps(self):
+        if len(self.presented) < 2:
+            return None
+        elapsed = self.presented[-1] - self.presented[0]
+        return (len(self.presented) - 1) / elapsed if elapsed > 0 else None
+
+    def stats(self):
+        return {
+            'target_fps': 1 / self.interval,
+            'fps': self.fps(),
+            'frames': self.frames,
+            'budget_ms': self.interval * self.budget * 1000,
+            'median_frame_ms': statistics.median(self.costs) * 1000
+            if self.costs else None,
+            'max_frame_ms': max(self.costs) * 1000 if self.costs else None,
+            'over_budget': self.over_budget
+        }
@@ -0,0 +1,184 @@
+from threading import Lock
+
+import os
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5)
+
+
+def label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    type = 'counter'
+
+    def __init__(self, name, help, lock):
+        self.name = name
+        self.help = help
+        self.lock = lock
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def collect(self):
+        with self.lock:
+            return dict(self.values)
+
+    def snapshot(self):
+        return [{'labels': dict(k), 'value': v}
+                for k, v in self.collect().items()]
+
+    def prometheus(self):
+        return [f'{self.name}{format_labels(k)} {format_value(v)}'
+                for k, v in self.collect().items()]
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    # A gauge either holds values set explicitly or asks collector for
+    # (labels, value) pairs whenever it is read
+    def __init__(self, name, help, lock, collector=None):
+        super().__init__(name, help, lock)
+        self.collector = collector
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[label_key(labels)] = value
+
+    def collect(self):
+        if self.collector is None:
+            return super().collect()
+        return {label_key(labels): value
+                for labels, value in self.collector()}
+
+
+class Histogram(object):
+    type = 'histogram'
+
+    def __init__(self, name, help, lock, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.lock = lock
+        self.buckets = tuple(buckets) + (float('inf'),)
+        # labels -> [per bucket counts, sum, count]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = label_key(labels)
+        with self.lock:
+            entry = self.values.setdefault(
+                key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    # Context manager observing the duration of its body in seconds
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    def collect(self):
+        with self.lock:
+            return {k: ([c for c in v[0]], v[1], v[2])
+                    for k, v in self.values.items()}
+
+    def snapshot(self):
+        result = []
+        for key, (counts, total, count) in self.collect().items():
+            cumulative = 0
+            buckets = {}
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                buckets[format_value(bound)] = cumulative
+            result.append({'labels': dict(key), 'count': count,
+                           'sum': total, 'buckets': buckets})
+        return result
+
+    def prometheus(self):
+        lines = []
+        for value in self.snapshot():
+            key = label_key(value['labels'])
+            for bound, c in value['buckets'].items():
+                lines.append(f'{self.name}_bucket'
+                             f'{format_labels(key, [("le", bound)])} {c}')
+            lines.append(f'{self.name}_sum{format_labels(key)} '
+                         f'{format_value(value["sum"])}')
+            lines.append(f'{self.name}_count{format_labels(key)} '
+                         f'{value["count"]}')
+        return lines
+
+
+class Timer(object):
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed, **self.labels)
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.lock = Lock()
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help):
+        return self.register(Counter(name, help, self.lock))
+
+    def gauge(self, name, help, collector=None):
+        return self.register(Gauge(name, help, self.lock, collector))
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, self.lock, buckets))
+
+    def snapshot(self):
+        return {name: {'type': m.type, 'help': m.help,
+                       'values': m.snapshot()}
+                for name, m in self.metrics.items()}
+
+    def prometheus(self):
+        lines = []
+        for name, m in self.metrics.items():
+            lines.append(f'# HELP {name} {m.help}')
+            lines.append(f'# TYPE {name} {m.type}')
+            lines.extend(m.prometheus())
+        return '\n'.join(lines) + '\n'
+
+    # Replace path atomically so scrapers never read a partial file
+    def write(self, path):
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(tmp, path)
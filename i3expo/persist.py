@@ -0,0 +1,116 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import json
+import logging
+import mmap
+import os
+import struct
+
+MAGIC = b'I3XT'
+VERSION = 1
+# magic, format version, length of the JSON metadata that follows
+HEADER = struct.Struct('<4sII')
+SUFFIX = '.thumb'
+
+
+def get_cache_dir():
+    uid = os.getuid()
+    return f"/run/user/{uid}/i3expo"
+
+
+class ThumbnailCache(object):
+    """Thumbnails kept on disk across restarts of the daemon, one file per
+    workspace name. Files are written by a single background thread and
+    memory-mapped when read back, so restoring does not copy them."""
+
+    def __init__(self, path):
+        self.path = path
+        self.writer = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='i3expo-persist')
+
+    # Screenshots must stay private to the user, refuse a directory that
+    # someone else could read
+    def open(self):
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        st = os.stat(self.path)
+        if st.st_uid != os.getuid() or st.st_mode & 0o077:
+            logging.warning("Not using thumbnail cache %s, it is accessible "
+                            "by other users", self.path)
+            return False
+        return True
+
+    def filename(self, name):
+        return os.path.join(self.path, name.encode().hex() + SUFFIX)
+
+    def save(self, name, state, compression, pixel_format, levels):
+        return self.writer.submit(self.write, name, state, compression,
+                                  pixel_format, dict(levels))
+
+    def write(self, name, state, compression, pixel_format, levels):
+        meta = {
+            'name': name,
+            'state': state,
+            'compression': compression,
+            'pixel_format': pixel_format,
+            'levels': {}
+        }
+        offset = 0
+        for level, (w, h, data) in levels.items():
+            meta['levels'][level] = [w, h, offset, len(data)]
+            offset += len(data)
+        header = json.dumps(meta).encode()
+
+        path = self.filename(name)
+        tmp = f'{path}.tmp'
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(header)))
+            f.write(header)
+            for _, _, data in levels.values():
+                f.write(data)
+        os.replace(tmp, path)
+
+    # Returns the metadata and {level: (w, h, data)} with data pointing into
+    # the mapped file, or None if there is no usable entry
+    def load(self, name):
+        try:
+            with open(self.filename(name), 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        try:
+            magic, version, length = HEADER.unpack_from(mapped)
+            if magic != MAGIC or version != VERSION:
+                return None
+            meta = json.loads(mapped[HEADER.size:HEADER.size + length])
+        except (struct.error, ValueError):
+            return None
+
+        base = HEADER.size + length
+        view = memoryview(mapped)
+        levels = {}
+        for level, (w, h, offset, size) in meta['levels'].items():
+            if base + offset + size > len(mapped):
+                return None
+            levels[level] = (w, h, view[base + offset:base + offset + size])
+        return (meta, levels)
+
+    def remove(self, name):
+        return self.writer.submit(self.unlink, self.filename(name))
+
+    def unlink(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    # Drop the files of workspaces that no longer exist
+    def prune(self, names):
+        keep = {os.path.basename(self.filename(name)) for name in names}
+        for entry in os.listdir(self.path):
+            if entry.endswith(SUFFIX) and entry not in keep:
+                self.unlink(os.path.join(self.path, entry))
+
+    def close(self):
+        self.writer.shutdown(wait=True)
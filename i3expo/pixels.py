@@ -0,0 +1,67 @@
+from i3expo.lazy import lazy_import
+
+pygame = lazy_import('pygame')
+
+# Raw pixel layouts and the pygame buffer format that reads them. Captures
+# come in the native 32-bit layout of the X server, whose padding byte is not
+# alpha; thumbnails are packed RGB.
+FORMATS = {'BGRX': 'BGRA', 'RGB': 'RGB'}
+
+
+# Wrap raw pixels in a surface without copying them. The surface writes
+# through to data if it is drawn on, so data must be writable for that.
+def to_surface(raw_img, mode='RGB'):
+    w, h, data = raw_img
+    surface = pygame.image.frombuffer(data, (w, h), FORMATS[mode])
+    opaque(surface)
+    return surface
+
+
+# Surfaces read with an alpha channel they do not have are blitted as is
+def opaque(surface):
+    if surface.get_flags() & pygame.SRCALPHA:
+        surface.set_alpha(None)
+    return surface
+
+
+def scale(surface, size):
+    if surface.get_size() == tuple(size):
+        return surface
+    return opaque(pygame.transform.smoothscale(surface, size))
+
+
+def to_rgb(surface):
+    return pygame.image.tobytes(surface, 'RGB')
+
+
+# Raw bytes of a 16-bit surface without the padding at the end of its rows
+def get_packed(surface):
+    w, h = surface.get_size()
+    raw = surface.get_buffer().raw
+    pitch = surface.get_pitch()
+    if pitch == w * 2:
+        return raw
+    return b''.join(raw[y * pitch:y * pitch + w * 2] for y in range(h))
+
+
+def pack_rgb565(w, h, data):
+    packed = pygame.Surface((w, h), 0, 16)
+    packed.blit(to_surface((w, h, data)), (0, 0))
+    return get_packed(packed)
+
+
+def unpack_rgb565(w, h, data):
+    packed = pygame.Surface((w, h), 0, 16)
+    buffer = packed.get_buffer()
+    pitch = packed.get_pitch()
+    if pitch == w * 2:
+        buffer.write(bytes(data), 0)
+    else:
+        for y in range(h):
+            buffer.write(bytes(data[y * w * 2:(y + 1) * w * 2]), y * pitch)
+    del buffer
+
+    # Blitting to 24 bits scales the channels back up to the full range
+    rgb = bytearray(w * h * 3)
+    to_surface((w, h, rgb)).blit(packed, (0, 0))
+    return rgb
@@ -0,0 +1,202 @@
+from collections import namedtuple
+from i3expo.debounce import MODES
+from i3expo.thumbnails import COMPRESSIONS, PIXEL_FORMATS
+
+import logging
+
+# Sizes of 0 are replaced by the size of the screen
+DEFAULTS = {
+    'Capture': {
+        'screenshot_width': 0,
+        'screenshot_height': 0,
+        'screenshot_offset_x': 0,
+        'screenshot_offset_y': 0,
+        'screenshot_delay': 0.2,
+        'settle_mode': 'fixed',  # fixed or adaptive
+        'settle_interval': 0.03,
+        'settle_timeout': 1.0,
+        'settle_threshold': 0.01,
+        'settle_retries': 2,
+        'capture_output': True,
+        'use_damage': False,
+        'window_crops': False,
+        'preview_percent': 0
+    },
+    'UI': {
+        'window_width': 0,
+        'window_height': 0,
+        'bgcolor': 'gray20',
+        'frame_active_color': '#5a6da4',
+        'frame_inactive_color': '#93afb3',
+        'frame_missing_color': '#ffe6d0',
+        'tile_missing_color': 'gray40',
+
+        'grid_x': 3,
+        'workspaces': 9,
+
+        'padding_percent_x': 5,
+        'padding_percent_y': 5,
+        'spacing_percent_x': 4,
+        'spacing_percent_y': 4,
+        'frame_width_px': 3,
+
+        'names_show': True,
+        'names_font': 'verdana',  # list with pygame.font.get_fonts()
+        'names_fontsize': 25,
+        'names_color': 'white',
+        'highlight_percentage': 20,
+        'render_threads': 0,  # 0 uses every core
+        'live_fps': 0,  # 0 disables live tiles
+        'live_budget_percent': 25
+    },
+    'Daemon': {
+        'forced_update_interval': 10.0,
+        'debounce_period': 1.0,
+        'debounce_mode': 'trailing',  # leading, trailing or both
+        'debounce_max_wait': 0.0,  # 0 waits for events to settle
+        'metrics_file': '',  # Prometheus text file, empty disables
+        'metrics_interval': 15.0,
+        'frame_compression': 'none',  # none, zlib or lz4
+        'frame_format': 'rgb',  # rgb or rgb565
+        'memory_budget_mb': 0.0,  # 0 disables eviction
+        'persist_thumbnails': False,
+        'persist_dir': '',  # defaults to /run/user/$UID/i3expo
+    }
+}
+
+CHOICES = {
+    ('Capture', 'settle_mode'): ['fixed', 'adaptive'],
+    ('Daemon', 'debounce_mode'): MODES,
+    ('Daemon', 'frame_compression'): COMPRESSIONS,
+    ('Daemon', 'frame_format'): PIXEL_FORMATS
+}
+
+# Smallest valid value of numeric settings, anything lower falls back to the
+# default
+MINIMUMS = {
+    ('Capture', 'screenshot_width'): 0,
+    ('Capture', 'screenshot_height'): 0,
+    ('Capture', 'screenshot_offset_x'): 0,
+    ('Capture', 'screenshot_offset_y'): 0,
+    ('Capture', 'screenshot_delay'): 0,
+    ('Capture', 'settle_interval'): 0.001,
+    ('Capture', 'settle_timeout'): 0,
+    ('Capture', 'settle_threshold'): 0,
+    ('Capture', 'settle_retries'): 0,
+    ('Capture', 'preview_percent'): 0,
+    ('UI', 'window_width'): 0,
+    ('UI', 'window_height'): 0,
+    ('UI', 'grid_x'): 1,
+    ('UI', 'workspaces'): 1,
+    ('UI', 'padding_percent_x'): 0,
+    ('UI', 'padding_percent_y'): 0,
+    ('UI', 'spacing_percent_x'): 0,
+    ('UI', 'spacing_percent_y'): 0,
+    ('UI', 'frame_width_px'): 0,
+    ('UI', 'names_fontsize'): 1,
+    ('UI', 'highlight_percentage'): 0,
+    ('UI', 'render_threads'): 0,
+    ('UI', 'live_fps'): 0,
+    ('UI', 'live_budget_percent'): 1,
+    ('Daemon', 'forced_update_interval'): 0.1,
+    ('Daemon', 'debounce_period'): 0,
+    ('Daemon', 'debounce_max_wait'): 0,
+    ('Daemon', 'metrics_interval'): 1.0,
+    ('Daemon', 'memory_budget_mb'): 0
+}
+
+SIZES = {
+    ('Capture', 'screenshot_width'): 'x',
+    ('Capture', 'screenshot_height'): 'y',
+    ('UI', 'window_width'): 'x',
+    ('UI', 'window_height'): 'y'
+}
+
+# Window events that trigger a capture. Each can override the debounce
+# policy with keys such as debounce_window_focus_mode in the Daemon section.
+WINDOW_EVENTS = ['window::move', 'window::floating',
+                 'window::fullscreen_mode', 'window::focus']
+
+Settings = namedtuple('Settings',
+                      list(DEFAULTS) + ['workspace_names', 'debounce'])
+sections = {name: namedtuple(name, list(keys))
+            for name, keys in DEFAULTS.items()}
+DebouncePolicy = namedtuple('DebouncePolicy', ['period', 'mode', 'max_wait'])
+
+
+def get_value(config, section, key, default, choices=None, minimum=None):
+    try:
+        if isinstance(default, bool):
+            value = config.getboolean(section, key)
+        elif isinstance(default, int):
+            value = config.getint(section, key)
+        elif isinstance(default, float):
+            value = config.getfloat(section, key)
+        else:
+            value = config.get(section, key)
+    except ValueError:
+        logging.warning("Invalid value for %s in [%s], using %s",
+                        key, section, default)
+        return default
+
+    choices = CHOICES.get((section, key), choices)
+    if choices is not None and value not in choices:
+        logging.warning("%s in [%s] must be one of %s, using %s",
+                        key, section, ', '.join(choices), default)
+        return default
+
+    minimum = MINIMUMS.get((section, key), minimum)
+    if minimum is not None and value < minimum:
+        logging.warning("%s in [%s] must be at least %s, using %s",
+                        key, section, minimum, default)
+        return default
+
+    return value
+
+
+# The debounce policy of a window event, falling back to the general one for
+# keys that are not set or not valid
+def get_debounce(config, daemon, event):
+    prefix = 'debounce_' + event.replace('::', '_')
+    values = {}
+    for key in DebouncePolicy._fields:
+        default = getattr(daemon, f'debounce_{key}')
+        option = f'{prefix}_{key}'
+        if config.has_option('Daemon', option):
+            values[key] = get_value(
+                config, 'Daemon', option, default,
+                MODES if key == 'mode' else None,
+                MINIMUMS.get(('Daemon', f'debounce_{key}')))
+        else:
+            values[key] = default
+    return DebouncePolicy(**values)
+
+
+# Read every setting once, converted to its type, so that the daemon does
+# not parse the config again on every use. Colors are kept as written and
+# only turned into pygame colors by the UI.
+def compile_settings(config, screen=None):
+    values = {}
+    for section, defaults in DEFAULTS.items():
+        section_values = {}
+        for key, default in defaults.items():
+            value = get_value(config, section, key, default)
+            axis = SIZES.get((section, key))
+            if axis is not None and value == 0 and screen is not None:
+                value = getattr(screen, axis)
+            section_values[key] = value
+        values[section] = sections[section](**section_values)
+
+    workspace_names = {}
+    if config.has_section('Workspaces'):
+        for key, name in config.items('Workspaces'):
+            try:
+                workspace_names[int(key.replace('workspace_', ''))] = name
+            except ValueError:
+                logging.warning("Unknown workspace %s in [Workspaces]", key)
+
+    debounce = {event: get_debounce(config, values['Daemon'], event)
+                for event in WINDOW_EVENTS}
+
+    return Settings(workspace_names=workspace_names, debounce=debounce,
+                    **values)
@@ -0,0 +1,94 @@
+from collections import deque
+from i3expo.lazy import lazy_import
+from i3expo.pixels import to_surface, to_rgb
+
+import statistics
+
+pygame = lazy_import('pygame')
+
+RESULTS = ['settled', 'timeout', 'stale', 'torn']
+PROBE_WIDTH = 64
+
+
+# Mean absolute difference of two probes of the same size, from 0 to 1
+def difference(a, b):
+    if a[0] != b[0] or a[1] != b[1]:
+        return 1.0
+
+    w, h, _ = a
+    first = to_surface(a, 'BGRX')
+    second = to_surface(b, 'BGRX')
+
+    # Subtraction saturates at 0, so |a - b| is (a - b) + (b - a)
+    diff = pygame.Surface((w, h))
+    diff.blit(first, (0, 0))
+    diff.blit(second, (0, 0), special_flags=pygame.BLEND_RGB_SUB)
+    reverse = pygame.Surface((w, h))
+    reverse.blit(second, (0, 0))
+    reverse.blit(first, (0, 0), special_flags=pygame.BLEND_RGB_SUB)
+    diff.blit(reverse, (0, 0), special_flags=pygame.BLEND_RGB_ADD)
+
+    return sum(to_rgb(diff)) / (w * h * 3 * 255)
+
+
+class SettleTracker(object):
+
+    def __init__(self, smoothing=0.3, history=256):
+        self.smoothing = smoothing
+        # workspace number -> smoothed seconds until its screen settles
+        self.estimates = {}
+        # capture rectangle -> workspace number last captured on it
+        self.last = {}
+        # workspace number -> probe of its last capture
+        self.seen = {}
+        self.delays = deque(maxlen=history)
+        self.results = {r: 0 for r in RESULTS}
+
+    def estimate(self, num):
+        return self.estimates.get(num, 0.0)
+
+    def learn(self, num, elapsed):
+        if num not in self.estimates:
+            self.estimates[num] = elapsed
+        else:
+            self.estimates[num] += self.smoothing * (
+                elapsed - self.estimates[num])
+
+    # After switching workspaces, the screen still shows the workspace last
+    # captured on it and not the new one as it looked the last time
+    def is_stale(self, rect, num, probe, threshold):
+        last = self.last.get(rect)
+        if last in (None, num) or last not in self.seen:
+            return False
+        if difference(self.seen[last], probe) > threshold:
+            return False
+
+        seen = self.seen.get(num)
+        return seen is None or difference(seen, probe) > threshold
+
+    def captured(self, rect, num, probe):
+        self.last[rect] = num
+        self.seen[num] = probe
+
+    # Fixed delay captures only report their delay
+    def record(self, delay, result=None):
+        self.delays.append(delay)
+        if result is not None:
+            self.results[result] += 1
+
+    def forget(self, num):
+        self.estimates.pop(num, None)
+        self.seen.pop(num, None)
+        for rect, last in list(self.last.items()):
+            if last == num:
+                del self.last[rect]
+
+    def stats(self):
+        total = sum(self.results.values())
+        return {
+            'captures': total,
+            'median_delay_ms': statistics.median(self.delays) * 1000
+            if self.delays else None,
+            'rates': {r: (c / total if total else 0.0)
+                      for r, c in self.results.items()}
+        }
@@ -0,0 +1,62 @@
+from collections import namedtuple
+from threading import Lock
+from types import MappingProxyType
+
+# What the daemon knows about a workspace. windows maps window ids to their
+# rects as of the last capture and, like the rest of a record, is never
+# changed once published. version is that of the store when the record last
+# changed.
+Workspace = namedtuple('Workspace', [
+    'num', 'name', 'state', 'last_update', 'windows', 'rect', 'version'])
+
+# A consistent view of every workspace, active is the number of the focused
+# one or -1 before the first update
+Snapshot = namedtuple('Snapshot', ['version', 'active', 'workspaces'])
+
+
+class StateStore(object):
+    """Workspace state shared between the event loop, capture threads and the
+    UI thread. Writers copy the current snapshot, change the copy and publish
+    it under a lock, readers take the current snapshot without locking and
+    keep reading that one even while newer ones are published."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.snapshot = Snapshot(0, -1, MappingProxyType({}))
+
+    def current(self):
+        return self.snapshot
+
+    def publish(self, workspaces, active):
+        self.snapshot = Snapshot(self.snapshot.version + 1, active,
+                                 MappingProxyType(workspaces))
+        return self.snapshot
+
+    # Change the record of a workspace, creating it if needed, and optionally
+    # make it the active one in the same snapshot
+    def update(self, num, activate=False, **fields):
+        with self.lock:
+            snapshot = self.snapshot
+            workspaces = dict(snapshot.workspaces)
+            record = workspaces.get(num)
+            if record is None:
+                record = Workspace(num, None, 0, 0, {}, None, 0)
+            workspaces[num] = record._replace(
+                version=snapshot.version + 1, **fields)
+            active = num if activate else snapshot.active
+            return self.publish(workspaces, active)
+
+    # Drop workspaces, returning the records that were removed
+    def remove(self, nums):
+        with self.lock:
+            snapshot = self.snapshot
+            workspaces = dict(snapshot.workspaces)
+            removed = [workspaces.pop(num) for num in nums
+                       if num in workspaces]
+            if removed:
+                self.publish(workspaces, snapshot.active)
+            return removed
+
+    def clear(self):
+        with self.lock:
+            self.publish({}, -1)
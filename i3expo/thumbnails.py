@@ -0,0 +1,279 @@
+from collections import OrderedDict
+from threading import RLock
+from i3expo.geometry import Dimension
+from i3expo.pixels import to_surface, scale, to_rgb, pack_rgb565, \
+    unpack_rgb565
+
+import logging
+import math
+import time
+import zlib
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+TILE = 'tile'
+PREVIEW = 'preview'
+
+COMPRESSIONS = ['none', 'zlib', 'lz4']
+PIXEL_FORMATS = ['rgb', 'rgb565']
+
+
+# Scale a frame down without copying it first, only the result is allocated
+def downsample(raw_img, size, mode='BGRX'):
+    w, h, _ = raw_img
+    target = size.fit(Dimension(w, h))
+    target.set(max(1, target.x), max(1, target.y))
+
+    surface = scale(to_surface(raw_img, mode), (target.x, target.y))
+    return (target.x, target.y, to_rgb(surface))
+
+
+class ThumbnailStore(object):
+    """Encoded thumbnails of every workspace. Captures store them on
+    executor threads while the UI thread reads and touches them and metrics
+    are collected, so every access to the stored entries holds the lock.
+    Captures are encoded and decoded outside of it, only a change of codec
+    converts the stored entries while holding it."""
+
+    def __init__(self, compression='none', pixel_format='rgb', budget=0):
+        # Reentrant since storing enforces the budget, which counts the bytes
+        self.lock = RLock()
+        # workspace number -> {level: (w, h, encoded bytes)}, least recently
+        # shown first
+        self.thumbnails = OrderedDict()
+        # workspace number -> number of captures stored so far
+        self.versions = {}
+        # called with the workspace number when its thumbnails are evicted
+        self.on_evict = None
+        # called with 'encode' or 'decode' and the seconds it took
+        self.on_timing = None
+        # (compression, pixel format) every stored entry is encoded with,
+        # and how many times it changed. Entries encoded outside the lock are
+        # only stored if it did not change meanwhile.
+        self.codec = None
+        self.generation = 0
+        self.stats = {
+            'compress_count': 0,
+            'compress_time': 0.0,
+            'decompress_count': 0,
+            'decompress_time': 0.0,
+            'evictions': 0
+        }
+        self.configure(compression, pixel_format, budget)
+
+    def configure(self, compression, pixel_format, budget):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown frame compression: {compression}")
+        if pixel_format not in PIXEL_FORMATS:
+            raise ValueError(f"Unknown frame format: {pixel_format}")
+        if compression == 'lz4' and lz4 is None:
+            logging.warning("lz4 is not installed, falling back to zlib")
+            compression = 'zlib'
+
+        codec = (compression, pixel_format)
+        with self.lock:
+            # Stored entries are converted in place, nothing else can read
+            # them meanwhile
+            if codec != self.codec:
+                for num, levels in self.thumbnails.items():
+                    self.thumbnails[num] = {
+                        level: self.encode(self.decode(t, self.codec), codec)
+                        for level, t in levels.items()}
+                self.codec = codec
+                self.generation += 1
+
+            self.compression = compression
+            self.pixel_format = pixel_format
+            self.budget = budget
+            self.enforce_budget()
+
+    def encode(self, thumb, codec):
+        w, h, data = thumb
+        compression, pixel_format = codec
+        start = time.perf_counter()
+
+        if pixel_format == 'rgb565':
+            data = pack_rgb565(w, h, data)
+        if compression == 'zlib':
+            data = zlib.compress(data, 1)
+        elif compression == 'lz4':
+            data = lz4.frame.compress(data)
+
+        self.timed('compress', time.perf_counter() - start)
+        return (w, h, data)
+
+    def decode(self, entry, codec):
+        w, h, data = entry
+        compression, pixel_format = codec
+        start = time.perf_counter()
+
+        if compression == 'zlib':
+            data = zlib.decompress(data)
+        elif compression == 'lz4':
+            data = lz4.frame.decompress(data)
+        if pixel_format == 'rgb565':
+            data = unpack_rgb565(w, h, data)
+
+        self.timed('decompress', time.perf_counter() - start)
+        return (w, h, data)
+
+    def timed(self, key, seconds):
+        with self.lock:
+            self.stats[f'{key}_count'] += 1
+            self.stats[f'{key}_time'] += seconds
+        if self.on_timing is not None:
+            self.on_timing('encode' if key == 'compress' else 'decode',
+                           seconds)
+
+    # Downsample a full frame to every requested level and drop the frame
+    def put(self, num, raw_img, sizes, mode='BGRX'):
+        while True:
+            with self.lock:
+                codec, generation = self.codec, self.generation
+            levels = {
+                level: self.encode(downsample(raw_img, size, mode), codec)
+                for level, size in sizes.items() if size is not None
+            }
+            with self.lock:
+                # Encoded for a codec that was replaced meanwhile
+                if generation != self.generation:
+                    continue
+                self.thumbnails[num] = levels
+                self.thumbnails.move_to_end(num)
+                self.versions[num] = self.versions.get(num, 0) + 1
+                self.enforce_budget()
+                return
+
+    # Paste a captured region of size w x h at rect, in the coordinates of a
+    # size[0] x size[1] capture, into every stored level of a workspace.
+    # Returns False if the workspace has no thumbnails to patch, they may
+    # have been evicted since the caller checked, and it needs a full capture.
+    def patch(self, num, raw_img, rect, size):
+        region = to_surface(raw_img, 'BGRX')
+
+        with self.lock:
+            stored = self.thumbnails.get(num)
+            if not stored:
+                return False
+            stored = dict(stored)
+            codec, generation = self.codec, self.generation
+
+        levels = {}
+        for level, entry in stored.items():
+            tw, th, pixels = self.decode(entry, codec)
+            pixels = bytearray(pixels)
+            thumb = to_surface((tw, th, pixels))
+
+            sx = tw / size[0]
+            sy = th / size[1]
+            x1 = math.floor(rect.x * sx)
+            y1 = math.floor(rect.y * sy)
+            x2 = max(x1 + 1, math.ceil((rect.x + rect.width) * sx))
+            y2 = max(y1 + 1, math.ceil((rect.y + rect.height) * sy))
+
+            thumb.blit(scale(region, (x2 - x1, y2 - y1)), (x1, y1))
+            levels[level] = self.encode((tw, th, bytes(pixels)), codec)
+
+        with self.lock:
+            if num not in self.thumbnails or generation != self.generation:
+                return False
+            self.thumbnails[num] = levels
+            self.versions[num] = self.versions.get(num, 0) + 1
+        return True
+
+    def get(self, num, level=TILE):
+        with self.lock:
+            entry = self.thumbnails.get(num, {}).get(level)
+            codec = self.codec
+        if entry is None:
+            return None
+        return self.decode(entry, codec)
+
+    # Encoded levels of a workspace as stored, with the codec they are
+    # encoded with
+    def export(self, num):
+        with self.lock:
+            return self.codec, dict(self.thumbnails.get(num, {}))
+
+    # Take back exported levels, unless they were encoded with another codec.
+    # Returns whether they were.
+    def restore(self, num, codec, levels):
+        with self.lock:
+            if tuple(codec) != self.codec:
+                return False
+            self.thumbnails[num] = dict(levels)
+            self.thumbnails.move_to_end(num, last=False)
+            self.versions[num] = self.versions.get(num, 0) + 1
+            self.enforce_budget()
+            return True
+
+    # The most detailed level stored for a workspace
+    def get_largest(self, num):
+        with self.lock:
+            levels = dict(self.thumbnails.get(num, {}))
+            codec = self.codec
+        if not levels:
+            return None
+        return self.decode(max(levels.values(), key=lambda t: t[0] * t[1]),
+                           codec)
+
+    def has(self, num):
+        with self.lock:
+            return num in self.thumbnails
+
+    # Mark a workspace as recently shown so it is evicted last
+    def touch(self, num):
+        with self.lock:
+            if num in self.thumbnails:
+                self.thumbnails.move_to_end(num)
+
+    def version(self, num):
+        with self.lock:
+            return self.versions.get(num, 0)
+
+    def remove(self, num):
+        with self.lock:
+            self.thumbnails.pop(num, None)
+            self.versions.pop(num, None)
+
+    def keys(self):
+        with self.lock:
+            return list(self.thumbnails)
+
+    def enforce_budget(self):
+        if self.budget <= 0:
+            return
+
+        # Always keep the most recent capture, even if it alone is too big
+        with self.lock:
+            while len(self.thumbnails) > 1 \
+                    and self.total_bytes() > self.budget:
+                num, _ = self.thumbnails.popitem(last=False)
+                self.stats['evictions'] += 1
+                logging.debug("Evicted thumbnails for workspace %s", num)
+                if self.on_evict is not None:
+                    self.on_evict(num)
+
+    def bytes_used(self, num):
+        with self.lock:
+            return sum(len(t[2])
+                       for t in self.thumbnails.get(num, {}).values())
+
+    def usage(self):
+        with self.lock:
+            return {num: self.bytes_used(num) for num in self.thumbnails}
+
+    def total_bytes(self):
+        return sum(self.usage().values())
+
+    def timing(self):
+        def average(key):
+            count = self.stats[f'{key}_count']
+            return self.stats[f'{key}_time'] / count * 1000 if count else 0
+
+        with self.lock:
+            return {'compress_ms': average('compress'),
+                    'decompress_ms': average('decompress')}
@@ -0,0 +1,52 @@
+import asyncio
+import json
+import time
+
+# A trace is a file of JSON lines. The first holds the tree and outputs when
+# recording started, every other one an i3 event: its type, raw payload and
+# the tree and outputs right after it. t is in seconds since recording
+# started.
+
+
+class TraceRecorder(object):
+    """Writes the i3 events the daemon receives to a trace that
+    benchmarks.replay can play back. Handlers only queue events, the tree
+    snapshots are taken one after the other on a task of their own."""
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.start = time.perf_counter()
+        self.queue = asyncio.Queue()
+        self.events = 0
+
+    def record(self, event, e):
+        self.queue.put_nowait(
+            (time.perf_counter() - self.start, event, e.ipc_data))
+
+    # snapshot returns the raw tree and outputs
+    async def run(self, snapshot):
+        tree, outputs = await snapshot()
+        self.write({'t': 0.0, 'tree': tree, 'outputs': outputs})
+
+        while True:
+            t, event, data = await self.queue.get()
+            tree, outputs = await snapshot()
+            self.write({'t': t, 'event': event, 'data': data, 'tree': tree,
+                        'outputs': outputs})
+            self.events += 1
+
+    def write(self, entry):
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+# The first entry of a trace and its events
+def read_trace(path):
+    with open(path) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    if not entries or 'tree' not in entries[0]:
+        raise ValueError(f"Not a trace: {path}")
+    return entries[0], sorted(entries[1:], key=lambda e: e['t'])
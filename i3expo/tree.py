@@ -0,0 +1,123 @@
+class TreeModel(object):
+    """The workspaces of the i3 tree, kept up to date from the payloads of
+    workspace and window events instead of asking i3 for the whole tree on
+    every event. Workspace events carry the full subtree of the workspace,
+    window events only the window itself: events that can resize other
+    windows mark the workspace as dirty until the next full sync."""
+
+    def __init__(self):
+        # Workspace con id -> workspace con
+        self.workspaces = {}
+        # Window con id -> id of the workspace holding it
+        self.windows = {}
+        self.focused = None
+        self.dirty = set()
+        self.valid = False
+        self.stats = {
+            'events': 0,
+            'syncs': 0,
+            'divergences': 0
+        }
+
+    # Replace the model with a full tree
+    def sync(self, root):
+        self.workspaces = {}
+        self.windows = {}
+        for workspace in root.workspaces():
+            self.put(workspace)
+
+        focused = root.find_focused()
+        self.focused = focused.workspace().id if focused is not None else None
+        self.dirty.clear()
+        self.valid = True
+        self.stats['syncs'] += 1
+
+    def invalidate(self):
+        self.valid = False
+
+    # Whether a full sync is needed before the windows of the focused
+    # workspace, or with every those of all workspaces, can be trusted
+    def is_stale(self, focused=True, every=False):
+        if not self.valid or self.focused not in self.workspaces:
+            return True
+        if every:
+            return bool(self.dirty)
+        return focused and self.focused in self.dirty
+
+    def put(self, workspace):
+        self.drop(workspace.id)
+        self.workspaces[workspace.id] = workspace
+        for con in workspace.leaves():
+            self.windows[con.id] = workspace.id
+
+    def drop(self, ws_id):
+        self.workspaces.pop(ws_id, None)
+        self.dirty.discard(ws_id)
+        self.windows = {con_id: owner for con_id, owner
+                        in self.windows.items() if owner != ws_id}
+
+    def on_workspace(self, e):
+        self.stats['events'] += 1
+        if e.change in ['reload', 'restored']:
+            self.invalidate()
+        elif e.change == 'empty':
+            if e.current is not None:
+                self.drop(e.current.id)
+        elif e.current is not None:
+            # Focus also reports the workspace that lost it, which is gone
+            # if it was empty
+            if e.old is not None and e.old.id in self.workspaces:
+                self.put(e.old)
+            self.put(e.current)
+            if e.change == 'focus':
+                self.focused = e.current.id
+
+    def on_window(self, e):
+        self.stats['events'] += 1
+        con = e.container
+        ws_id = self.windows.get(con.id)
+
+        if e.change == 'focus' and ws_id is not None:
+            self.set_focus(ws_id, con.id)
+        elif e.change == 'close' and ws_id is not None:
+            self.windows.pop(con.id)
+            self.dirty.add(ws_id)
+        elif e.change in ['floating', 'fullscreen_mode'] and ws_id is not None:
+            self.dirty.add(ws_id)
+        elif e.change in ['title', 'mark', 'urgent']:
+            pass
+        else:
+            # New windows and moves can land on any workspace
+            self.dirty.update(self.workspaces)
+
+    # Focus moves without changing any geometry. Only the focused workspace
+    # can hold the window that loses it.
+    def set_focus(self, ws_id, con_id):
+        for workspace in {self.focused, ws_id}:
+            if workspace in self.workspaces:
+                for con in self.workspaces[workspace].leaves():
+                    con.focused = con.id == con_id
+        self.focused = ws_id
+
+    def focused_workspace(self):
+        return self.workspaces.get(self.focused)
+
+    def get_workspaces(self):
+        return sorted(self.workspaces.values(), key=lambda w: w.num)
+
+    # Numbers of the workspaces whose model disagrees with a full tree
+    # according to digest, dirty ones are known to differ and not counted
+    def diverged(self, root, digest):
+        actual = {w.id: w for w in root.workspaces()}
+        nums = [w.num for ws_id, w in self.workspaces.items()
+                if ws_id not in actual and ws_id not in self.dirty]
+        for ws_id, workspace in actual.items():
+            known = self.workspaces.get(ws_id)
+            if known is None:
+                nums.append(workspace.num)
+            elif ws_id not in self.dirty \
+                    and digest(known) != digest(workspace):
+                nums.append(workspace.num)
+        if nums:
+            self.stats['divergences'] += 1
+        return sorted(nums)
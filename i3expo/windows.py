@@ -0,0 +1,78 @@
+from i3expo.damage import Rect
+from i3expo.pixels import to_surface, scale, to_rgb
+
+
+def is_floating(con):
+    parent = con.parent
+    while parent is not None and parent.type != 'workspace':
+        if parent.type == 'floating_con':
+            return True
+        parent = parent.parent
+    return False
+
+
+# Window id -> rect for every window of a workspace, tiled windows first so
+# that floating ones are painted over them
+def get_layout(workspace):
+    leaves = workspace.leaves()
+    ordered = [c for c in leaves if not is_floating(c)] \
+        + [c for c in leaves if is_floating(c)]
+    return {c.id: Rect(c.rect.x, c.rect.y, c.rect.width, c.rect.height)
+            for c in ordered}
+
+
+# Pixel box of a window in a w x h thumbnail of the capture rectangle rect,
+# or None if it is not on it
+def get_box(window, rect, w, h):
+    sx = w / rect.width
+    sy = h / rect.height
+    x1 = max(0, round((window.x - rect.x) * sx))
+    y1 = max(0, round((window.y - rect.y) * sy))
+    x2 = min(w, round((window.x + window.width - rect.x) * sx))
+    y2 = min(h, round((window.y + window.height - rect.y) * sy))
+
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return (x1, y1, x2, y2)
+
+
+# Cut the image of every window out of a thumbnail
+def crop_windows(thumb, rect, layout):
+    w, h, _ = thumb
+    image = to_surface(thumb)
+
+    crops = {}
+    for con_id, window in layout.items():
+        box = get_box(window, rect, w, h)
+        if box is not None:
+            x1, y1, x2, y2 = box
+            crop = image.subsurface((x1, y1, x2 - x1, y2 - y1))
+            crops[con_id] = (x2 - x1, y2 - y1, to_rgb(crop))
+    return crops
+
+
+# Redraw a thumbnail for a new layout from the images of its windows. Areas
+# left by windows that moved away are filled with background, windows
+# without an image keep whatever the thumbnail showed.
+def compose(thumb, rect, old_layout, layout, crops, background):
+    w, h, data = thumb
+    pixels = bytearray(data)
+    image = to_surface((w, h, pixels))
+
+    for con_id, window in old_layout.items():
+        if layout.get(con_id) != window:
+            box = get_box(window, rect, w, h)
+            if box is not None:
+                x1, y1, x2, y2 = box
+                image.fill(background, (x1, y1, x2 - x1, y2 - y1))
+
+    for con_id, window in layout.items():
+        crop = crops.get(con_id)
+        box = get_box(window, rect, w, h)
+        if crop is None or box is None:
+            continue
+
+        size = (box[2] - box[0], box[3] - box[1])
+        image.blit(scale(to_surface(crop), size), box[:2])
+
+    return (w, h, bytes(pixels))
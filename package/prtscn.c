@@ -1,10 +1,532 @@
 #include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/ipc.h>
+#include <sys/shm.h>
 #include <X11/X.h>
 #include <X11/Xutil.h>
-//Compile hint: gcc -shared -O3 -lX11 -fPIC -Wl,-soname,prtscn -o prtscn.so prtscn.c
+#include <X11/extensions/XShm.h>
+#include <X11/extensions/Xdamage.h>
+#include <X11/extensions/Xfixes.h>
+//Compile hint: gcc -shared -O3 -fPIC -Wl,-soname,prtscn -o prtscn.so prtscn.c -lX11 -lXext -lXdamage -lXfixes
 
+#define BACKEND_NONE -1
+#define BACKEND_XLIB 0
+#define BACKEND_SHM 1
+
+static Display *display = NULL;
+static Window root;
+static int backend = BACKEND_NONE;
+// Set by closeCapture, later calls fail instead of opening a new connection
+static int closed = 0;
+
+// Full captures keep one shared segment per capture size, which is one per
+// output unless outputs share a resolution, so that switching between
+// outputs does not recreate segments. The least recently used one goes when
+// more sizes are in use.
+#define SHM_SLOTS 4
+
+typedef struct {
+   XImage *image;
+   XShmSegmentInfo info;
+   unsigned long used;
+} ShmImage;
+
+static ShmImage shm_images[SHM_SLOTS];
+static unsigned long shm_clock = 0;
+
+static Damage damage = None;
+
+static int x_error = 0;
+
+static int onXError(Display *d, XErrorEvent *e)
+{
+   (void) d;
+   (void) e;
+   x_error = 1;
+   return 0;
+}
+
+static void destroyShmImage(ShmImage *shm)
+{
+   if (shm->image == NULL)
+      return;
+
+   XShmDetach(display, &shm->info);
+   XSync(display, False);
+   XDestroyImage(shm->image);
+   shmdt(shm->info.shmaddr);
+   shm->image = NULL;
+}
+
+static void destroyShmImages(void)
+{
+   int i;
+
+   for (i = 0; i < SHM_SLOTS; i++)
+      destroyShmImage(&shm_images[i]);
+}
+
+static int createShmImage(ShmImage *shm, const int W, const int H)
+{
+   int screen = DefaultScreen(display);
+   XImage *image;
+
+   destroyShmImage(shm);
+
+   image = XShmCreateImage(display, DefaultVisual(display, screen),
+                           DefaultDepth(display, screen), ZPixmap,
+                           NULL, &shm->info, W, H);
+   if (image == NULL)
+      return 0;
+
+   shm->info.shmid = shmget(IPC_PRIVATE, image->bytes_per_line * H,
+                            IPC_CREAT | 0600);
+   if (shm->info.shmid < 0) {
+      XDestroyImage(image);
+      return 0;
+   }
+
+   shm->info.shmaddr = shmat(shm->info.shmid, NULL, 0);
+   if (shm->info.shmaddr == (void *) -1) {
+      shmctl(shm->info.shmid, IPC_RMID, NULL);
+      XDestroyImage(image);
+      return 0;
+   }
+   image->data = shm->info.shmaddr;
+   shm->info.readOnly = False;
+
+   x_error = 0;
+   XShmAttach(display, &shm->info);
+   XSync(display, False);
+
+   // Mark for removal now, the segment lives until the last detach
+   shmctl(shm->info.shmid, IPC_RMID, NULL);
+
+   if (x_error) {
+      XDestroyImage(image);
+      shmdt(shm->info.shmaddr);
+      return 0;
+   }
+
+   shm->image = image;
+   return 1;
+}
+
+// The shared image for captures of W x H, created on first use
+static XImage *getShmImage(const int W, const int H)
+{
+   ShmImage *shm = NULL;
+   int i;
+
+   for (i = 0; i < SHM_SLOTS; i++) {
+      ShmImage *slot = &shm_images[i];
+      if (slot->image != NULL && slot->image->width == W
+          && slot->image->height == H) {
+         shm = slot;
+         break;
+      }
+      if (shm == NULL || (shm->image != NULL
+                          && (slot->image == NULL || slot->used < shm->used)))
+         shm = slot;
+   }
+
+   if (shm->image == NULL || shm->image->width != W
+       || shm->image->height != H)
+      if (!createShmImage(shm, W, H))
+         return NULL;
+
+   shm->used = ++shm_clock;
+   return shm->image;
+}
+
+// Copy an image into data as tightly packed 32-bit pixels in the server's
+// native layout (BGRX on little-endian TrueColor displays)
+static void copyImage(XImage *image, const int W, const int H, unsigned char *data)
+{
+   int x, y;
+   int row = W * 4;
+
+   if (image->bits_per_pixel == 32) {
+      for (y = 0; y < H; y++)
+         memcpy(data + y * row, image->data + y * image->bytes_per_line, row);
+      return;
+   }
+
+   for (y = 0; y < H; y++) {
+      for (x = 0; x < W; x++) {
+         unsigned long pixel = XGetPixel(image, x, y);
+         unsigned char *out = data + y * row + x * 4;
+
+         out[0] = (pixel & image->blue_mask);
+         out[1] = (pixel & image->green_mask) >> 8;
+         out[2] = (pixel & image->red_mask) >> 16;
+         out[3] = 0xff;
+      }
+   }
+}
+
+static int grabXlib(const int xx, const int yy, const int W, const int H, unsigned char *data)
+{
+   XImage *image;
+
+   x_error = 0;
+   image = XGetImage(display, root, xx, yy, W, H, AllPlanes, ZPixmap);
+   if (image == NULL || x_error)
+      return -1;
+
+   copyImage(image, W, H, data);
+   XDestroyImage(image);
+   return 0;
+}
+
+// Remote displays report the extension but cannot attach segments, captures
+// go through Xlib for good once one fails to attach
+static void disableShm(void)
+{
+   destroyShmImages();
+   backend = BACKEND_XLIB;
+}
+
+// Returns 0 on success, SHM_UNAVAILABLE if no segment could be attached and
+// -1 if the grab itself failed, e.g. for a rectangle briefly outside the root
+// window while outputs change
+#define SHM_UNAVAILABLE -2
+
+static int grabShm(const int xx, const int yy, const int W, const int H, unsigned char *data)
+{
+   XImage *image = getShmImage(W, H);
+
+   if (image == NULL)
+      return SHM_UNAVAILABLE;
+
+   x_error = 0;
+   if (!XShmGetImage(display, root, image, xx, yy, AllPlanes) || x_error)
+      return -1;
+
+   copyImage(image, W, H, data);
+   return 0;
+}
+
+int initCapture(void);
+int initCapture(void)
+{
+   int major, minor;
+   Bool pixmaps;
+
+   if (display != NULL)
+      return backend;
+   if (closed)
+      return BACKEND_NONE;
+
+   display = XOpenDisplay(NULL);
+   if (display == NULL)
+      return BACKEND_NONE;
+
+   XSetErrorHandler(onXError);
+   root = DefaultRootWindow(display);
+
+   if (XShmQueryVersion(display, &major, &minor, &pixmaps))
+      backend = BACKEND_SHM;
+   else
+      backend = BACKEND_XLIB;
+
+   return backend;
+}
+
+int getBackend(void);
+int getBackend(void)
+{
+   return backend;
+}
+
+void closeCapture(void);
+void closeCapture(void)
+{
+   closed = 1;
+   if (display == NULL)
+      return;
+
+   destroyShmImages();
+   if (damage != None)
+      XDamageDestroy(display, damage);
+   damage = None;
+   XCloseDisplay(display);
+   display = NULL;
+   backend = BACKEND_NONE;
+}
+
+// Start tracking damage on the root window. Returns 1 if XDamage is available.
+int initDamage(void);
+int initDamage(void)
+{
+   int event_base, error_base;
+
+   if (display == NULL && initCapture() == BACKEND_NONE)
+      return 0;
+   if (damage != None)
+      return 1;
+   if (!XDamageQueryExtension(display, &event_base, &error_base))
+      return 0;
+
+   damage = XDamageCreate(display, root, XDamageReportNonEmpty);
+   XSync(display, False);
+   return damage != None;
+}
+
+// Collect the regions damaged since the previous call into rects as
+// (x, y, width, height) quadruplets. When more than max rectangles are
+// damaged, their bounding box is returned instead. Returns the number of
+// rectangles written.
+int pollDamage(int *, const int);
+int pollDamage(/*out*/ int *rects, const int max)
+{
+   XEvent event;
+   XserverRegion region;
+   XRectangle *area, bounds;
+   int i, count = 0;
+
+   if (damage == None || max < 1)
+      return 0;
+
+   // Notifications are only used to wake the server side, drop them
+   while (XPending(display))
+      XNextEvent(display, &event);
+
+   region = XFixesCreateRegion(display, NULL, 0);
+   XDamageSubtract(display, damage, None, region);
+
+   area = XFixesFetchRegionAndBounds(display, region, &count, &bounds);
+   if (area == NULL)
+      count = 0;
+
+   if (count > max) {
+      rects[0] = bounds.x;
+      rects[1] = bounds.y;
+      rects[2] = bounds.width;
+      rects[3] = bounds.height;
+      count = 1;
+   } else {
+      for (i = 0; i < count; i++) {
+         rects[i * 4 + 0] = area[i].x;
+         rects[i * 4 + 1] = area[i].y;
+         rects[i * 4 + 2] = area[i].width;
+         rects[i * 4 + 3] = area[i].height;
+      }
+   }
+
+   if (area != NULL)
+      XFree(area);
+   XFixesDestroyRegion(display, region);
+   return count;
+}
+
+// Capture the given rectangle as 4 bytes per pixel into data, which must hold
+// at least W * H * 4 bytes. Returns 0 on success.
+int getScreen32(const int, const int, const int, const int, unsigned char *);
+int getScreen32(const int xx, const int yy, const int W, const int H, /*out*/ unsigned char *data)
+{
+   if (display == NULL && initCapture() == BACKEND_NONE)
+      return -1;
+
+   if (backend == BACKEND_SHM) {
+      int status = grabShm(xx, yy, W, H, data);
+      if (status == 0)
+         return 0;
+
+      // A failed grab is retried with Xlib this once
+      if (status == SHM_UNAVAILABLE)
+         disableShm();
+   }
+
+   return grabXlib(xx, yy, W, H, data);
+}
+
+// Capture a small region such as a damaged rectangle without resizing the
+// shared segment used for full captures
+int getRegion32(const int, const int, const int, const int, unsigned char *);
+int getRegion32(const int xx, const int yy, const int W, const int H, /*out*/ unsigned char *data)
+{
+   if (display == NULL && initCapture() == BACKEND_NONE)
+      return -1;
+
+   return grabXlib(xx, yy, W, H, data);
+}
+
+// Probes read this many evenly spaced rows of every row of cells
+#define PROBE_ROWS 4
+
+// Cells average at most this many evenly spaced rows and columns of their
+// pixels, so that shrinking a frame does not get slower with the resolution
+#define SHRINK_SAMPLES 4
+
+// Box filter image down to PW x PH pixels, averaging the sampled pixels of
+// each cell, as 4 bytes per pixel in the same layout as copyImage. Frames in
+// that layout are read straight from image->data, one row at a time.
+static int shrinkImage(XImage *image, const int W, const int PW, const int PH, unsigned char *data)
+{
+   int IH = image->height;
+   int direct = image->bits_per_pixel == 32 && image->byte_order == LSBFirst
+      && image->red_mask == 0xff0000 && image->green_mask == 0xff00
+      && image->blue_mask == 0xff;
+   // Sampled columns of every cell and the sums of the current row of cells
+   int *xs = malloc(sizeof(int) * PW * SHRINK_SAMPLES);
+   int *columns = malloc(sizeof(int) * PW);
+   unsigned long *sums = malloc(sizeof(unsigned long) * PW * 3);
+   int i, j, k, l;
+
+   if (xs == NULL || columns == NULL || sums == NULL) {
+      free(xs);
+      free(columns);
+      free(sums);
+      return -1;
+   }
+
+   for (i = 0; i < PW; i++) {
+      int x0 = i * W / PW, cw = (i + 1) * W / PW - x0;
+      if (cw < 1)
+         cw = 1;
+      columns[i] = cw < SHRINK_SAMPLES ? cw : SHRINK_SAMPLES;
+      for (l = 0; l < columns[i]; l++)
+         xs[i * SHRINK_SAMPLES + l] = x0 + (2 * l + 1) * cw / (2 * columns[i]);
+   }
+
+   for (j = 0; j < PH; j++) {
+      int y0 = j * IH / PH, ch = (j + 1) * IH / PH - y0;
+      int rows;
+      if (ch < 1)
+         ch = 1;
+      rows = ch < SHRINK_SAMPLES ? ch : SHRINK_SAMPLES;
+      memset(sums, 0, sizeof(unsigned long) * PW * 3);
+
+      for (k = 0; k < rows; k++) {
+         int y = y0 + (2 * k + 1) * ch / (2 * rows);
+         unsigned char *row = (unsigned char *) image->data
+            + y * image->bytes_per_line;
+
+         for (i = 0; i < PW; i++) {
+            const int *x = xs + i * SHRINK_SAMPLES;
+            unsigned long *sum = sums + i * 3;
+
+            if (direct) {
+               for (l = 0; l < columns[i]; l++) {
+                  unsigned char *in = row + x[l] * 4;
+                  sum[0] += in[0];
+                  sum[1] += in[1];
+                  sum[2] += in[2];
+               }
+               continue;
+            }
+
+            for (l = 0; l < columns[i]; l++) {
+               unsigned long pixel = XGetPixel(image, x[l], y);
+               sum[0] += (pixel & image->blue_mask);
+               sum[1] += (pixel & image->green_mask) >> 8;
+               sum[2] += (pixel & image->red_mask) >> 16;
+            }
+         }
+      }
+
+      for (i = 0; i < PW; i++) {
+         unsigned long count = (unsigned long) rows * columns[i];
+         unsigned char *out = data + (j * PW + i) * 4;
+
+         out[0] = sums[i * 3 + 0] / count;
+         out[1] = sums[i * 3 + 1] / count;
+         out[2] = sums[i * 3 + 2] / count;
+         out[3] = 0xff;
+      }
+   }
+
+   free(xs);
+   free(columns);
+   free(sums);
+   return 0;
+}
+
+// Read rows evenly spaced rows of the given rectangle, each with its own
+// request, so that a row of cells gets rows / PH of them
+static XImage *getRows(const int xx, const int yy, const int W, const int H, const int rows)
+{
+   int screen = DefaultScreen(display);
+   XImage *image;
+   int r;
+
+   image = XCreateImage(display, DefaultVisual(display, screen),
+                        DefaultDepth(display, screen), ZPixmap, 0, NULL,
+                        W, rows, 32, 0);
+   if (image == NULL)
+      return NULL;
+   image->data = malloc(image->bytes_per_line * rows);
+   if (image->data == NULL) {
+      XDestroyImage(image);
+      return NULL;
+   }
+
+   x_error = 0;
+   for (r = 0; r < rows; r++) {
+      int y = ((2 * r + 1) * H) / (2 * rows);
+      if (XGetSubImage(display, root, xx, yy + y, W, 1, AllPlanes, ZPixmap,
+                       image, 0, r) == NULL || x_error) {
+         XDestroyImage(image);
+         return NULL;
+      }
+   }
+
+   return image;
+}
+
+// Capture the given rectangle scaled down to PW x PH pixels into data, which
+// must hold at least PW * PH * 4 bytes. Used to tell whether the screen has
+// settled and to draw live tiles without copying whole frames out: small
+// probes only read a few rows of every cell, large ones read the whole frame
+// through the shared segment. Either way each pixel is the average of its
+// cell. Returns 0 on success.
+int getProbe32(const int, const int, const int, const int, const int, const int, unsigned char *);
+int getProbe32(const int xx, const int yy, const int W, const int H, const int PW, const int PH, /*out*/ unsigned char *data)
+{
+   XImage *image;
+   int rows = PH * PROBE_ROWS;
+   int status;
+
+   if (display == NULL && initCapture() == BACKEND_NONE)
+      return -1;
+
+   // Past a quarter of the rows a single request for all of them is cheaper
+   if (rows * 4 < H) {
+      image = getRows(xx, yy, W, H, rows);
+      if (image == NULL)
+         return -1;
+
+      status = shrinkImage(image, W, PW, PH, data);
+      XDestroyImage(image);
+      return status;
+   }
+
+   if (backend == BACKEND_SHM) {
+      image = getShmImage(W, H);
+      if (image == NULL) {
+         disableShm();
+      } else {
+         x_error = 0;
+         if (XShmGetImage(display, root, image, xx, yy, AllPlanes) && !x_error)
+            return shrinkImage(image, W, PW, PH, data);
+      }
+   }
+
+   x_error = 0;
+   image = XGetImage(display, root, xx, yy, W, H, AllPlanes, ZPixmap);
+   if (image == NULL || x_error)
+      return -1;
+
+   status = shrinkImage(image, W, PW, PH, data);
+   XDestroyImage(image);
+   return status;
+}
+
+// Legacy entry point producing packed 24-bit RGB
 void getScreen(const int, const int, const int, const int, unsigned char *);
-void getScreen(const int xx,const int yy,const int W, const int H, /*out*/ unsigned char * data) 
+void getScreen(const int xx,const int yy,const int W, const int H, /*out*/ unsigned char * data)
 {
    Display *display = XOpenDisplay(NULL);
    Window root = DefaultRootWindow(display);
@@ -30,6 +552,5 @@ void getScreen(const int xx,const int yy,const int W, const int H, /*out*/ unsig
       }
    }
    XDestroyImage(image);
-   XDestroyWindow(display, root);
    XCloseDisplay(display);
 }
@@ -1,24 +1,16 @@
 import setuptools
-from pkg_resources import get_distribution, DistributionNotFound
 
 with open('README.md') as f:
     long_description = f.read()
 
 
-def get_dist(pkgname):
-    try:
-        return get_distribution(pkgname)
-    except DistributionNotFound:
-        return None
-
-
 requirements = [
     'pyxdg',
-    'i3ipc',
-    'pygame'
+    # i3ipc.aio
+    'i3ipc>=2.0',
+    # frombuffer() with BGRA pixels and tobytes()
+    'pygame>=2.1.3'
 ]
-pillow_req = 'pillow-simd' if get_dist('pillow-simd') else 'pillow'
-requirements.append(pillow_req)
 
 setuptools.setup(name='i3expo',
                  version='1.1.2',
@@ -29,9 +21,10 @@ setuptools.setup(name='i3expo',
                  author_email='mircea@mihalea.ro',
                  license='MIT',
                  zip_safe=False,
+                 python_requires='>=3.7',
                  install_requires=requirements,
                  include_package_data=True,
-                 packages=setuptools.find_packages(),
+                 packages=setuptools.find_packages(exclude=['benchmarks']),
                  entry_points={
                      'console_scripts': [
                          'i3expo-daemon=i3expo.daemon:main',
@@ -0,0 +1,96 @@
+from i3expo.debounce import Debounce
+
+import asyncio
+import unittest
+
+PERIOD = 0.05
+
+
+class DebounceTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.calls = []
+
+    def record(self, *args):
+        self.calls.append(args)
+
+    async def burst(self, debounce, count, gap=0.01):
+        for i in range(count):
+            debounce(i)
+            await asyncio.sleep(gap)
+
+    async def test_trailing_calls_once_with_the_last_arguments(self):
+        debounce = Debounce(PERIOD, self.record, 'trailing')
+        await self.burst(debounce, 3)
+        self.assertEqual(self.calls, [])
+
+        await asyncio.sleep(PERIOD * 2)
+        self.assertEqual(self.calls, [(2,)])
+        self.assertEqual(debounce.stats(),
+                         {'received': 3, 'coalesced': 2, 'fired': 1})
+
+    async def test_leading_calls_once_right_away(self):
+        debounce = Debounce(PERIOD, self.record, 'leading')
+        debounce(0)
+        self.assertEqual(self.calls, [(0,)])
+
+        await self.burst(debounce, 3)
+        await asyncio.sleep(PERIOD * 2)
+        self.assertEqual(self.calls, [(0,)])
+        self.assertEqual(debounce.stats()['fired'], 1)
+
+    async def test_leading_calls_again_after_a_quiet_period(self):
+        debounce = Debounce(PERIOD, self.record, 'leading')
+        debounce(0)
+        await asyncio.sleep(PERIOD * 2)
+        debounce(1)
+        self.assertEqual(self.calls, [(0,), (1,)])
+
+    async def test_both_calls_on_the_first_and_last_call(self):
+        debounce = Debounce(PERIOD, self.record, 'both')
+        await self.burst(debounce, 3)
+        self.assertEqual(self.calls, [(0,)])
+
+        await asyncio.sleep(PERIOD * 2)
+        self.assertEqual(self.calls, [(0,), (2,)])
+
+    async def test_both_does_not_repeat_a_single_call(self):
+        debounce = Debounce(PERIOD, self.record, 'both')
+        debounce(0)
+        await asyncio.sleep(PERIOD * 2)
+        self.assertEqual(self.calls, [(0,)])
+
+    async def test_max_wait_fires_during_a_long_burst(self):
+        debounce = Debounce(PERIOD, self.record, 'trailing',
+                            max_wait=PERIOD * 2)
+        await self.burst(debounce, 30)
+
+        # Without max_wait nothing fires until the burst ends
+        self.assertGreaterEqual(len(self.calls), 2)
+        await asyncio.sleep(PERIOD * 2)
+        self.assertEqual(self.calls[-1], (29,))
+
+    async def test_no_max_wait_waits_for_the_burst_to_end(self):
+        debounce = Debounce(PERIOD, self.record, 'trailing', max_wait=0)
+        await self.burst(debounce, 30)
+        self.assertEqual(self.calls, [])
+
+        await asyncio.sleep(PERIOD * 2)
+        self.assertEqual(self.calls, [(29,)])
+
+    async def test_reset_drops_the_pending_call(self):
+        debounce = Debounce(PERIOD, self.record, 'trailing')
+        debounce(0)
+        debounce.reset()
+
+        await asyncio.sleep(PERIOD * 2)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(debounce.stats()['coalesced'], 1)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            Debounce(PERIOD, self.record, 'sometimes')
+
+
+if __name__ == '__main__':
+    unittest.main()
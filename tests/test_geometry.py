@@ -0,0 +1,103 @@
+from i3expo import daemon
+from i3expo.geometry import Geometry, Dimension
+from i3expo.settings import DEFAULTS, compile_settings
+from i3expo.state import StateStore
+from unittest import mock
+
+import configparser
+import unittest
+
+
+def make_geometry():
+    # 3 x 2 cells of 100 x 50 with 10 pixels between them
+    g = Geometry()
+    g.grid.set(3, 2)
+    g.pad.set(20, 10)
+    g.outer.set(100, 50)
+    g.offset.set(110, 60)
+    return g
+
+
+def make_snapshot(nums):
+    store = StateStore()
+    for num in nums:
+        store.update(num)
+    return store.current()
+
+
+class GeometryTest(unittest.TestCase):
+
+    def test_cell_at(self):
+        g = make_geometry()
+        self.assertEqual(g.cell_at(20, 10), 0)
+        self.assertEqual(g.cell_at(119, 59), 0)
+        self.assertEqual(g.cell_at(130, 10), 1)
+        self.assertEqual(g.cell_at(240, 70), 5)
+        self.assertEqual(g.cell_at(339, 119), 5)
+
+    def test_cell_at_between_cells(self):
+        g = make_geometry()
+        for x, y in [(120, 10), (129, 30), (20, 60), (250, 69)]:
+            with self.subTest(x=x, y=y):
+                self.assertIsNone(g.cell_at(x, y))
+
+    def test_cell_at_outside_the_grid(self):
+        g = make_geometry()
+        for x, y in [(0, 0), (19, 30), (30, 9), (350, 30), (30, 130)]:
+            with self.subTest(x=x, y=y):
+                self.assertIsNone(g.cell_at(x, y))
+
+    def test_fit(self):
+        box = Dimension(100, 100)
+        fitted = box.fit(Dimension(1920, 1080))
+        self.assertEqual((fitted.x, fitted.y), (100, 56))
+        fitted = box.fit(Dimension(1080, 1920))
+        self.assertEqual((fitted.x, fitted.y), (56, 100))
+
+
+class PagingTest(unittest.TestCase):
+
+    def setUp(self):
+        config = configparser.ConfigParser()
+        config.read_dict(DEFAULTS)
+        config.read_dict({'UI': {
+            'workspaces': '4',
+            'grid_x': '2',
+            'padding_percent_x': '0',
+            'padding_percent_y': '0',
+            'spacing_percent_x': '0',
+            'spacing_percent_y': '0'
+        }})
+        patcher = mock.patch.object(daemon, 'settings',
+                                    compile_settings(config))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_page_count(self):
+        for count, pages in [(0, 1), (1, 1), (4, 1), (5, 2), (9, 3)]:
+            with self.subTest(count=count):
+                snapshot = make_snapshot(range(1, count + 1))
+                self.assertEqual(daemon.get_page_count(snapshot), pages)
+
+    def test_page_of(self):
+        # Pages follow the workspace numbers, not their order of creation
+        snapshot = make_snapshot([10, 1, 3, 2, 7, 4])
+        self.assertEqual(
+            [daemon.get_page_of(num, snapshot) for num in [1, 4, 7, 10]],
+            [0, 0, 1, 1])
+        self.assertEqual(daemon.get_page_of(5, snapshot), 0)
+
+    def test_grid_holds_one_page(self):
+        g = daemon.init_geometry(800, 600, make_snapshot(range(1, 10)))
+        self.assertEqual((g.grid.x, g.grid.y), (2, 2))
+        self.assertEqual((g.outer.x, g.outer.y), (400, 300))
+        self.assertEqual(g.cell_at(500, 400), 3)
+
+    def test_grid_shrinks_to_the_workspaces(self):
+        g = daemon.init_geometry(800, 600, make_snapshot([1]))
+        self.assertEqual((g.grid.x, g.grid.y), (1, 1))
+        self.assertEqual(g.cell_at(799, 599), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
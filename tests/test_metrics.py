@@ -0,0 +1,88 @@
+from i3expo.metrics import Registry
+
+import os
+import tempfile
+import unittest
+
+
+class RegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter('captures', 'Captures taken')
+        counter.inc(kind='full')
+        counter.inc(2, kind='patch')
+        counter.inc(kind='full')
+
+        self.assertEqual(self.registry.prometheus(), (
+            '# HELP captures Captures taken\n'
+            '# TYPE captures counter\n'
+            'captures{kind="full"} 2\n'
+            'captures{kind="patch"} 2\n'))
+
+    def test_gauges(self):
+        self.registry.gauge('idle', 'Idle bytes').set(1.5)
+        self.registry.gauge('stored', 'Stored thumbnails',
+                            lambda: [({'level': 'tile'}, 3), ({}, 4)])
+
+        self.assertEqual(self.registry.prometheus(), (
+            '# HELP idle Idle bytes\n'
+            '# TYPE idle gauge\n'
+            'idle 1.5\n'
+            '# HELP stored Stored thumbnails\n'
+            '# TYPE stored gauge\n'
+            'stored{level="tile"} 3\n'
+            'stored 4\n'))
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('seconds', 'Capture time',
+                                            buckets=(0.1, 1))
+        histogram.observe(0.05, kind='full')
+        histogram.observe(0.5, kind='full')
+        histogram.observe(2, kind='full')
+
+        self.assertEqual(self.registry.prometheus(), (
+            '# HELP seconds Capture time\n'
+            '# TYPE seconds histogram\n'
+            'seconds_bucket{kind="full",le="0.1"} 1\n'
+            'seconds_bucket{kind="full",le="1"} 2\n'
+            'seconds_bucket{kind="full",le="+Inf"} 3\n'
+            'seconds_sum{kind="full"} 2.55\n'
+            'seconds_count{kind="full"} 3\n'))
+
+    def test_labels_are_sorted(self):
+        counter = self.registry.counter('skipped', 'Captures skipped')
+        counter.inc(reason='torn', kind='full')
+        counter.inc(kind='full', reason='torn')
+
+        self.assertEqual(self.registry.prometheus().splitlines()[-1],
+                         'skipped{kind="full",reason="torn"} 2')
+
+    def test_snapshot(self):
+        self.registry.counter('captures', 'Captures taken').inc(kind='full')
+        self.registry.histogram('seconds', 'Capture time',
+                                buckets=(1,)).observe(0.5)
+
+        self.assertEqual(self.registry.snapshot(), {
+            'captures': {'type': 'counter', 'help': 'Captures taken',
+                         'values': [{'labels': {'kind': 'full'},
+                                     'value': 1}]},
+            'seconds': {'type': 'histogram', 'help': 'Capture time',
+                        'values': [{'labels': {}, 'count': 1, 'sum': 0.5,
+                                    'buckets': {'1': 1, '+Inf': 1}}]}
+        })
+
+    def test_write(self):
+        self.registry.counter('captures', 'Captures taken').inc()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'i3expo.prom')
+            self.registry.write(path)
+            with open(path) as f:
+                self.assertEqual(f.read(), self.registry.prometheus())
+            self.assertEqual(os.listdir(tmp), ['i3expo.prom'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+from i3expo import daemon
+from i3expo.persist import ThumbnailCache
+from i3expo.state import StateStore
+from i3expo.thumbnails import ThumbnailStore, TILE, PREVIEW
+from types import SimpleNamespace
+from unittest import mock
+
+import os
+import tempfile
+import unittest
+
+LEVELS = {TILE: (2, 1, b'\x01\x02\x03\x04\x05\x06'),
+          PREVIEW: (1, 1, b'\x07\x08\x09')}
+
+
+def workspace(num, name, *windows):
+    leaves = [SimpleNamespace(id=con_id, rect=SimpleNamespace(
+        x=x, y=0, width=100, height=100), focused=False)
+        for con_id, x in windows]
+    return SimpleNamespace(num=num, name=name, leaves=lambda: leaves)
+
+
+# A cache in a directory of its own, removed after the test
+def open_cache(test):
+    tmp = tempfile.TemporaryDirectory()
+    test.addCleanup(tmp.cleanup)
+    cache = ThumbnailCache(os.path.join(tmp.name, 'cache'))
+    test.addCleanup(cache.close)
+    test.assertTrue(cache.open())
+    return cache
+
+
+class ThumbnailCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = open_cache(self)
+        self.path = self.cache.path
+
+    def loaded(self, name):
+        meta, levels = self.cache.load(name)
+        return meta, {level: (w, h, bytes(data))
+                      for level, (w, h, data) in levels.items()}
+
+    def test_save_and_load(self):
+        self.cache.save('1: web', 42, 'zlib', 'rgb565', LEVELS).result()
+
+        meta, levels = self.loaded('1: web')
+        self.assertEqual(levels, LEVELS)
+        self.assertEqual((meta['name'], meta['state'], meta['compression'],
+                          meta['pixel_format']),
+                         ('1: web', 42, 'zlib', 'rgb565'))
+        self.assertIsNone(self.cache.load('2'))
+
+    def test_save_replaces_the_previous_file(self):
+        self.cache.save('1', 1, 'none', 'rgb', LEVELS).result()
+        self.cache.save('1', 2, 'none', 'rgb', {TILE: LEVELS[TILE]}).result()
+
+        meta, levels = self.loaded('1')
+        self.assertEqual(meta['state'], 2)
+        self.assertEqual(levels, {TILE: LEVELS[TILE]})
+        self.assertEqual(os.listdir(self.path),
+                         [os.path.basename(self.cache.filename('1'))])
+
+    def test_broken_files_are_ignored(self):
+        self.cache.save('1', 1, 'none', 'rgb', LEVELS).result()
+        path = self.cache.filename('1')
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        for broken in [b'', b'XXXX' + data[4:], data[:-1]]:
+            with self.subTest(broken=broken[:4]):
+                with open(path, 'wb') as f:
+                    f.write(broken)
+                self.assertIsNone(self.cache.load('1'))
+
+    def test_prune_and_remove(self):
+        for name in ['1', '2', '3']:
+            self.cache.save(name, 1, 'none', 'rgb', LEVELS).result()
+
+        self.cache.prune(['1', '2'])
+        self.cache.remove('2').result()
+        self.assertIsNotNone(self.cache.load('1'))
+        self.assertIsNone(self.cache.load('2'))
+        self.assertIsNone(self.cache.load('3'))
+
+    def test_refuses_a_directory_others_can_read(self):
+        os.chmod(self.path, 0o755)
+        with self.assertLogs(level='WARNING'):
+            self.assertFalse(self.cache.open())
+
+
+class RestoreThumbnailsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = open_cache(self)
+        self.thumbnails = ThumbnailStore()
+        self.knowledge = StateStore()
+        for name, value in [('thumbnail_cache', self.cache),
+                            ('thumbnails', self.thumbnails),
+                            ('knowledge', self.knowledge)]:
+            patcher = mock.patch.object(daemon, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def save(self, workspace, compression='none'):
+        state = daemon.tree_hash(workspace, focus=False)
+        self.cache.save(workspace.name, state, compression, 'rgb',
+                        LEVELS).result()
+
+    def restore(self, *workspaces):
+        daemon.restore_thumbnails(workspaces)
+        self.cache.writer.submit(lambda: None).result()
+
+    def test_restores_unchanged_workspaces(self):
+        web = workspace(1, 'web', (101, 0), (102, 100))
+        self.save(web)
+
+        self.restore(web)
+        self.assertEqual(self.thumbnails.export(1)[1], LEVELS)
+        self.assertEqual(self.knowledge.current().workspaces[1].state,
+                         daemon.tree_hash(web))
+
+    def test_drops_workspaces_whose_windows_changed(self):
+        self.save(workspace(1, 'web', (101, 0), (102, 100)))
+
+        self.restore(workspace(1, 'web', (101, 0)))
+        self.assertFalse(self.thumbnails.has(1))
+        self.assertIsNone(self.cache.load('web'))
+
+    def test_drops_thumbnails_of_another_codec(self):
+        web = workspace(1, 'web', (101, 0))
+        self.save(web, compression='zlib')
+
+        self.restore(web)
+        self.assertFalse(self.thumbnails.has(1))
+        self.assertIsNone(self.cache.load('web'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+from i3expo.settings import DEFAULTS, WINDOW_EVENTS, DebouncePolicy, \
+    compile_settings
+
+import configparser
+import unittest
+
+
+def make_config(daemon=None, ui=None):
+    config = configparser.ConfigParser()
+    config.read_dict(DEFAULTS)
+    config.read_dict({'Daemon': daemon or {}, 'UI': ui or {}})
+    return config
+
+
+class DebounceSettingsTest(unittest.TestCase):
+
+    def test_events_fall_back_to_the_general_policy(self):
+        settings = compile_settings(make_config({
+            'debounce_period': '0.5',
+            'debounce_mode': 'both'
+        }))
+        for event in WINDOW_EVENTS:
+            self.assertEqual(settings.debounce[event],
+                             DebouncePolicy(0.5, 'both', 0.0))
+
+    def test_per_event_overrides(self):
+        settings = compile_settings(make_config({
+            'debounce_window_focus_period': '0.1',
+            'debounce_window_focus_mode': 'leading',
+            'debounce_window_focus_max_wait': '2'
+        }))
+        self.assertEqual(settings.debounce['window::focus'],
+                         DebouncePolicy(0.1, 'leading', 2.0))
+        self.assertEqual(settings.debounce['window::move'],
+                         DebouncePolicy(1.0, 'trailing', 0.0))
+
+    def test_invalid_overrides_use_the_general_policy(self):
+        with self.assertLogs(level='WARNING') as logs:
+            settings = compile_settings(make_config({
+                'debounce_mode': 'leading',
+                'debounce_window_move_period': 'soon',
+                'debounce_window_move_mode': 'sometimes',
+                'debounce_window_move_max_wait': '-'
+            }))
+        self.assertEqual(settings.debounce['window::move'],
+                         DebouncePolicy(1.0, 'leading', 0.0))
+        self.assertEqual(len(logs.output), 3)
+
+    def test_invalid_general_policy_uses_the_defaults(self):
+        with self.assertLogs(level='WARNING'):
+            settings = compile_settings(make_config({
+                'debounce_mode': 'sometimes'
+            }))
+        self.assertEqual(settings.debounce['window::focus'].mode,
+                         'trailing')
+
+
+class RangeSettingsTest(unittest.TestCase):
+
+    def test_values_below_their_minimum_use_the_defaults(self):
+        with self.assertLogs(level='WARNING') as logs:
+            settings = compile_settings(make_config(
+                {'metrics_interval': '0'},
+                {'render_threads': '-2', 'workspaces': '0'}))
+        self.assertEqual(settings.Daemon.metrics_interval, 15.0)
+        self.assertEqual(settings.UI.render_threads, 0)
+        self.assertEqual(settings.UI.workspaces, 9)
+        self.assertEqual(len(logs.output), 3)
+
+    def test_minimums_are_valid(self):
+        settings = compile_settings(make_config(
+            {'metrics_interval': '1'}, {'workspaces': '1'}))
+        self.assertEqual(settings.Daemon.metrics_interval, 1.0)
+        self.assertEqual(settings.UI.workspaces, 1)
+
+    def test_negative_debounce_override(self):
+        with self.assertLogs(level='WARNING'):
+            settings = compile_settings(make_config({
+                'debounce_window_move_period': '-1'
+            }))
+        self.assertEqual(settings.debounce['window::move'].period, 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+from i3expo.settle import SettleTracker, difference
+
+import unittest
+
+RECT = (0, 0, 1920, 1080)
+THRESHOLD = 0.02
+
+
+# A w x h probe in the layout of the X server filled with one gray level
+def probe(level, w=4, h=2):
+    return (w, h, bytes([level, level, level, 0]) * (w * h))
+
+
+class DifferenceTest(unittest.TestCase):
+
+    def test_same_probe(self):
+        self.assertEqual(difference(probe(128), probe(128)), 0.0)
+
+    def test_mean_absolute_difference(self):
+        self.assertAlmostEqual(difference(probe(0), probe(255)), 1.0)
+        self.assertAlmostEqual(difference(probe(255), probe(0)), 1.0)
+        self.assertAlmostEqual(difference(probe(100), probe(151)), 0.2)
+
+    def test_only_changed_pixels_count(self):
+        changed = bytearray(probe(0)[2])
+        changed[:4] = bytes([255, 255, 255, 0])
+        self.assertAlmostEqual(difference(probe(0), (4, 2, changed)), 1 / 8)
+
+    def test_different_sizes(self):
+        self.assertEqual(difference(probe(0), probe(0, w=2)), 1.0)
+
+
+class SettleTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tracker = SettleTracker(smoothing=0.5)
+
+    def test_estimates(self):
+        self.assertEqual(self.tracker.estimate(1), 0.0)
+        self.tracker.learn(1, 0.2)
+        self.tracker.learn(1, 0.4)
+        self.assertAlmostEqual(self.tracker.estimate(1), 0.3)
+
+    def test_stale_while_the_previous_workspace_shows(self):
+        self.tracker.captured(RECT, 1, probe(0))
+        self.tracker.captured(RECT, 2, probe(200))
+        self.tracker.captured(RECT, 1, probe(0))
+
+        # Workspace 2 was seen before, the screen still shows workspace 1
+        self.assertTrue(self.tracker.is_stale(RECT, 2, probe(0), THRESHOLD))
+        self.assertFalse(
+            self.tracker.is_stale(RECT, 2, probe(200), THRESHOLD))
+
+    def test_stale_needs_the_previous_workspace(self):
+        # Nothing captured on the screen yet, or the same workspace again
+        self.assertFalse(self.tracker.is_stale(RECT, 1, probe(0), THRESHOLD))
+        self.tracker.captured(RECT, 1, probe(0))
+        self.assertFalse(self.tracker.is_stale(RECT, 1, probe(0), THRESHOLD))
+
+        # The screen moved on from workspace 1
+        self.assertFalse(
+            self.tracker.is_stale(RECT, 2, probe(100), THRESHOLD))
+
+    def test_unseen_workspace_that_looks_like_the_previous_one(self):
+        self.tracker.captured(RECT, 1, probe(0))
+        self.assertTrue(self.tracker.is_stale(RECT, 2, probe(0), THRESHOLD))
+
+    def test_workspace_that_looks_like_the_previous_one(self):
+        self.tracker.captured(RECT, 2, probe(0))
+        self.tracker.captured(RECT, 1, probe(0))
+        self.assertFalse(self.tracker.is_stale(RECT, 2, probe(0), THRESHOLD))
+
+    def test_forget(self):
+        self.tracker.learn(1, 0.2)
+        self.tracker.captured(RECT, 1, probe(0))
+        self.tracker.forget(1)
+
+        self.assertEqual(self.tracker.estimate(1), 0.0)
+        self.assertFalse(self.tracker.is_stale(RECT, 2, probe(0), THRESHOLD))
+
+    def test_stats(self):
+        self.assertEqual(self.tracker.stats()['median_delay_ms'], None)
+
+        for delay, result in [(0.1, 'settled'), (0.3, 'stale'),
+                              (0.2, 'settled'), (0.5, None)]:
+            self.tracker.record(delay, result)
+
+        stats = self.tracker.stats()
+        self.assertEqual(stats['captures'], 3)
+        self.assertAlmostEqual(stats['median_delay_ms'], 250)
+        self.assertAlmostEqual(stats['rates']['settled'], 2 / 3)
+        self.assertEqual(stats['rates']['torn'], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+from i3expo.state import StateStore
+
+import unittest
+
+
+class StateStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = StateStore()
+
+    def test_starts_empty(self):
+        snapshot = self.store.current()
+        self.assertEqual((snapshot.version, snapshot.active), (0, -1))
+        self.assertEqual(dict(snapshot.workspaces), {})
+
+    def test_update_creates_and_changes_records(self):
+        self.store.update(1, name='web')
+        snapshot = self.store.update(1, activate=True, state=42)
+
+        record = snapshot.workspaces[1]
+        self.assertEqual((record.num, record.name, record.state),
+                         (1, 'web', 42))
+        self.assertEqual(record.version, 2)
+        self.assertEqual((snapshot.version, snapshot.active), (2, 1))
+        self.assertIs(self.store.current(), snapshot)
+
+    def test_snapshots_do_not_change(self):
+        self.store.update(1, activate=True, name='web')
+        before = self.store.current()
+
+        self.store.update(2, activate=True, name='mail')
+        self.store.update(1, name='www')
+        self.store.remove([1])
+
+        self.assertEqual(before.active, 1)
+        self.assertEqual(list(before.workspaces), [1])
+        self.assertEqual(before.workspaces[1].name, 'web')
+        with self.assertRaises(TypeError):
+            before.workspaces[3] = None
+
+    def test_update_keeps_other_records(self):
+        self.store.update(1, name='web')
+        mail = self.store.update(2, name='mail').workspaces[2]
+
+        snapshot = self.store.update(1, state=7)
+        self.assertIs(snapshot.workspaces[2], mail)
+        self.assertEqual(snapshot.active, -1)
+
+    def test_remove(self):
+        for num in [1, 2]:
+            self.store.update(num, activate=True)
+        version = self.store.current().version
+
+        removed = self.store.remove([2, 3])
+        self.assertEqual([r.num for r in removed], [2])
+        self.assertEqual(list(self.store.current().workspaces), [1])
+        self.assertEqual(self.store.current().version, version + 1)
+
+        # Nothing to remove publishes nothing
+        self.assertEqual(self.store.remove([3]), [])
+        self.assertEqual(self.store.current().version, version + 1)
+
+    def test_clear(self):
+        self.store.update(1, activate=True)
+        self.store.clear()
+        snapshot = self.store.current()
+        self.assertEqual((dict(snapshot.workspaces), snapshot.active),
+                         ({}, -1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+from i3expo.damage import Rect
+from i3expo.geometry import Dimension
+from i3expo.thumbnails import ThumbnailStore, TILE, PREVIEW, lz4
+
+import unittest
+
+BLACK = (0, 0, 0)
+WHITE = (255, 255, 255)
+BLUE = (0, 0, 255)
+
+
+# A w x h capture in the layout of the X server, one BGRX pixel per color
+def frame(w, h, color):
+    r, g, b = color
+    return (w, h, bytearray(bytes([b, g, r, 0]) * (w * h)))
+
+
+def pixels(thumb):
+    w, h, data = thumb
+    data = bytes(data)
+    return [tuple(data[i:i + 3]) for i in range(0, w * h * 3, 3)]
+
+
+class ThumbnailStoreTest(unittest.TestCase):
+
+    def test_codecs_round_trip(self):
+        thumb = (2, 2, bytes(BLUE + WHITE + BLACK + BLUE))
+        codecs = [(compression, pixel_format)
+                  for compression in ['none', 'zlib', 'lz4']
+                  for pixel_format in ['rgb', 'rgb565']]
+
+        store = ThumbnailStore()
+        for codec in codecs:
+            if codec[0] == 'lz4' and lz4 is None:
+                continue
+            with self.subTest(codec=codec):
+                entry = store.encode(thumb, codec)
+                self.assertEqual(store.decode(entry, codec), thumb)
+
+    def test_put_stores_every_level(self):
+        store = ThumbnailStore('zlib', 'rgb565')
+        store.put(1, frame(4, 2, BLUE),
+                  {TILE: Dimension(2, 1), PREVIEW: Dimension(4, 2)})
+
+        self.assertEqual(pixels(store.get(1)), [BLUE] * 2)
+        self.assertEqual(pixels(store.get(1, PREVIEW)), [BLUE] * 8)
+        self.assertEqual(store.get_largest(1)[:2], (4, 2))
+        self.assertEqual(store.version(1), 1)
+        self.assertIsNone(store.get(2))
+
+    def test_configure_converts_stored_thumbnails(self):
+        store = ThumbnailStore()
+        store.put(1, frame(2, 2, WHITE), {TILE: Dimension(2, 2)})
+
+        store.configure('zlib', 'rgb565', 0)
+        codec, levels = store.export(1)
+        self.assertEqual(codec, ('zlib', 'rgb565'))
+        self.assertLess(len(levels[TILE][2]), 2 * 2 * 3)
+        self.assertEqual(pixels(store.get(1)), [WHITE] * 4)
+
+    def test_budget_evicts_the_least_recently_shown(self):
+        evicted = []
+        # Each workspace takes 12 bytes, two of them fit
+        store = ThumbnailStore(budget=24)
+        store.on_evict = evicted.append
+
+        for num in [1, 2]:
+            store.put(num, frame(2, 2, BLUE), {TILE: Dimension(2, 2)})
+        store.touch(1)
+        store.put(3, frame(2, 2, BLUE), {TILE: Dimension(2, 2)})
+
+        self.assertEqual(store.keys(), [1, 3])
+        self.assertEqual(evicted, [2])
+        self.assertEqual(store.stats['evictions'], 1)
+        self.assertEqual(store.total_bytes(), 24)
+
+    def test_budget_keeps_the_last_capture(self):
+        store = ThumbnailStore(budget=1)
+        store.put(1, frame(2, 2, BLUE), {TILE: Dimension(2, 2)})
+        store.put(2, frame(2, 2, BLUE), {TILE: Dimension(2, 2)})
+        self.assertEqual(store.keys(), [2])
+
+    def test_patch_pastes_the_region_into_every_level(self):
+        store = ThumbnailStore('zlib')
+        store.put(1, frame(4, 4, BLACK),
+                  {TILE: Dimension(2, 2), PREVIEW: Dimension(4, 4)})
+
+        self.assertTrue(store.patch(1, frame(2, 2, WHITE), Rect(2, 0, 2, 2),
+                                    (4, 4)))
+        self.assertEqual(pixels(store.get(1)), [BLACK, WHITE, BLACK, BLACK])
+        self.assertEqual(pixels(store.get(1, PREVIEW)),
+                         [BLACK, BLACK, WHITE, WHITE] * 2 + [BLACK] * 8)
+        self.assertEqual(store.version(1), 2)
+
+    def test_patch_needs_stored_thumbnails(self):
+        store = ThumbnailStore()
+        self.assertFalse(store.patch(1, frame(2, 2, WHITE), Rect(0, 0, 2, 2),
+                                     (4, 4)))
+
+    def test_restore_needs_the_same_codec(self):
+        store = ThumbnailStore()
+        store.put(1, frame(2, 2, BLUE), {TILE: Dimension(2, 2)})
+        codec, levels = store.export(1)
+
+        other = ThumbnailStore('zlib')
+        self.assertFalse(other.restore(1, codec, levels))
+        self.assertFalse(other.has(1))
+
+        other.configure(*codec, 0)
+        self.assertTrue(other.restore(1, codec, levels))
+        self.assertEqual(pixels(other.get(1)), [BLUE] * 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
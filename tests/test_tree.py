@@ -0,0 +1,174 @@
+from benchmarks.fakes import FakeI3, FakeRect, to_ipc
+from i3expo.tree import TreeModel
+
+from i3ipc import Con
+from i3ipc.events import WorkspaceEvent, WindowEvent
+
+import unittest
+
+
+# What a model knows, to compare it with one synced from the full tree
+def describe(model):
+    workspaces = {
+        ws_id: [(con.id, con.rect.x, con.rect.y, con.rect.width,
+                 con.rect.height, con.focused) for con in workspace.leaves()]
+        for ws_id, workspace in model.workspaces.items()}
+    return (model.focused, model.windows, workspaces)
+
+
+def digest(workspace):
+    return [(con.id, con.rect.x, con.rect.width, con.focused)
+            for con in workspace.leaves()]
+
+
+class TreeModelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.i3 = FakeI3(3, 1920, 1080)
+        self.model = TreeModel()
+        self.model.sync(self.tree())
+
+    def tree(self):
+        return Con(self.i3.ipc_tree(), None, None)
+
+    def synced(self):
+        model = TreeModel()
+        model.sync(self.tree())
+        return model
+
+    # Events go through their raw payloads, as the daemon receives them
+    def workspace_event(self, change, current, old=None):
+        return WorkspaceEvent({
+            'change': change,
+            'current': to_ipc(current) if current is not None else None,
+            'old': to_ipc(old) if old is not None else None
+        }, None)
+
+    def window_event(self, change, con):
+        return WindowEvent({
+            'change': change,
+            'container': to_ipc(con)
+        }, None)
+
+    def send(self, e):
+        if isinstance(e, WorkspaceEvent):
+            self.model.on_workspace(e)
+        else:
+            self.model.on_window(e)
+
+    def assertMatchesTree(self):
+        self.assertEqual(describe(self.model), describe(self.synced()))
+        self.assertFalse(self.model.is_stale(every=True))
+
+    def test_sync(self):
+        self.assertEqual(self.model.focused, 1)
+        self.assertEqual(self.model.windows[2001], 2)
+        self.assertEqual([w.num for w in self.model.get_workspaces()],
+                         [1, 2, 3])
+        self.assertFalse(self.model.is_stale(every=True))
+
+    def test_workspace_focus_replaces_both_workspaces(self):
+        e = self.i3.focus(2)
+        self.send(self.workspace_event(e.change, e.current, e.old))
+        self.assertMatchesTree()
+        self.assertEqual(self.model.focused_workspace().num, 2)
+
+    def test_window_focus_moves_the_focused_window(self):
+        e = self.i3.focus_window(3, 3002)
+        self.send(self.window_event(e.change, e.container))
+        self.assertMatchesTree()
+        self.assertEqual(self.model.focused, 3)
+
+    def test_init_adds_the_workspace(self):
+        self.i3.workspace_nums.append(4)
+        self.send(self.workspace_event('init', self.i3.build_workspace(4)))
+        self.assertMatchesTree()
+
+    def test_empty_drops_the_workspace(self):
+        workspace = self.i3.build_workspace(3)
+        self.i3.workspace_nums.remove(3)
+        self.send(self.workspace_event('empty', workspace))
+        self.assertMatchesTree()
+        self.assertNotIn(3001, self.model.windows)
+
+    def test_focus_from_an_empty_workspace(self):
+        workspace = self.i3.build_workspace(3)
+        self.i3.workspace_nums.remove(3)
+        self.send(self.workspace_event('empty', workspace))
+
+        # The workspace that lost focus is gone and must not come back
+        e = self.i3.focus(1)
+        self.send(self.workspace_event(e.change, e.current, workspace))
+        self.assertMatchesTree()
+
+    def test_reload_and_restored_invalidate(self):
+        for change in ['reload', 'restored']:
+            self.send(self.workspace_event(change, None))
+            self.assertTrue(self.model.is_stale())
+
+            self.model.sync(self.tree())
+            self.assertMatchesTree()
+
+    def test_new_window_dirties_every_workspace(self):
+        e = self.i3.open_window(2, 2010)
+        self.send(self.window_event(e.change, e.container))
+        self.assertEqual(self.model.dirty, {1, 2, 3})
+        self.assertTrue(self.model.is_stale())
+
+        self.model.sync(self.tree())
+        self.assertMatchesTree()
+        self.assertEqual(self.model.windows[2010], 2)
+
+    def test_move_dirties_every_workspace(self):
+        con = self.i3.build_workspace(1).leaves()[1]
+        self.i3.layouts[1] = self.i3.layout(1)[:1] + self.i3.layout(1)[2:]
+        self.i3.layouts[3] = self.i3.layout(3) + [(con.id, con.rect)]
+        self.send(self.window_event('move', con))
+        self.assertEqual(self.model.dirty, {1, 2, 3})
+
+        self.model.sync(self.tree())
+        self.assertMatchesTree()
+        self.assertEqual(self.model.windows[con.id], 3)
+
+    def test_close_dirties_its_workspace(self):
+        con = self.i3.build_workspace(2).leaves()[0]
+        self.i3.layouts[2] = self.i3.layout(2)[1:]
+        self.send(self.window_event('close', con))
+        self.assertEqual(self.model.dirty, {2})
+        self.assertNotIn(con.id, self.model.windows)
+        self.assertFalse(self.model.is_stale())
+        self.assertTrue(self.model.is_stale(every=True))
+
+        self.model.sync(self.tree())
+        self.assertMatchesTree()
+
+    def test_floating_dirties_its_workspace(self):
+        con = self.i3.build_workspace(1).leaves()[0]
+        self.send(self.window_event('floating', con))
+        self.assertEqual(self.model.dirty, {1})
+        self.assertTrue(self.model.is_stale())
+
+    def test_title_changes_nothing(self):
+        con = self.i3.build_workspace(1).leaves()[0]
+        self.send(self.window_event('title', con))
+        self.assertMatchesTree()
+
+    def test_diverged(self):
+        self.assertEqual(self.model.diverged(self.tree(), digest), [])
+
+        # A resize i3 did not report
+        self.i3.layouts[2] = [(2000, FakeRect(0, 0, 1920, 1080))]
+        self.assertEqual(self.model.diverged(self.tree(), digest), [2])
+        self.assertEqual(self.model.stats['divergences'], 1)
+
+        # Dirty workspaces are known to differ
+        self.model.dirty.add(2)
+        self.assertEqual(self.model.diverged(self.tree(), digest), [])
+
+    def test_diverged_reports_missing_and_unknown_workspaces(self):
+        self.i3.workspace_nums = [1, 2, 4]
+        self.assertEqual(self.model.diverged(self.tree(), digest), [3, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()